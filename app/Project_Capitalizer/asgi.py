@@ -0,0 +1,18 @@
+"""
+ASGI config for Project_Capitalizer project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with an ASGI server, e.g. gunicorn with uvicorn workers (see docker-compose.asgi.yml).
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+"""
+
+import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault(
+    'DJANGO_SETTINGS_MODULE',
+    'Project_Capitalizer.settings')
+
+application = get_asgi_application()
@@ -60,7 +60,13 @@ REST_AUTH_SERIALIZERS = {
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ],
+    # orjson is opt-in: it is not in requirements.txt, as the Alpine images cannot install its wheels and would need Rust
+    # to build it. Install it to encode JSON with it (see api.renderers.FastJSONRenderer); without it JSONRenderer is used.
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 500,
@@ -73,6 +79,9 @@ CORS_ORIGIN_ALLOW_ALL = True
 # Middleware framework
 # https://docs.djangoproject.com/en/2.1/topics/http/middleware/
 MIDDLEWARE = [
+    'api.middleware.AsgiConnectionMiddleware',
+    'api.middleware.RequestTimingMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -107,17 +116,84 @@ WSGI_APPLICATION = 'Project_Capitalizer.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
+# Django's SQLite and PostgreSQL backends are replaced by those of api.backends, which add health checks, pooling and
+# connection metrics. Connections are kept for SQL_CONN_MAX_AGE seconds; SQL_POOL_SIZE > 0 enables the pool (see api.backends.pool).
+# SQL_CONN_MAX_AGE must be 0 under ASGI, where sync views run on a thread pool and every thread would otherwise keep
+# a connection open: docker-compose.asgi.yml sets it, with SQL_POOL_SIZE to reuse connections across those threads.
+MANAGED_ENGINES = {
+    "django.db.backends.sqlite3": "api.backends.sqlite3",
+    "django.db.backends.postgresql": "api.backends.postgresql",
+    "django.db.backends.postgresql_psycopg2": "api.backends.postgresql",
+}
+SQL_ENGINE = os.environ.get("SQL_ENGINE", "django.db.backends.sqlite3")
+
 DATABASES = {
     "default": {
-        "ENGINE": os.environ.get("SQL_ENGINE", "django.db.backends.sqlite3"),
+        "ENGINE": MANAGED_ENGINES.get(SQL_ENGINE, SQL_ENGINE),
         "NAME": os.environ.get("SQL_DATABASE", os.path.join(BASE_DIR, "db.sqlite3")),
         "USER": os.environ.get("SQL_USER", "user"),
         "PASSWORD": os.environ.get("SQL_PASSWORD", "password"),
         "HOST": os.environ.get("SQL_HOST", "localhost"),
         "PORT": os.environ.get("SQL_PORT", "5432"),
+        "CONN_MAX_AGE": int(os.environ.get("SQL_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": bool(int(os.environ.get("SQL_CONN_HEALTH_CHECKS", 1))),
+        "POOL_SIZE": int(os.environ.get("SQL_POOL_SIZE", 0)),
+        "POOL_TIMEOUT": float(os.environ.get("SQL_POOL_TIMEOUT", 10)),
+    }
+}
+
+# Read replicas, as a comma-separated SQL_REPLICAS list of 'host[:port]' for PostgreSQL or of database files for SQLite.
+# They get the other settings of the primary, and serve the reads of safe requests (see api.routers).
+# A client is pinned to the primary for SQL_REPLICA_STICKY_SECONDS after a write, in the 'default' cache, which must be
+# shared by the workers (see CACHES; check warning api.W001); a replica that refuses connections is skipped for SQL_REPLICA_RETRY_SECONDS.
+for number, replica in enumerate(filter(None, os.environ.get("SQL_REPLICAS", "").split(",")), 1):
+    if DATABASES["default"]["ENGINE"].endswith("sqlite3"):
+        location = {"NAME": replica.strip()}
+    else:
+        host, _, port = replica.strip().partition(":")
+        location = {"HOST": host, "PORT": port or DATABASES["default"]["PORT"]}
+    # The test runner creates no test databases for replicas; run the tests without SQL_REPLICAS
+    DATABASES["replica%d" % number] = dict(DATABASES["default"], TEST={"MIRROR": "default"}, **location)
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["api.routers.ReplicaRouter"] if DATABASE_REPLICAS else []
+REPLICA_STICKY_SECONDS = int(os.environ.get("SQL_REPLICA_STICKY_SECONDS", 10))
+REPLICA_RETRY_SECONDS = int(os.environ.get("SQL_REPLICA_RETRY_SECONDS", 30))
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# Local memory by default, which is per process: with several workers, set CACHE_BACKEND and CACHE_LOCATION to a shared
+# cache (e.g. django.core.cache.backends.memcached.MemcachedCache) so that they share cached responses, primary pins
+# and token revocations.
+# Cached responses are keyed on the data version in the database, so writes from any process invalidate them either way.
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
     }
 }
 
+# Cache and lifetime in seconds of cached API responses (see api.cache). Set API_RESPONSE_CACHE_TIMEOUT to 0 to disable.
+API_RESPONSE_CACHE = os.environ.get("API_RESPONSE_CACHE", "default")
+API_RESPONSE_CACHE_TIMEOUT = int(os.environ.get("API_RESPONSE_CACHE_TIMEOUT", 300))
+
+# Size and lifetime in seconds of each worker's token authentication cache (see api.authentication), and the cache
+# that revocations are announced through. Unless that cache is shared (see CACHES), a revoked token may be accepted by
+# other workers for up to TOKEN_CACHE_TIMEOUT seconds; 0 disables the cache.
+TOKEN_CACHE = os.environ.get("TOKEN_CACHE", "default")
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_TIMEOUT = int(os.environ.get("TOKEN_CACHE_TIMEOUT", 5))
+
+# Per-request timings (see api.middleware): a Server-Timing header for 'staff' users, on 'all' responses or 'off',
+# and one JSON log line per request on the 'api.timing' logger if REQUEST_TIMING_LOG is 1. Both off unloads the middleware.
+REQUEST_TIMING_HEADER = os.environ.get("REQUEST_TIMING_HEADER", "staff")
+REQUEST_TIMING_LOG = bool(int(os.environ.get("REQUEST_TIMING_LOG", 0)))
+
+# Prometheus metrics (see api.metrics) at /metrics. Set METRICS_TOKEN to require 'Authorization: Bearer <token>' from scrapers;
+# without it, /metrics is only served to requests from loopback or private addresses that did not pass through a proxy.
+REQUEST_METRICS = bool(int(os.environ.get("REQUEST_METRICS", 1)))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -164,17 +240,30 @@ logging.config.dictConfig({
         'console': {
             'format': '%(asctime)s %(levelname)s [%(name)s:%(lineno)s] %(module)s %(process)d %(thread)d %(message)s',
         },
+        # Messages that are already JSON, one per line
+        'json': {
+            'format': '%(message)s',
+        },
     },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
             'formatter': 'console',
         },
+        'json': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
     },
     'loggers': {
         '': {
             'level': LOGLEVEL,
             'handlers': ['console',],
         },
+        'api.timing': {
+            'level': 'INFO',
+            'handlers': ['json',],
+            'propagate': False,
+        },
     },
 })
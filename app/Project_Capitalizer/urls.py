@@ -20,8 +20,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from api import views as api_views
+
 urlpatterns = [
     # Uncomment the next line to enable the admin:
     path('admin/', admin.site.urls),
     path('api/v1/', include('api.urls')),
+    path('metrics', api_views.metrics, name='metrics'),
 ]
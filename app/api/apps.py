@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class apiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        # Connect signal handlers
+        from . import signals
+        from .routers import check_primary_pins
+        checks.register(check_primary_pins)
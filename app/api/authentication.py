@@ -0,0 +1,153 @@
+"""
+Token authentication with an in-process cache of token -> user lookups.
+
+Every authenticated request would otherwise join Token and PCUser before the view runs. The cache is a bounded LRU
+with a time to live, per worker process. The handlers in api.signals revoke a token when it is deleted (logout)
+and every token of a user when the user is saved or deleted (e.g. deactivated). A revocation evicts the entries
+in this process and changes a generation key in a Django cache (settings.TOKEN_CACHE), which every hit is checked
+against. With a shared cache, other workers thus stop accepting a revoked token at once; with the default local
+memory cache they may accept it for up to TOKEN_CACHE_TIMEOUT seconds, so keep the timeout short.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+
+from . import metrics
+
+GENERATION_KEY = 'api.token_generation'
+
+class TokenCache:
+    """
+    Least recently used cache of (user id, database, token field values, user field values) by token key, with a time to live.
+    Entries cached at another revocation generation are misses.
+    """
+    def __init__(self, size=None, timeout=None, alias=None):
+        self._size = size
+        self._timeout = timeout
+        self.alias = alias
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._size if self._size is not None else getattr(settings, 'TOKEN_CACHE_SIZE', 10000)
+
+    @property
+    def timeout(self):
+        return self._timeout if self._timeout is not None else getattr(settings, 'TOKEN_CACHE_TIMEOUT', 5)
+
+    @property
+    def shared(self):
+        return caches[self.alias or getattr(settings, 'TOKEN_CACHE', 'default')]
+
+    def generation(self):
+        """
+        Returns the current revocation generation. A lost key starts a new generation, so that it cannot bring
+        back entries cached before a revocation.
+        """
+        generation = self.shared.get(GENERATION_KEY)
+        if generation is None:
+            self.shared.add(GENERATION_KEY, uuid.uuid4().hex, None)
+            generation = self.shared.get(GENERATION_KEY)
+        return generation
+
+    def get(self, key, generation=None):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now and (generation is None or entry[2] == generation):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                metrics.TOKEN_CACHE_HITS.inc()
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            metrics.TOKEN_CACHE_MISSES.inc()
+            return None
+
+    def set(self, key, value, generation=None):
+        if self.timeout <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.timeout, value, generation)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def evict(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def evict_user(self, user_id):
+        with self.lock:
+            for key in [key for key, (expires, value, generation) in self.entries.items() if value[0] == user_id]:
+                del self.entries[key]
+
+    def revoke(self, key=None, user_id=None):
+        """
+        Evicts a token, or every token of a user, in this process, and starts a new generation so that every process
+        drops its cached tokens. Starts another one when the transaction commits, in case a token was cached again
+        from the uncommitted state.
+        """
+        if key is not None:
+            self.evict(key)
+        if user_id is not None:
+            self.evict_user(user_id)
+        shared = self.shared
+        shared.set(GENERATION_KEY, uuid.uuid4().hex, None)
+        transaction.on_commit(lambda: shared.set(GENERATION_KEY, uuid.uuid4().hex, None))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns this process's hit and miss counts, the hit ratio and the number of cached tokens.
+        """
+        with self.lock:
+            hits, misses, size = self.hits, self.misses, len(self.entries)
+        return {'hits': hits, 'misses': misses, 'hit_ratio': hits / (hits + misses) if hits + misses else None, 'size': size}
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+token_cache = TokenCache()
+
+def field_values(instance):
+    return tuple(getattr(instance, field.attname) for field in instance._meta.concrete_fields)
+
+def from_values(model, db, values):
+    return model.from_db(db, [field.attname for field in model._meta.concrete_fields], values)
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that caches successful lookups in token_cache. Failed lookups (unknown token, inactive user)
+    are not cached and fail exactly as in TokenAuthentication. Each request gets its own user and token instances.
+    """
+    def authenticate_credentials(self, key):
+        # Read before the lookup, so that a revocation during it is not missed
+        generation = token_cache.generation()
+        entry = token_cache.get(key, generation)
+        if entry is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, (user.pk, token._state.db, field_values(token), field_values(user)), generation)
+            return user, token
+
+        user_id, db, token_values, user_values = entry
+        user = from_values(get_user_model(), db, user_values)
+        token = from_values(self.get_model(), db, token_values)
+        token.user = user
+        return user, token
@@ -0,0 +1,218 @@
+"""
+Database connection management shared by the backends in api.backends: health checks before a connection is reused,
+an optional in-process pool and connection metrics.
+
+Django keeps one connection per thread, for CONN_MAX_AGE seconds (SQL_CONN_MAX_AGE). Extra DATABASES settings:
+- CONN_HEALTH_CHECKS: run 'SELECT 1' on a persistent connection before its first query in each request,
+  and on a pooled connection before handing it out, replacing it if the server closed it
+- POOL_SIZE: keep at most this many connections open per process and reuse them across threads. 0 disables the pool:
+  connections are then opened and closed by Django as usual, but still counted
+- POOL_TIMEOUT: seconds to wait for a connection when POOL_SIZE are in use, before raising PoolTimeout
+
+A pool only helps when a process runs more threads than it should hold connections, as with the ASGI deployment.
+Set CONN_MAX_AGE to 0 with it, so that every request returns its connection at the end. Under ASGI the connections
+are released on the thread that ran the view by api.middleware.AsgiConnectionMiddleware.
+"""
+import threading
+import time
+from collections import deque
+
+from django.db import connections
+from django.db.utils import OperationalError
+
+class PoolTimeout(OperationalError):
+    """
+    Raised when no pooled connection became free within POOL_TIMEOUT seconds.
+    """
+
+def ping(connection):
+    """
+    Returns whether a DB-API connection still answers a query.
+    """
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+    # Each driver raises its own error classes, e.g. for a connection the server closed
+    except Exception:
+        return False
+    return True
+
+class ConnectionPool:
+    """
+    Bounded set of open DB-API connections of one database, shared by the threads of a process, with usage counts.
+    """
+    def __init__(self, size=0, timeout=10, health_checks=True):
+        self.size = size
+        self.timeout = timeout
+        self.health_checks = health_checks
+        self.idle = deque()
+        self.open = 0
+        self.in_use = 0
+        self.created = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.lock = threading.Condition()
+
+    def acquire(self, connect):
+        """
+        Returns an idle connection that passes the health check, or a new one from 'connect'
+        if fewer than 'size' are open. Otherwise waits for one to be released.
+        """
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            with self.lock:
+                while not self.idle and self.size and self.open >= self.size:
+                    if not waited:
+                        self.waits += 1
+                        waited = True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout('No database connection became free within %s seconds (%d in use)' % (self.timeout, self.in_use))
+                    self.lock.wait(remaining)
+                self.in_use += 1
+                if self.idle:
+                    connection = self.idle.pop()
+                else:
+                    # Reserve the slot, then connect without holding the lock
+                    connection = None
+                    self.open += 1
+
+            if connection is None:
+                try:
+                    connection = connect()
+                except Exception:
+                    with self.lock:
+                        self.open -= 1
+                        self.in_use -= 1
+                        self.lock.notify()
+                    raise
+                with self.lock:
+                    self.created += 1
+                return connection
+
+            if not self.health_checks or ping(connection):
+                return connection
+            with self.lock:
+                self.in_use -= 1
+                self.reconnects += 1
+                self.discard(connection)
+
+    def release(self, connection, discard=False):
+        """
+        Returns a connection to the pool, rolling back any transaction left open, or closes it if 'discard'
+        is set, the pool is disabled or the rollback fails.
+        """
+        if self.size and not discard:
+            try:
+                connection.rollback()
+            except Exception:
+                discard = True
+        with self.lock:
+            self.in_use -= 1
+            if self.size and not discard:
+                self.idle.append(connection)
+            else:
+                self.discard(connection)
+            self.lock.notify()
+
+    def discard(self, connection):
+        # Called with the lock held
+        self.open -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def record_reconnect(self):
+        with self.lock:
+            self.reconnects += 1
+
+    def stats(self):
+        """
+        Returns the number of open, in use and idle connections, and counts of connections created,
+        waits for a free connection, waits that timed out and connections replaced after a failed health check.
+        """
+        with self.lock:
+            return {
+                'size': self.size, 'open': self.open, 'in_use': self.in_use, 'idle': len(self.idle),
+                'created': self.created, 'waits': self.waits, 'timeouts': self.timeouts, 'reconnects': self.reconnects,
+            }
+
+pools = {}
+pools_lock = threading.Lock()
+
+def get_pool(alias, settings_dict):
+    """
+    Returns the pool of a database alias, creating it from the alias's settings.
+    Databases are told apart by name too, so that the test databases get pools of their own.
+    """
+    key = (alias, settings_dict['NAME'], settings_dict['HOST'], settings_dict['PORT'])
+    with pools_lock:
+        pool = pools.get(key)
+        if pool is None:
+            pool = pools[key] = ConnectionPool(
+                settings_dict.get('POOL_SIZE', 0), settings_dict.get('POOL_TIMEOUT', 10), settings_dict.get('CONN_HEALTH_CHECKS', False))
+        return pool
+
+def pool_stats():
+    """
+    Returns the stats of this process's pool of each database whose backend is from api.backends, by alias.
+    """
+    return {alias: connections[alias].pool.stats() for alias in connections if isinstance(connections[alias], ManagedConnectionMixin)}
+
+class ManagedConnectionMixin:
+    """
+    Mixin for a Django DatabaseWrapper that gets its connections from a ConnectionPool and checks the health
+    of a persistent connection before it is reused by a new request.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+        self.discard_connection = False
+
+    @property
+    def health_checks(self):
+        return self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        return self.pool.acquire(lambda: super(ManagedConnectionMixin, self).get_new_connection(conn_params))
+
+    def connect(self):
+        super().connect()
+        # A new or pooled connection has just been checked
+        self.health_check_done = True
+
+    def _close(self):
+        # Django keeps a connection closed in an atomic block until the block exits, so it must not be handed out again
+        discard = self.discard_connection or self.errors_occurred or self.in_atomic_block
+        self.discard_connection = False
+        with self.wrap_database_errors:
+            self.pool.release(self.connection, discard)
+
+    def close_if_unusable_or_obsolete(self):
+        # Called when a request starts and finishes: check the connection again before the next query
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def close_if_health_check_failed(self):
+        if self.connection is None or not self.health_checks or self.health_check_done or self.in_atomic_block:
+            return
+        if not ping(self.connection):
+            self.discard_connection = True
+            self.close()
+            self.pool.record_reconnect()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
@@ -0,0 +1,8 @@
+from django.db.backends.postgresql import base
+
+from ..pool import ManagedConnectionMixin
+
+class DatabaseWrapper(ManagedConnectionMixin, base.DatabaseWrapper):
+    """
+    Django's PostgreSQL backend with the connection management of api.backends.pool.
+    """
@@ -0,0 +1,8 @@
+from django.db.backends.sqlite3 import base
+
+from ..pool import ManagedConnectionMixin
+
+class DatabaseWrapper(ManagedConnectionMixin, base.DatabaseWrapper):
+    """
+    Django's SQLite backend with the connection management of api.backends.pool.
+    """
@@ -0,0 +1,426 @@
+"""
+Micro-benchmarks for the api app.
+
+Run them with 'python manage.py benchmark [name ...]'. Every benchmark runs inside a rolled back
+transaction on a throwaway test database, so real data is never touched.
+A benchmark returns a list of result rows: {'benchmark': ..., 'case': ..., 'size': ..., 'seconds': ...},
+optionally with the size of the output in 'bytes'. Request benchmarks also report the 'p50', 'p95' and 'p99'
+latencies and the 'queries' per request. Use --report to save the results as JSON and --compare to check a run
+against a saved report, e.g. before and after a change, on SQLite or PostgreSQL.
+"""
+import json
+import math
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import msgpack
+import numpy as np
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .authentication import token_cache
+from .columnar import PRICE_COLUMNS, price_columns
+from .ingest import PRICE_FIELDS, sync_derived_tables
+from .models import PCUser, Stock, StockPrice, TradingDay
+from .pagination import KeysetPagination
+from .partitioning import partition_table
+from .renderers import FastJSONRenderer, MsgpackRenderer, orjson
+from .serializers import StockPriceSerializer, StockSerializer, row_serializer
+from .utils import batch_suggestions, suggestions_from_rows
+
+BENCHMARKS = {}
+
+def benchmark(func):
+    """
+    Registers func under its name so the benchmark command can run it.
+    """
+    BENCHMARKS[func.__name__] = func
+    return func
+
+def median_time(func, repeat=5):
+    """
+    Calls func 'repeat' times and returns the median wall time in seconds.
+    """
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of 'values', e.g. fraction 0.95 for the 95th percentile.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def load_prices(stock_count, first_day, last_day, start=date(2000, 1, 3)):
+    """
+    Bulk loads one price per stock for each day in [first_day, last_day), creating the stocks if needed.
+    Bulk loads bypass model signals, so callers must rebuild derived tables themselves.
+    """
+    stocks = [Stock(name='Stock %d' % i, symbol='S%05d' % i, category='Cat%d' % (i % 10)) for i in range(stock_count)]
+    Stock.objects.bulk_create(stocks, ignore_conflicts=True)
+
+    # Insert a chunk of days at a time so memory stays bounded for large loads
+    for chunk_start in range(first_day, last_day, 100):
+        prices = []
+        for day in range(chunk_start, min(chunk_start + 100, last_day)):
+            for i, stock in enumerate(stocks):
+                price = Decimal(10 + (day * 7 + i * 13) % 90)
+                prices.append(StockPrice(stock=stock, date=start + timedelta(days=day), predicted_closing_price=price,
+                                         actual_closing_price=price, opening_price=price))
+        StockPrice.objects.bulk_create(prices)
+
+@benchmark
+def trading_calendar(stock_count=20, day_counts=(250, 1000, 4000)):
+    """
+    'Latest 5 dates' and 'previous date' lookups: SELECT DISTINCT over StockPrice vs the TradingDay calendar.
+    """
+    results = []
+    loaded = 0
+    for day_count in day_counts:
+        load_prices(stock_count, loaded, day_count)
+        TradingDay.objects.rebuild()
+        loaded = day_count
+        target = TradingDay.objects.latest_dates(1)[0]
+        size = stock_count * day_count
+
+        def distinct_latest():
+            return [row['date'] for row in StockPrice.objects.values('date').distinct().order_by('-date')][:5]
+
+        def distinct_previous():
+            dates = [row['date'] for row in StockPrice.objects.values('date').distinct().order_by('-date')]
+            return dates[dates.index(target) + 1]
+
+        cases = [
+            ('distinct latest 5', distinct_latest),
+            ('calendar latest 5', lambda: TradingDay.objects.latest_dates(5)),
+            ('distinct previous date', distinct_previous),
+            ('calendar previous date', lambda: TradingDay.objects.previous_date(target)),
+        ]
+        for case, func in cases:
+            results.append({'benchmark': 'trading_calendar', 'case': case, 'size': size, 'seconds': median_time(func)})
+    return results
+
+def legacy_suggestions(rows, sellThreshold=-0.05, buyThreshold=0.05):
+    """
+    The per-row Decimal loop that suggestions_from_rows replaced, kept as a baseline.
+    """
+    suggestions = []
+    for stockSymbol, predicted_closing, before_closing in rows:
+        if predicted_closing == None or before_closing == None:
+            suggestions.append({'stock': stockSymbol, 'action': 'unknown', 'percent_change': None})
+            continue
+        percentchange = (predicted_closing - before_closing) / before_closing
+        if percentchange > buyThreshold:
+            action = 'buy'
+        elif percentchange < sellThreshold:
+            action = 'sell'
+        else:
+            action = 'hold'
+        suggestions.append({'stock': stockSymbol, 'action': action, 'percent_change': percentchange})
+    return suggestions
+
+@benchmark
+def suggestion_engine(stock_count=10000):
+    """
+    Suggestions for the whole universe: the per-row Decimal loop vs the vectorized batch engine.
+    """
+    rows = [('S%05d' % i, Decimal(1000 + (i * 37) % 200) / 100, Decimal(1000 + (i * 53) % 200) / 100) for i in range(stock_count)]
+    predicted = np.array([row[1] for row in rows], dtype=float)
+    previous = np.array([row[2] for row in rows], dtype=float)
+    return [
+        {'benchmark': 'suggestion_engine', 'case': 'decimal loop', 'size': stock_count, 'seconds': median_time(lambda: legacy_suggestions(rows))},
+        {'benchmark': 'suggestion_engine', 'case': 'batch engine', 'size': stock_count, 'seconds': median_time(lambda: suggestions_from_rows(rows))},
+        {'benchmark': 'suggestion_engine', 'case': 'batch engine, float columns', 'size': stock_count, 'seconds': median_time(lambda: batch_suggestions(previous, predicted))},
+    ]
+
+@benchmark
+def price_pagination(stock_count=100, day_count=1000, page_size=500, depths=(1, 20, 190)):
+    """
+    Fetching a page of the price list at increasing depths: COUNT plus OFFSET vs keyset on (date, id).
+    """
+    load_prices(stock_count, 0, day_count)
+    queryset = StockPrice.objects.all()
+    paginator = KeysetPagination()
+    paginator.ordering = ('date', 'id')
+    size = stock_count * day_count
+
+    results = []
+    for depth in depths:
+        offset = (depth - 1) * page_size
+        last = queryset.order_by('date', 'id').values_list('date', 'id')[offset - 1] if offset else None
+
+        def offset_page():
+            queryset.count()
+            return list(queryset.order_by('date', 'id')[offset:offset + page_size])
+
+        def keyset_page():
+            page = queryset.order_by('date', 'id')
+            if last is not None:
+                page = page.filter(paginator.keyset_filter(list(last), 'gt'))
+            return list(page[:page_size])
+
+        results.append({'benchmark': 'price_pagination', 'case': 'offset page %d' % depth, 'size': size, 'seconds': median_time(offset_page)})
+        results.append({'benchmark': 'price_pagination', 'case': 'keyset page %d' % depth, 'size': size, 'seconds': median_time(keyset_page)})
+    return results
+
+def drop_indexes(model):
+    """
+    Drops every secondary index and unique constraint on model's table, leaving only the primary key.
+    Only for use inside a transaction that is rolled back.
+    """
+    table = model._meta.db_table
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for name, info in connection.introspection.get_constraints(cursor, table).items():
+            if info['primary_key']:
+                continue
+            if info['index']:
+                cursor.execute('DROP INDEX %s' % quote(name))
+            elif info['unique']:
+                cursor.execute('ALTER TABLE %s DROP CONSTRAINT %s' % (quote(table), quote(name)))
+
+@benchmark
+def price_indexes(stock_count=500, day_count=2000):
+    """
+    The hot stock price queries on a million rows, with the (stock, date) and (date, id) indexes and without any.
+    """
+    load_prices(stock_count, 0, day_count)
+    TradingDay.objects.rebuild()
+    recent_dates = TradingDay.objects.latest_dates(5)
+    size = stock_count * day_count
+
+    cases = [
+        ('prices on date', lambda: list(StockPrice.objects.filter(date=recent_dates[0]))),
+        ('recent=all', lambda: list(StockPrice.objects.filter(date__in=recent_dates).order_by('stock__category', 'stock__symbol', '-date'))),
+        ('recent=<symbol>', lambda: list(StockPrice.objects.filter(stock='S00250').order_by('-date')[:5])),
+    ]
+    results = []
+    for indexed in (True, False):
+        if not indexed:
+            drop_indexes(StockPrice)
+        for case, func in cases:
+            results.append({'benchmark': 'price_indexes', 'case': '%s, %s' % (case, 'indexed' if indexed else 'no index'), 'size': size, 'seconds': median_time(func)})
+    return results
+
+@benchmark
+def price_partitions(stock_count=500, day_count=2000):
+    """
+    Queries on recent dates with a plain and a monthly partitioned stock price table. PostgreSQL only.
+    For the 50M row comparison, run price_partitions(25000, 2000) from a shell against a scratch database.
+    """
+    if connection.vendor != 'postgresql':
+        return []
+    load_prices(stock_count, 0, day_count)
+    TradingDay.objects.rebuild()
+    recent_dates = TradingDay.objects.latest_dates(21)
+    size = stock_count * day_count
+
+    cases = [
+        ('prices on date', lambda: list(StockPrice.objects.filter(date=recent_dates[0]))),
+        ('recent=all', lambda: list(StockPrice.objects.filter(date__in=recent_dates[:5]).order_by('stock__category', 'stock__symbol', '-date'))),
+        ('last month', lambda: list(StockPrice.objects.filter(date__gte=recent_dates[-1]).values_list('stock_id', 'date', 'actual_closing_price'))),
+        ('recent=<symbol>', lambda: list(StockPrice.objects.filter(stock='S00250').order_by('-date')[:5])),
+    ]
+    results = []
+    for partitioned in (False, True):
+        if partitioned:
+            partition_table('month')
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE %s' % connection.ops.quote_name(StockPrice._meta.db_table))
+        for case, func in cases:
+            results.append({'benchmark': 'price_partitions', 'case': '%s, %s' % (case, 'partitioned' if partitioned else 'plain'), 'size': size, 'seconds': median_time(func)})
+    return results
+
+@benchmark
+def price_formats(stock_count=100, day_count=5):
+    """
+    Encoding and decoding a page of prices: serializer and JSON vs values_list, columns and MessagePack.
+    """
+    load_prices(stock_count, 0, day_count)
+    queryset = StockPrice.objects.order_by('date', 'id')
+    size = stock_count * day_count
+
+    def encode_json():
+        return JSONRenderer().render({'results': StockPriceSerializer(queryset, many=True).data})
+
+    def encode_columns():
+        return MsgpackRenderer().render({'results': price_columns(queryset.values_list(*PRICE_COLUMNS))})
+
+    encoded_json = encode_json()
+    encoded_columns = encode_columns()
+    return [
+        {'benchmark': 'price_formats', 'case': 'encode json', 'size': size, 'seconds': median_time(encode_json), 'bytes': len(encoded_json)},
+        {'benchmark': 'price_formats', 'case': 'encode msgpack columns', 'size': size, 'seconds': median_time(encode_columns), 'bytes': len(encoded_columns)},
+        {'benchmark': 'price_formats', 'case': 'decode json', 'size': size, 'seconds': median_time(lambda: json.loads(encoded_json))},
+        {'benchmark': 'price_formats', 'case': 'decode msgpack columns', 'size': size, 'seconds': median_time(lambda: msgpack.unpackb(encoded_columns, raw=False))},
+    ]
+
+@benchmark
+def list_serializers(stock_count=500, day_count=1, page_size=500):
+    """
+    Serializing a page of prices and of stocks, query included: model serializers vs row serializers.
+    """
+    load_prices(stock_count, 0, day_count)
+    prices = StockPrice.objects.order_by('date', 'id')[:page_size]
+    stocks = Stock.objects.with_price_summary().order_by('symbol')[:page_size]
+    price_rows = row_serializer(StockPriceSerializer)
+    stock_rows = row_serializer(StockSerializer)
+
+    cases = [
+        ('prices, serializer', lambda: StockPriceSerializer(prices, many=True).data),
+        ('prices, rows', lambda: price_rows.to_representation(prices.values_list(*price_rows.columns, named=True))),
+        ('stocks, serializer', lambda: StockSerializer(stocks, many=True).data),
+        ('stocks, rows', lambda: stock_rows.to_representation(stocks.values_list(*stock_rows.columns, named=True))),
+    ]
+    results = []
+    for case, func in cases:
+        seconds = median_time(func)
+        results.append({'benchmark': 'list_serializers', 'case': case, 'size': page_size, 'seconds': seconds, 'rows_per_second': page_size / seconds})
+    return results
+
+@benchmark
+def json_renderers(stock_count=500, day_count=1):
+    """
+    Rendering a page of prices and a day of suggestions as JSON: DRF's JSONRenderer vs FastJSONRenderer (with orjson if installed).
+    """
+    load_prices(stock_count, 0, day_count)
+    price_rows = row_serializer(StockPriceSerializer)
+    prices = {'next': None, 'previous': None, 'results': price_rows.to_representation(
+        StockPrice.objects.order_by('date', 'id').values_list(*price_rows.columns, named=True)[:stock_count])}
+    random.seed(0)
+    suggestions = {'suggestions': [{'stock': 'S%05d' % i, 'action': random.choice(['buy', 'sell', 'hold']), 'percent_change': random.gauss(0, 0.05)}
+                                   for i in range(stock_count)]}
+
+    renderers = [('JSONRenderer', JSONRenderer())]
+    if orjson is not None:
+        renderers.append(('FastJSONRenderer', FastJSONRenderer()))
+    results = []
+    for page, data in [('prices', prices), ('suggestions', suggestions)]:
+        for name, renderer in renderers:
+            seconds = median_time(lambda: renderer.render(data))
+            results.append({'benchmark': 'json_renderers', 'case': '%s, %s' % (page, name), 'size': stock_count, 'seconds': seconds,
+                            'rows_per_second': stock_count / seconds, 'bytes': len(renderer.render(data))})
+    return results
+
+def market_data(stock_count, day_count, seed=0, start=date(2020, 1, 6)):
+    """
+    Generates synthetic daily bars for 'stock_count' stocks over 'day_count' weekdays from 'start': a random walk
+    of closing prices with open, high, low, volume and a noisy prediction. The same arguments always give the same data.
+    Yields one list of price dicts per day, as accepted by the bulk price endpoint but with Decimal prices and date dates.
+    """
+    rng = random.Random(seed)
+    symbols = ['S%05d' % i for i in range(stock_count)]
+    closes = [rng.uniform(10, 500) for symbol in symbols]
+    day = start
+    for i in range(day_count):
+        while day.weekday() >= 5:
+            day += timedelta(days=1)
+        prices = []
+        for j, symbol in enumerate(symbols):
+            opening = closes[j] * (1 + rng.gauss(0, 0.005))
+            closes[j] = max(1.0, closes[j] * (1 + rng.gauss(0, 0.02)))
+            bar = {
+                'predicted_closing_price': closes[j] * (1 + rng.gauss(0, 0.03)),
+                'opening_price': opening,
+                'actual_closing_price': closes[j],
+                'daily_high': max(opening, closes[j]) * (1 + abs(rng.gauss(0, 0.01))),
+                'daily_low': min(opening, closes[j]) * (1 - abs(rng.gauss(0, 0.01))),
+            }
+            price = {'stock': symbol, 'date': day}
+            price.update((field, Decimal('%.2f' % value)) for field, value in bar.items())
+            price['volume'] = rng.randint(10000, 10000000)
+            prices.append(price)
+        yield prices
+        day += timedelta(days=1)
+
+def load_market_data(days, stock_count):
+    """
+    Bulk loads days of market_data with their stocks, trading calendar and suggestions.
+    """
+    Stock.objects.bulk_create([Stock(name='Stock %d' % i, symbol='S%05d' % i, category='Cat%d' % (i % 10)) for i in range(stock_count)])
+    dates = []
+    for prices in days:
+        StockPrice.objects.bulk_create([StockPrice(stock_id=price['stock'], **{field: price[field] for field in ['date'] + PRICE_FIELDS}) for price in prices])
+        dates.append(prices[0]['date'])
+    sync_derived_tables(dates)
+    return dates
+
+def as_json(prices):
+    return [{field: value if isinstance(value, int) else str(value) for field, value in price.items()} for price in prices]
+
+def measure_requests(client, name, requests, size):
+    """
+    Sends each request in turn and returns a result row with the latency percentiles, median queries and bytes per request.
+    Each request is a (method, url, data) tuple.
+    """
+    latencies = []
+    queries = []
+    sizes = []
+    for method, url, data in requests:
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            if method == 'post':
+                response = client.post(url, data, format='json')
+            else:
+                response = client.get(url)
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+            latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            raise RuntimeError('%s %s returned %d: %s' % (method.upper(), url, response.status_code, body[:200]))
+        queries.append(len(captured))
+        sizes.append(len(body))
+    return {
+        'benchmark': 'api_endpoints', 'case': name, 'size': size, 'seconds': percentile(latencies, 0.5),
+        'p50': percentile(latencies, 0.5), 'p95': percentile(latencies, 0.95), 'p99': percentile(latencies, 0.99),
+        'queries': statistics.median_low(queries), 'bytes': statistics.median_low(sizes),
+    }
+
+@benchmark
+def api_endpoints(stock_count=200, day_count=250, requests=100, seed=0):
+    """
+    Requests to each endpoint through the whole Django stack, on 'day_count' days of market_data for 'stock_count' stocks.
+    The response cache is disabled so that the views themselves are measured; token lookups are cached as in production.
+    """
+    # One more request per scenario than measured, to warm up e.g. the token cache and the database's caches
+    count = requests + 1
+    days = market_data(stock_count, day_count + count, seed)
+    dates = load_market_data((next(days) for i in range(day_count)), stock_count)
+    size = stock_count * day_count
+
+    user = PCUser.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+    token_cache.clear()
+
+    symbols = ['S%05d' % (i * 7919 % stock_count) for i in range(count)]
+    latest = dates[-1].isoformat()
+    scenarios = [
+        ('GET stock-price list', [('get', '/api/v1/stock-price/', None)] * count),
+        ('GET stock-price recent=all', [('get', '/api/v1/stock-price/?recent=all', None)] * count),
+        ('GET stock-price recent=<symbol>', [('get', '/api/v1/stock-price/?recent=%s' % symbol, None) for symbol in symbols]),
+        ('GET stock list', [('get', '/api/v1/stock/', None)] * count),
+        ('GET stock detail', [('get', '/api/v1/stock/%s' % symbol, None) for symbol in symbols]),
+        ('GET stock price history', [('get', '/api/v1/stock/%s/prices?interval=week' % symbol, None) for symbol in symbols]),
+        ('GET suggestion', [('get', '/api/v1/suggestion/?date=%s' % latest, None)] * count),
+        # Writes come last as they change the data the reads see; each writes a new day for every stock
+        ('POST stock-price bulk', [('post', '/api/v1/stock-price/bulk/', as_json(prices)) for prices in days]),
+    ]
+
+    results = []
+    # APIClient requests are for the 'testserver' host, as in the tests
+    with override_settings(API_RESPONSE_CACHE_TIMEOUT=0, ALLOWED_HOSTS=['testserver']):
+        for name, scenario in scenarios:
+            measure_requests(client, name, scenario[:1], size)
+            results.append(measure_requests(client, name, scenario[1:], size))
+    return results
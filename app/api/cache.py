@@ -0,0 +1,192 @@
+"""
+Server-side and HTTP caching for read endpoints whose responses are the same for every user between data loads.
+
+Entries are stored in a Django cache (settings.API_RESPONSE_CACHE, the 'default' cache unless set), so the backend
+is pluggable: local memory by default, or a shared cache such as memcached for multiple workers.
+Every key includes the version of the stock data, api.models.DataVersion, which every writer bumps in the database.
+A write from any process, such as the import_prices command, thus moves every process to new keys at once, and a
+cached response always belongs to the version its ETag is derived from.
+
+The interest -> stock symbols index used for personalized suggestions is kept in the same cache, keyed on the data
+version too: changes to interests bump it like changes to stocks do.
+
+Conditional GETs are answered from api.models.DataVersion: ETag and Last-Modified are derived from its change counter,
+so a client that already has the current data gets a 304 after one primary key lookup.
+"""
+import hashlib
+import threading
+from calendar import timegm
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import metrics
+from .models import DataVersion, Interest, Stock
+
+class ResponseCache:
+    """
+    Caches the data of successful API responses by request URI, and counts hits and misses in this process.
+    """
+    def __init__(self, alias=None, timeout=None, prefix='api.response'):
+        self.alias = alias
+        self.timeout = timeout
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias or getattr(settings, 'API_RESPONSE_CACHE', 'default')]
+
+    @property
+    def ttl(self):
+        return self.timeout if self.timeout is not None else getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', None)
+
+    def key(self, request, version, modified):
+        """
+        Returns the cache key for a request at a data version. The absolute URI covers the path and every query parameter,
+        including the page, and the negotiated media type covers formats whose data differ, such as the columnar price lists.
+        The time of the change tells versions apart if the counter starts again, e.g. after the database was recreated.
+        """
+        uri = hashlib.md5(('%s %s' % (request.build_absolute_uri(), request.accepted_media_type)).encode()).hexdigest()
+        return '%s.%d.%s.%s' % (self.prefix, version, modified.timestamp() if modified is not None else 0, uri)
+
+    def fetch(self, request, view):
+        """
+        Returns the cached response for 'request' at the current data version, or calls 'view' to build it and caches it
+        if it succeeded.
+        """
+        key = self.key(request, *data_version(request))
+        data = self.cache.get(key)
+        if data is not None:
+            self.count(hit=True)
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        self.count(hit=False)
+        response = view()
+        if response.status_code == status.HTTP_200_OK:
+            self.cache.set(key, response.data, self.ttl)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def count(self, hit):
+        (metrics.RESPONSE_CACHE_HITS if hit else metrics.RESPONSE_CACHE_MISSES).inc()
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """
+        Returns this process's hit and miss counts and the hit ratio.
+        """
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        return {'hits': hits, 'misses': misses, 'hit_ratio': hits / (hits + misses) if hits + misses else None}
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+response_cache = ResponseCache()
+
+def cache_response(view_func):
+    """
+    Caches the responses of a function-based API view in response_cache.
+    Apply it below @api_view and @permission_classes so that requests are authenticated and checked first.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        return response_cache.fetch(request, lambda: view_func(request, *args, **kwargs))
+    return wrapper
+
+INTEREST_SYMBOLS_KEY = 'api.interest_symbols'
+
+def interest_symbols(interest_ids, version):
+    """
+    Returns the sorted symbols of the stocks whose category is one of the interests with the given ids.
+    Reads a precomputed interest id -> symbols index for the (version, modified) data version, building it with
+    two queries if it is not cached.
+    """
+    cache = response_cache.cache
+    version, modified = version
+    key = '%s.%d.%s' % (INTEREST_SYMBOLS_KEY, version, modified.timestamp() if modified is not None else 0)
+    index = cache.get(key)
+    if index is None:
+        interests = dict(Interest.objects.values_list('interest', 'id'))
+        index = {}
+        for category, symbol in Stock.objects.filter(category__in=list(interests)).values_list('category', 'symbol'):
+            index.setdefault(interests[category], []).append(symbol)
+        cache.set(key, index, response_cache.ttl)
+    return sorted({symbol for interest_id in interest_ids for symbol in index.get(interest_id, ())})
+
+def interests_changed():
+    """
+    Records a change to interests, or to stocks written without signals: bumps the data version, which moves
+    every process to a new interest -> stock symbols index.
+    """
+    DataVersion.objects.bump()
+
+def stock_data_changed():
+    """
+    Records a change to stocks, stock prices or the tables derived from them: bumps the data version used
+    for conditional GETs and cached responses, in every process. Every writer must call it.
+    """
+    DataVersion.objects.bump()
+
+def data_version(request):
+    """
+    Returns the (version, modified) tuple of the stock data, read once per request so that the ETag
+    and the cached response of a request are for the same version.
+    """
+    if not hasattr(request, 'data_version'):
+        request.data_version = DataVersion.objects.current()
+    return request.data_version
+
+def conditional_get(request, view):
+    """
+    Answers a conditional GET with 304 Not Modified if the client's ETag or Last-Modified matches the current
+    data version, without calling 'view'. Otherwise calls 'view' and adds ETag and Last-Modified to its response.
+    """
+    version, modified = data_version(request)
+
+    # The response depends on the data, the URI (path, filters, page) and the negotiated format
+    representation = '%d %s %s' % (version, request.build_absolute_uri(), request.accepted_media_type)
+    etag = '"%s"' % hashlib.md5(representation.encode()).hexdigest()
+    last_modified = timegm(modified.utctimetuple()) if modified is not None else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    response = view()
+    if response.status_code == status.HTTP_200_OK:
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+    return response
+
+def conditional_response(view_func):
+    """
+    Answers conditional GETs to a function-based API view, see conditional_get.
+    Apply it below @api_view and @permission_classes so that requests are authenticated and checked first.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        return conditional_get(request, lambda: view_func(request, *args, **kwargs))
+    return wrapper
+
+class ConditionalGetMixin:
+    """
+    Answers conditional GETs to a generic API view, see conditional_get.
+    """
+    def get(self, request, *args, **kwargs):
+        return conditional_get(request, lambda: super(ConditionalGetMixin, self).get(request, *args, **kwargs))
@@ -0,0 +1,62 @@
+"""
+Columnar layout of stock prices for binary clients (see renderers.MsgpackRenderer).
+
+A page of prices is sent as parallel arrays instead of one object per row:
+- 'id', 'volume': integers
+- 'date': days since 1970-01-01
+- 'stock': indexes into 'symbols', the distinct stock symbols of the page
+- prices: integers scaled by 'price_scale' (cents), so no decimal strings need parsing
+Missing values are null in every column.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+from .ingest import PRICE_FIELDS
+
+# Columns read from the database, in the order of the rows passed to price_columns
+PRICE_COLUMNS = ['id', 'stock_id', 'date'] + PRICE_FIELDS
+
+DECIMAL_FIELDS = [field for field in PRICE_FIELDS if field != 'volume']
+
+# Prices are sent as integers in units of 10 ** -PRICE_PLACES
+PRICE_PLACES = 2
+
+EPOCH = date(1970, 1, 1)
+
+def price_columns(rows):
+    """
+    Builds the columnar layout from rows of PRICE_COLUMNS, e.g. from values_list(*PRICE_COLUMNS).
+    """
+    epoch = EPOCH.toordinal()
+    symbols = {}
+    columns = {field: [] for field in ['id', 'stock', 'date'] + PRICE_FIELDS}
+    ids, stocks, dates, volumes = columns['id'], columns['stock'], columns['date'], columns['volume']
+    prices = [columns[field] for field in DECIMAL_FIELDS]
+
+    for row in rows:
+        ids.append(row[0])
+        stocks.append(symbols.setdefault(row[1], len(symbols)))
+        dates.append(row[2].toordinal() - epoch)
+        # The decimal fields are followed by volume, the last of PRICE_FIELDS
+        for column, value in zip(prices, row[3:-1]):
+            column.append(None if value is None else int(value.scaleb(PRICE_PLACES)))
+        volumes.append(row[-1])
+
+    columns['symbols'] = list(symbols)
+    columns['price_scale'] = 10 ** PRICE_PLACES
+    return columns
+
+def price_rows(columns):
+    """
+    Converts the columnar layout back to rows as the JSON API returns them. The inverse of price_columns.
+    """
+    places = len(str(columns['price_scale'])) - 1
+    rows = []
+    for i, price_id in enumerate(columns['id']):
+        row = {'id': price_id, 'stock': columns['symbols'][columns['stock'][i]], 'date': (EPOCH + timedelta(days=columns['date'][i])).isoformat()}
+        for field in DECIMAL_FIELDS:
+            value = columns[field][i]
+            row[field] = None if value is None else str(Decimal(value).scaleb(-places))
+        row['volume'] = columns['volume'][i]
+        rows.append(row)
+    return rows
@@ -0,0 +1,77 @@
+"""
+Streaming export of stock price history as NDJSON or CSV.
+Rows are read with a server-side cursor where the database supports one and encoded a chunk at a time,
+so memory stays flat however many rows are exported. The columns are those read by the import_prices command.
+
+Under ASGI, Django 3.0 iterates a streaming response in the event loop, where queries are not allowed, so the export
+is written to a spooled temporary file by the view instead (see spool).
+"""
+import csv
+import json
+import tempfile
+
+from .ingest import PRICE_FIELDS
+
+EXPORT_FIELDS = ['stock', 'date'] + PRICE_FIELDS
+
+# Rows fetched from the database and encoded per chunk of output
+CHUNK_SIZE = 2000
+
+# Bytes of a spooled export kept in memory before it is moved to a file on disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+def export_rows(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Yields the EXPORT_FIELDS of each price in 'queryset' as a tuple, with decimals and dates
+    as strings formatted as the API formats them: decimals with their places and ISO dates.
+    """
+    for row in queryset.values_list('stock_id', *EXPORT_FIELDS[1:]).iterator(chunk_size=chunk_size):
+        yield tuple(value if value is None or isinstance(value, int) else str(value) for value in row)
+
+def chunked(rows, size=CHUNK_SIZE):
+    """
+    Groups an iterable into lists of at most 'size' items, without reading ahead further than one list.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def ndjson_stream(rows):
+    """
+    Encodes rows from export_rows as newline-delimited JSON objects, yielding one string per chunk of rows.
+    """
+    for chunk in chunked(rows):
+        yield ''.join(json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n' for row in chunk)
+
+class Echo:
+    """
+    File-like object that returns what is written to it, so csv.writer can encode one row at a time.
+    """
+    def write(self, value):
+        return value
+
+def csv_stream(rows):
+    """
+    Encodes rows from export_rows as CSV with a header line, yielding one string per chunk of rows.
+    The header is yielded on its own so the response starts before the first rows are read.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for chunk in chunked(rows):
+        yield ''.join(writer.writerow(row) for row in chunk)
+
+def spool(chunks, charset='utf-8', max_size=SPOOL_MAX_SIZE):
+    """
+    Writes the strings of an export stream to a temporary file, kept in memory up to 'max_size' bytes,
+    and returns it rewound for reading.
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=max_size)
+    for chunk in chunks:
+        file.write(chunk.encode(charset))
+    file.seek(0)
+    return file
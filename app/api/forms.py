@@ -2,3 +2,24 @@ from django import forms
 
 class SuggestionDateForm(forms.Form):
     date = forms.DateField()
+
+class PersonalSuggestionForm(SuggestionDateForm):
+    # Number of buys and of sells to return; all suggestions if empty
+    limit = forms.IntegerField(min_value=1, required=False)
+
+class PriceExportForm(forms.Form):
+    # Comma-separated stock symbols; all stocks if empty
+    symbols = forms.CharField(required=False)
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+
+    def clean_symbols(self):
+        return [symbol for symbol in self.cleaned_data['symbols'].split(',') if symbol]
+
+class PriceHistoryForm(forms.Form):
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+    interval = forms.ChoiceField(choices=[('day', 'day'), ('week', 'week'), ('month', 'month')], required=False)
+
+    def clean_interval(self):
+        return self.cleaned_data['interval'] or 'day'
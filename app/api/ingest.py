@@ -0,0 +1,295 @@
+"""
+Bulk writes of stock prices, shared by the bulk upload endpoint and the import_prices management command.
+Bulk writes do not send model signals, so writers must call sync_derived_tables afterwards.
+"""
+import csv
+import io
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, connection, transaction
+
+from .cache import interests_changed, stock_data_changed
+from .models import Stock, StockPrice, Suggestion, TradingDay
+from .partitioning import ensure_partitions, is_partitioned
+
+# Price columns written by an upsert, besides the (stock, date) key
+PRICE_FIELDS = ['predicted_closing_price', 'opening_price', 'actual_closing_price', 'daily_high', 'daily_low', 'volume']
+
+# Keeps IN lists and multi-row statements under SQLite's variable limit
+BATCH_SIZE = 500
+
+def upsert_prices(rows):
+    """
+    Inserts or updates stock prices keyed on (stock, date), replacing every price column of existing rows.
+    Later rows win over earlier rows with the same key. Returns a (created, updated) tuple of counts.
+
+    rows - An iterable of dicts with 'stock' (a symbol of an existing stock), 'date' (a datetime.date)
+           and any of PRICE_FIELDS; missing price fields are stored as null.
+    """
+    latest = {}
+    for row in rows:
+        latest[(row['stock'], row['date'])] = row
+    rows = list(latest.values())
+
+    with transaction.atomic():
+        # A partitioned table needs partitions for the dates before rows are written to them
+        ensure_partitions(row['date'] for row in rows)
+        if supports_native_upsert():
+            return upsert_prices_native(rows)
+        return upsert_prices_portable(rows)
+
+def supports_native_upsert():
+    """
+    Returns True if the database supports INSERT ... ON CONFLICT DO UPDATE (PostgreSQL, and SQLite 3.24 or later).
+    """
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        from sqlite3 import sqlite_version_info
+        return sqlite_version_info >= (3, 24, 0)
+    return False
+
+def find_existing_prices(rows):
+    """
+    Returns a dict of (symbol, date) -> id for the rows that already exist, using one query per batch.
+    """
+    existing = {}
+    for batch in batches(rows):
+        symbols = {row['stock'] for row in batch}
+        dates = {row['date'] for row in batch}
+        for pk, stock_id, date in StockPrice.objects.filter(stock_id__in=symbols, date__in=dates).values_list('id', 'stock_id', 'date'):
+            existing[(stock_id, date)] = pk
+    return existing
+
+def upsert_prices_portable(rows, attempts=3):
+    """
+    Upsert for any backend: finds the existing rows, then uses bulk_create and bulk_update.
+    A concurrent writer may insert one of the new rows between the read and the insert, which then fails on the
+    unique (stock, date) constraint. The insert is rolled back to a savepoint and the rows are read again, so that
+    the ones now existing are updated. With isolation levels stricter than read committed the new rows stay
+    invisible, and the IntegrityError is raised after 'attempts' tries.
+    """
+    for attempt in range(attempts):
+        existing = find_existing_prices(rows)
+
+        to_create = []
+        to_update = []
+        for row in rows:
+            price = StockPrice(stock_id=row['stock'], date=row['date'], **{field: row.get(field) for field in PRICE_FIELDS})
+            price.pk = existing.get((row['stock'], row['date']))
+            if price.pk is None:
+                to_create.append(price)
+            else:
+                to_update.append(price)
+
+        try:
+            with transaction.atomic():
+                StockPrice.objects.bulk_create(to_create)
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+            continue
+        StockPrice.objects.bulk_update(to_update, PRICE_FIELDS, batch_size=BATCH_SIZE)
+        return len(to_create), len(to_update)
+
+def upsert_prices_native(rows):
+    """
+    Native upsert with INSERT ... ON CONFLICT (stock_id, date) DO UPDATE, one statement per batch.
+    PostgreSQL reports which rows were inserted; on SQLite and partitioned tables, which cannot return the system
+    column telling inserts from updates, the existing rows are counted first.
+    """
+    quote = connection.ops.quote_name
+    columns = ['stock_id', 'date'] + PRICE_FIELDS
+    placeholders = '(%s)' % ', '.join(['%s'] * len(columns))
+    sql = 'INSERT INTO %s (%s) VALUES %%s ON CONFLICT (stock_id, date) DO UPDATE SET %s' % (
+        quote(StockPrice._meta.db_table),
+        ', '.join(quote(column) for column in columns),
+        ', '.join('%s = excluded.%s' % (quote(field), quote(field)) for field in PRICE_FIELDS))
+
+    postgresql = connection.vendor == 'postgresql'
+    returns_inserted = postgresql and not is_partitioned()
+    if returns_inserted:
+        sql += ' RETURNING (xmax = 0)'
+    else:
+        updated = len(find_existing_prices(rows))
+    # Older SQLite builds allow at most 999 variables per statement
+    batch_size = BATCH_SIZE if postgresql else 999 // len(columns)
+
+    created = 0
+    with connection.cursor() as cursor:
+        for batch in batches(rows, batch_size):
+            params = []
+            for row in batch:
+                params.extend([row['stock'], row['date']] + [row.get(field) for field in PRICE_FIELDS])
+            cursor.execute(sql % ', '.join([placeholders] * len(batch)), params)
+            if returns_inserted:
+                created += sum(1 for (inserted,) in cursor.fetchall() if inserted)
+
+    if returns_inserted:
+        return created, len(rows) - created
+    return len(rows) - updated, updated
+
+def copy_prices(rows):
+    """
+    Same as upsert_prices, but on PostgreSQL the rows are loaded with COPY FROM STDIN into a temporary staging table
+    and merged with a single INSERT ... SELECT ... ON CONFLICT, which is much faster for large loads.
+    Other backends fall back to upsert_prices.
+    """
+    if connection.vendor != 'postgresql':
+        return upsert_prices(rows)
+
+    latest = {}
+    for row in rows:
+        latest[(row['stock'], row['date'])] = row
+
+    # Rows as CSV; None becomes an empty unquoted field, which COPY reads as NULL
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in latest.values():
+        writer.writerow([row['stock'], row['date'].isoformat()] + ['' if row.get(field) is None else row[field] for field in PRICE_FIELDS])
+    buffer.seek(0)
+
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in ['stock_id', 'date'] + PRICE_FIELDS)
+    updates = ', '.join('%s = EXCLUDED.%s' % (quote(field), quote(field)) for field in PRICE_FIELDS)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        ensure_partitions(date for stock, date in latest)
+        cursor.execute('CREATE TEMPORARY TABLE import_stockprice ('
+                       'stock_id varchar(100), date date, predicted_closing_price numeric(12, 2), opening_price numeric(12, 2), '
+                       'actual_closing_price numeric(12, 2), daily_high numeric(12, 2), daily_low numeric(12, 2), volume integer)')
+        cursor.copy_expert('COPY import_stockprice (%s) FROM STDIN WITH (FORMAT csv)' % columns, buffer)
+        merge = 'INSERT INTO %s (%s) SELECT %s FROM import_stockprice ON CONFLICT (stock_id, date) DO UPDATE SET %s' % (
+            quote(StockPrice._meta.db_table), columns, columns, updates)
+        if is_partitioned():
+            # A partitioned table cannot return xmax, so the existing rows are counted first
+            cursor.execute('SELECT count(*) FROM %s p JOIN import_stockprice i ON p.stock_id = i.stock_id AND p.date = i.date' % (
+                quote(StockPrice._meta.db_table)))
+            updated = cursor.fetchone()[0]
+            cursor.execute(merge)
+            created, total = cursor.rowcount - updated, cursor.rowcount
+        else:
+            cursor.execute('WITH merged AS (%s RETURNING (xmax = 0) AS inserted) '
+                           'SELECT count(*) FILTER (WHERE inserted), count(*) FROM merged' % merge)
+            created, total = cursor.fetchone()
+        # Dropped here rather than on commit, as several batches may be written in one transaction; a failed batch
+        # rolls back to the savepoint, which drops the table too
+        cursor.execute('DROP TABLE import_stockprice')
+    return created, total - created
+
+def create_missing_stocks(stocks, known):
+    """
+    Creates the stocks that don't exist yet with one query to find them and one bulk insert.
+    Returns the number of stocks created.
+
+    stocks - A dict of symbol -> {'name': ..., 'category': ...} for the stocks referenced by a batch of rows
+    known - A set of symbols known to exist; updated in place so later batches skip them
+    """
+    unknown = set(stocks) - known
+    if not unknown:
+        return 0
+
+    known.update(Stock.objects.filter(symbol__in=unknown).values_list('symbol', flat=True))
+    missing = [Stock(symbol=symbol, name=stocks[symbol].get('name') or symbol, category=stocks[symbol].get('category') or '')
+               for symbol in unknown - known]
+    Stock.objects.bulk_create(missing, ignore_conflicts=True)
+    known.update(stock.symbol for stock in missing)
+    # bulk_create sends no signals, so the interest index must be moved on here
+    if missing:
+        interests_changed()
+    return len(missing)
+
+def parse_price_row(raw):
+    """
+    Converts a row read from a CSV or NDJSON file into the dict used by upsert_prices, plus the optional stock 'name'
+    and 'category' columns. Empty strings are treated as nulls. Raises ValueError with a readable message if invalid.
+    """
+    def value(name):
+        field = raw.get(name)
+        return None if field == '' else field
+
+    symbol = value('stock') or value('symbol')
+    if symbol is None:
+        raise ValueError('stock: This field is required.')
+    row = {'stock': str(symbol), 'name': value('name'), 'category': value('category')}
+
+    try:
+        row['date'] = date.fromisoformat(str(value('date')))
+    except ValueError:
+        raise ValueError('date: Date has wrong format. Use YYYY-MM-DD.')
+
+    for field in PRICE_FIELDS:
+        field_value = value(field)
+        if field_value is None:
+            if field == 'predicted_closing_price':
+                raise ValueError('%s: This field is required.' % field)
+            row[field] = None
+        elif field == 'volume':
+            row[field] = parse_volume(field_value)
+        else:
+            row[field] = parse_price(field, field_value)
+    return row
+
+def parse_volume(field_value):
+    """
+    Parses a volume like the serializer's IntegerField: integral values such as 100 or '100.0' are accepted,
+    while 1.5 is rejected rather than truncated.
+    """
+    try:
+        volume = int(re.sub(r'\.0*\s*$', '', str(field_value)))
+    except (TypeError, ValueError):
+        raise ValueError('volume: A valid integer is required.')
+    if not -2 ** 31 <= volume < 2 ** 31:
+        raise ValueError('volume: Must be between %d and %d.' % (-2 ** 31, 2 ** 31 - 1))
+    return volume
+
+def parse_price(field, field_value):
+    """
+    Parses a price that must fit a DecimalField(max_digits=12, decimal_places=2).
+    """
+    try:
+        price = Decimal(str(field_value))
+    except InvalidOperation:
+        raise ValueError('%s: A valid number is required.' % field)
+    if not price.is_finite() or abs(price) >= 10 ** 10 or price != price.quantize(Decimal('0.01')):
+        raise ValueError('%s: Must be a number with at most 10 digits before and 2 after the decimal point.' % field)
+    return price
+
+def add_trading_days(dates):
+    """
+    Adds dates that prices were written for in bulk to the trading calendar.
+    """
+    TradingDay.objects.bulk_create([TradingDay(date=date) for date in set(dates)], ignore_conflicts=True)
+
+def sync_derived_tables(dates, symbols=None):
+    """
+    Brings the trading calendar, stored suggestions, data version and cached responses up to date after prices on 'dates' were written in bulk.
+    Suggestions are recomputed for every written date and for the trading date following each of them.
+
+    symbols - The stocks whose prices were written, if known; only their suggestions are then recomputed, except on the
+              date following a new trading date, where every stock's previous day changed
+    """
+    dates = set(dates)
+    if not dates:
+        return
+    stock_data_changed()
+    new_dates = dates - set(TradingDay.objects.filter(date__in=dates).values_list('date', flat=True)) if symbols is not None else dates
+    add_trading_days(dates)
+
+    # The trading dates from the first written date up to the one after the last, to find each date's next date
+    last = TradingDay.objects.next_date(max(dates)) or max(dates)
+    calendar = list(TradingDay.objects.filter(date__range=(min(dates), last)).order_by('date').values_list('date', flat=True))
+    following = {date: next_date for date, next_date in zip(calendar, calendar[1:]) if date in dates}
+    all_stocks = {following[date] for date in new_dates if date in following}
+    affected = (dates | set(following.values())) - all_stocks
+
+    Suggestion.objects.refresh_dates(all_stocks)
+    Suggestion.objects.refresh_dates(affected, symbols=symbols)
+
+def batches(items, size=BATCH_SIZE):
+    """
+    Splits a list into consecutive lists of at most 'size' items.
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
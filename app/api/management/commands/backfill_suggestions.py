@@ -0,0 +1,30 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from api.cache import stock_data_changed
+from api.models import Suggestion, TradingDay
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored suggestions for every trading date, or for the dates in [--start, --end].'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First date to recompute (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last date to recompute (YYYY-MM-DD)')
+        parser.add_argument('--rebuild-calendar', action='store_true', help='Rebuild the trading calendar from stock prices first')
+
+    def handle(self, *args, **options):
+        if options['rebuild_calendar']:
+            TradingDay.objects.rebuild()
+
+        dates = TradingDay.objects.order_by('date')
+        if options['start']:
+            dates = dates.filter(date__gte=options['start'])
+        if options['end']:
+            dates = dates.filter(date__lte=options['end'])
+
+        dates = list(dates.values_list('date', flat=True))
+        Suggestion.objects.refresh_dates(dates)
+        stock_data_changed()
+
+        self.stdout.write(self.style.SUCCESS('Recomputed suggestions for %d trading date(s)' % len(dates)))
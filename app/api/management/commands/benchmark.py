@@ -0,0 +1,71 @@
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.benchmarks import BENCHMARKS
+
+class Command(BaseCommand):
+    help = ('Runs api benchmarks against a throwaway test database. '
+            'Optionally writes the results as a JSON report and compares them with an earlier report.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Benchmarks to run (default: all). Available: %s' % ', '.join(BENCHMARKS))
+        parser.add_argument('--report', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='JSON report of an earlier run to compare the results with')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Fail if a case is slower than in the --compare report by more than this fraction (default: 0.25)')
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError('Unknown benchmark(s): %s' % ', '.join(unknown))
+
+        baseline = {}
+        if options['compare']:
+            with open(options['compare']) as report:
+                baseline = {(result['benchmark'], result['case'], result['size']): result['seconds'] for result in json.load(report)['results']}
+
+        results = []
+        regressions = []
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for name in names:
+                # Roll back each benchmark's data so they don't affect each other
+                with transaction.atomic():
+                    for result in BENCHMARKS[name]():
+                        results.append(result)
+                        line = '%-20s %-32s %10d rows %10.3f ms' % (result['benchmark'], result['case'], result['size'], result['seconds'] * 1000)
+                        if 'p95' in result:
+                            line += ' p95 %8.3f ms p99 %8.3f ms %4d queries' % (result['p95'] * 1000, result['p99'] * 1000, result['queries'])
+                        if 'rows_per_second' in result:
+                            line += ' %10.0f rows/s' % result['rows_per_second']
+                        if 'bytes' in result:
+                            line += ' %10d bytes' % result['bytes']
+                        previous = baseline.get((result['benchmark'], result['case'], result['size']))
+                        if previous:
+                            ratio = result['seconds'] / previous
+                            line += ' x%.2f' % ratio
+                            if ratio > 1 + options['tolerance']:
+                                regressions.append('%s %s' % (result['benchmark'], result['case']))
+                                line = self.style.WARNING(line)
+                        self.stdout.write(line)
+                    transaction.set_rollback(True)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['report']:
+            with open(options['report'], 'w') as report:
+                json.dump({
+                    'created': timezone.now().isoformat(), 'database': connection.vendor,
+                    'django': django.get_version(), 'python': platform.python_version(), 'results': results,
+                }, report, indent=2)
+
+        if regressions:
+            raise CommandError('%d case(s) slower than in %s by more than %d%%: %s' % (
+                len(regressions), options['compare'], options['tolerance'] * 100, ', '.join(regressions)))
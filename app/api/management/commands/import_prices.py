@@ -0,0 +1,132 @@
+import csv
+import gzip
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.ingest import copy_prices, create_missing_stocks, parse_price_row, sync_derived_tables
+
+class Command(BaseCommand):
+    help = ('Streams stock prices from CSV or NDJSON files (optionally gzipped) into the database, upserting on (stock, date) '
+            'and creating missing stocks. Columns: stock (or symbol), date, predicted_closing_price, opening_price, '
+            'actual_closing_price, daily_high, daily_low, volume, and optionally name and category for new stocks. '
+            'Progress is checkpointed after every batch so a failed import can be continued with --resume.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='CSV (.csv) or NDJSON (.ndjson, .jsonl) files, optionally ending in .gz')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='File format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows written per transaction (default: 5000)')
+        parser.add_argument('--resume', action='store_true', help="Continue from each file's checkpoint instead of starting over")
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        for path in options['files']:
+            if not os.path.isfile(path):
+                raise CommandError('File not found: %s' % path)
+            self.import_file(path, options['format'] or self.guess_format(path), options['batch_size'], options['resume'])
+
+    def guess_format(self, path):
+        name = path[:-3] if path.endswith('.gz') else path
+        if name.endswith('.csv'):
+            return 'csv'
+        if name.endswith('.ndjson') or name.endswith('.jsonl'):
+            return 'ndjson'
+        raise CommandError('Cannot tell the format of %s, use --format' % path)
+
+    def read_records(self, path, file_format):
+        """
+        Yields (line number, record) for every record in the file, one at a time.
+        CSV records are dicts; NDJSON records are undecoded lines.
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', newline='') as stream:
+            if file_format == 'csv':
+                reader = csv.DictReader(stream)
+                for record in reader:
+                    yield reader.line_num, record
+            else:
+                for number, line in enumerate(stream, start=1):
+                    if line.strip():
+                        yield number, line
+
+    def import_file(self, path, file_format, batch_size, resume):
+        checkpoint_path = path + '.checkpoint'
+        checkpoint = {'size': os.path.getsize(path), 'records': 0}
+        if resume and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            if saved['size'] != checkpoint['size']:
+                raise CommandError('%s changed since its checkpoint was written; import it again without --resume' % path)
+            checkpoint = saved
+            self.stdout.write('Resuming %s after %d records' % (path, checkpoint['records']))
+
+        totals = {'created': 0, 'updated': 0, 'stocks': 0, 'errors': 0}
+        known_stocks = set()
+        skip = checkpoint['records']
+        records = 0
+        batch = []
+        start = time.perf_counter()
+
+        for line_number, record in self.read_records(path, file_format):
+            records += 1
+            if records <= skip:
+                continue
+
+            try:
+                if file_format == 'ndjson':
+                    record = json.loads(record)
+                    if not isinstance(record, dict):
+                        raise ValueError('Expected a JSON object.')
+                batch.append(parse_price_row(record))
+            except ValueError as exc:
+                totals['errors'] += 1
+                self.stderr.write('%s line %d: %s' % (path, line_number, exc))
+
+            if len(batch) >= batch_size:
+                self.write_batch(batch, known_stocks, totals)
+                self.save_checkpoint(checkpoint_path, checkpoint, records)
+                batch = []
+                if self.verbosity > 1:
+                    self.report(path, totals, start, final=False)
+
+        if batch:
+            self.write_batch(batch, known_stocks, totals)
+        self.save_checkpoint(checkpoint_path, checkpoint, records)
+        os.remove(checkpoint_path)
+        self.report(path, totals, start, final=True)
+
+    def write_batch(self, batch, known_stocks, totals):
+        """
+        Writes one batch of parsed rows in a single transaction: missing stocks, prices, and the trading calendar,
+        suggestions, data version and cached responses they affect. A batch is live as soon as it commits,
+        so the derived tables are synced with it rather than at the end of the file, which a failed import never reaches.
+        """
+        with transaction.atomic():
+            totals['stocks'] += create_missing_stocks({row['stock']: row for row in batch}, known_stocks)
+            created, updated = copy_prices(batch)
+            sync_derived_tables({row['date'] for row in batch}, {row['stock'] for row in batch})
+        totals['created'] += created
+        totals['updated'] += updated
+
+    def save_checkpoint(self, checkpoint_path, checkpoint, records):
+        """
+        Records that every record up to 'records' has been committed. Writes are atomic so a crash can't corrupt it.
+        Rewriting a batch after a crash between commit and checkpoint is harmless, as writes are upserts.
+        """
+        checkpoint['records'] = records
+        with open(checkpoint_path + '.tmp', 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    def report(self, path, totals, start, final):
+        elapsed = time.perf_counter() - start
+        rows = totals['created'] + totals['updated']
+        message = '%s: %d rows (%d created, %d updated), %d new stocks, %d errors in %.1fs (%.0f rows/sec)' % (
+            path, rows, totals['created'], totals['updated'], totals['stocks'], totals['errors'], elapsed, rows / elapsed if elapsed else 0)
+        self.stdout.write(self.style.SUCCESS(message) if final else message)
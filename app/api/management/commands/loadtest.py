@@ -0,0 +1,62 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import percentile
+
+class Command(BaseCommand):
+    help = ('Sends GET requests from many concurrent clients to a running server and reports throughput and latency, '
+            'e.g. to compare the WSGI and ASGI deployments.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='URLs to request, in turn')
+        parser.add_argument('--concurrency', type=int, default=200, help='Number of concurrent clients (default: 200)')
+        parser.add_argument('--requests', type=int, default=2000, help='Total number of requests (default: 2000)')
+        parser.add_argument('--token', help='API token to send in the Authorization header')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be positive')
+
+        headers = {'Authorization': 'Token ' + options['token']} if options['token'] else {}
+        urls = options['urls']
+        counter = itertools.count()
+        lock = threading.Lock()
+        latencies = []
+        errors = []
+
+        def client():
+            # Each client reuses one connection, like a browser or mobile app would
+            session = requests.Session()
+            while True:
+                with lock:
+                    number = next(counter)
+                if number >= options['requests']:
+                    return
+                start = time.perf_counter()
+                try:
+                    status = session.get(urls[number % len(urls)], headers=headers).status_code
+                except requests.RequestException as exc:
+                    status = exc.__class__.__name__
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    if not (isinstance(status, int) and (200 <= status < 300 or status == 304)):
+                        errors.append(status)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            for i in range(options['concurrency']):
+                executor.submit(client)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write('%d requests from %d clients in %.2f s: %.1f requests/s' % (
+            len(latencies), options['concurrency'], elapsed, len(latencies) / elapsed))
+        self.stdout.write('latency p50 %.1f ms, p95 %.1f ms, p99 %.1f ms' % tuple(
+            percentile(latencies, fraction) * 1000 for fraction in (0.5, 0.95, 0.99)))
+        if errors:
+            self.stdout.write(self.style.WARNING('%d failed requests, e.g. %s' % (len(errors), errors[0])))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.partitioning import INTERVALS, TABLE, ensure_partitions, is_partitioned, partition_table
+
+class Command(BaseCommand):
+    help = ('Converts the stock price table into a PostgreSQL table partitioned by month or year of date, unless it already is, '
+            'and creates the partitions of the coming months or years. Run it regularly (e.g. daily) to keep partitions ahead of '
+            'the data. On other databases the table stays a plain table. See api.partitioning.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', choices=INTERVALS, default='month',
+                            help='Range of dates per partition when converting the table (default: month)')
+        parser.add_argument('--ahead', type=int, default=3, help='Months or years after the current one to create partitions for (default: 3)')
+
+    def handle(self, *args, **options):
+        if options['ahead'] < 0:
+            raise CommandError('--ahead must not be negative')
+        if connection.vendor != 'postgresql':
+            self.stdout.write('Partitioning requires PostgreSQL; %s stays a plain table on %s' % (TABLE, connection.vendor))
+            return
+
+        if is_partitioned():
+            created = ensure_partitions(ahead=options['ahead'])
+            if created:
+                self.stdout.write(self.style.SUCCESS('Created %d partition(s): %s' % (len(created), ', '.join(created))))
+            else:
+                self.stdout.write('All partitions exist')
+            return
+
+        start = time.perf_counter()
+        created = partition_table(options['interval'], options['ahead'])
+        self.stdout.write(self.style.SUCCESS('Partitioned %s by %s into %d partition(s) in %.1fs' % (
+            TABLE, options['interval'], len(created), time.perf_counter() - start)))
@@ -0,0 +1,80 @@
+"""
+Prometheus metrics of the API, served at /metrics.
+
+Requests are counted and timed per URL name by api.middleware.RequestTimingMiddleware, the caches count their hits and misses,
+and each worker reports its in-flight requests and database connections.
+
+Under gunicorn every worker is a separate process. gunicorn.conf.py sets prometheus_multiproc_dir, so that each process
+writes its metrics to memory-mapped files in that directory and /metrics adds up the files of all workers, whichever
+worker serves the scrape. Without it (runserver, tests) the metrics are those of the current process.
+
+/metrics requires settings.METRICS_TOKEN if it is set, and is otherwise only served to internal scrapers: clients with
+a loopback or private address whose request did not pass through a proxy, such as a Prometheus server on the Docker network.
+"""
+import ipaddress
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+REQUESTS = Counter('api_requests_total', 'Requests by URL name, method and status code', ['view', 'method', 'status'])
+REQUEST_DURATION = Histogram('api_request_duration_seconds', 'Request latency by URL name', ['view'])
+DB_QUERIES = Counter('api_db_queries_total', 'Database queries by URL name of the request', ['view'])
+DB_DURATION = Histogram('api_request_db_duration_seconds', 'Time spent in database queries per request, by URL name', ['view'])
+
+CACHE_LOOKUPS = Counter('api_cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+RESPONSE_CACHE_HITS = CACHE_LOOKUPS.labels('response', 'hit')
+RESPONSE_CACHE_MISSES = CACHE_LOOKUPS.labels('response', 'miss')
+TOKEN_CACHE_HITS = CACHE_LOOKUPS.labels('token', 'hit')
+TOKEN_CACHE_MISSES = CACHE_LOOKUPS.labels('token', 'miss')
+
+# Gauges of live workers, added up across workers
+IN_PROGRESS = Gauge('api_requests_in_progress', 'Requests being served', multiprocess_mode='livesum')
+DB_CONNECTIONS = Gauge('api_db_connections', 'Database connections by alias and state (see api.backends.pool)', ['alias', 'state'],
+                       multiprocess_mode='livesum')
+
+# Label of requests that matched no URL, so that unknown paths do not create new series
+UNMATCHED = '<unmatched>'
+
+def record_request(request, response, metrics):
+    """
+    Records a finished request, with the 'metrics' of api.middleware.RequestTiming.
+    """
+    view = request.resolver_match.view_name if request.resolver_match else UNMATCHED
+    REQUESTS.labels(view, request.method, response.status_code).inc()
+    REQUEST_DURATION.labels(view).observe(metrics['total'] / 1000)
+    DB_QUERIES.labels(view).inc(metrics['queries'])
+    DB_DURATION.labels(view).observe(metrics['db'] / 1000)
+
+def record_connections(stats):
+    """
+    Sets the connection gauges from api.backends.pool.pool_stats().
+    """
+    for alias, pool in stats.items():
+        for state in ('open', 'in_use', 'idle'):
+            DB_CONNECTIONS.labels(alias, state).set(pool[state])
+
+# Headers set by proxies, whose own address is private, for the client they forward for
+FORWARDED_HEADERS = ['HTTP_FORWARDED', 'HTTP_X_FORWARDED_FOR', 'HTTP_X_REAL_IP']
+
+def internal(request):
+    """
+    Returns whether a request comes directly from a loopback or private address.
+    """
+    if any(header in request.META for header in FORWARDED_HEADERS):
+        return False
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return address.is_loopback or address.is_private
+
+def latest():
+    """
+    Returns the current metrics in the Prometheus text format, and their content type.
+    """
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,189 @@
+"""
+Middleware of the api app.
+
+RequestTimingMiddleware: per-request performance instrumentation. It records SQL query count and time,
+view time (including serialization), render time, total time and response size.
+
+The timings are sent in a Server-Timing header to staff users, or on every response, depending on
+settings.REQUEST_TIMING_HEADER ('staff', 'all' or 'off'), logged as one JSON line per request on the
+'api.timing' logger if settings.REQUEST_TIMING_LOG is set, and recorded in the Prometheus metrics of api.metrics
+if settings.REQUEST_METRICS is set. With all three off the middleware is not loaded at all.
+
+ReplicaRoutingMiddleware: serves safe requests from read replicas, see api.routers.
+
+AsgiConnectionMiddleware: returns the database connections of an ASGI request to the pool when its view is done.
+"""
+import json
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+from . import metrics as api_metrics
+from .backends.pool import pool_stats
+from .routers import client_key, current_replica, pin_to_primary, pinned_to_primary, read_from_replicas, session_key, stream_from_replicas
+
+logger = logging.getLogger('api.timing')
+
+def milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+class RequestTiming:
+    """
+    Timings of one request. Also a database execute wrapper that counts queries and their time.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end = None
+        self.view_start = None
+        self.view_end = None
+        self.render_end = None
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - start
+
+    def rendered(self, response):
+        self.render_end = time.perf_counter()
+
+    def metrics(self):
+        """
+        Returns the durations in milliseconds: 'total', 'view' (None if no view was called), 'render' (None if
+        the response was not rendered from data, e.g. a 304 or streamed response) and 'db', and the number of 'queries'.
+        """
+        view = render = None
+        if self.view_start is not None:
+            view = (self.view_end or self.end) - self.view_start
+        if self.view_end is not None and self.render_end is not None:
+            render = self.render_end - self.view_end
+        return {
+            'total': milliseconds(self.end - self.start), 'view': milliseconds(view), 'render': milliseconds(render),
+            'db': milliseconds(self.query_seconds), 'queries': self.queries,
+        }
+
+def server_timing(metrics):
+    """
+    Formats metrics as a Server-Timing header value.
+    """
+    entries = ['db;desc="%d queries";dur=%.3f' % (metrics['queries'], metrics['db'])]
+    entries += ['%s;dur=%.3f' % (name, metrics[name]) for name in ('view', 'render', 'total') if metrics[name] is not None]
+    return ', '.join(entries)
+
+class RequestTimingMiddleware:
+    """
+    Times each request, see the module docstring. Put it first in MIDDLEWARE so the total covers the other middleware.
+    """
+    def __init__(self, get_response):
+        self.header = getattr(settings, 'REQUEST_TIMING_HEADER', 'staff')
+        self.log = getattr(settings, 'REQUEST_TIMING_LOG', False)
+        self.metrics = getattr(settings, 'REQUEST_METRICS', True)
+        if self.header == 'off' and not self.log and not self.metrics:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timing = request.timing = RequestTiming()
+        if self.metrics:
+            api_metrics.IN_PROGRESS.inc()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(timing))
+                response = self.get_response(request)
+            timing.end = time.perf_counter()
+        finally:
+            if self.metrics:
+                api_metrics.IN_PROGRESS.dec()
+
+        metrics = timing.metrics()
+        if self.metrics:
+            api_metrics.record_request(request, response, metrics)
+            api_metrics.record_connections(pool_stats())
+        # API views set the user they authenticated on the Django request too
+        user = getattr(request, 'user', None)
+        if self.header == 'all' or (self.header == 'staff' and user is not None and user.is_staff):
+            response['Server-Timing'] = server_timing(metrics)
+        if self.log:
+            logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': request.resolver_match.view_name if request.resolver_match else None,
+                'status': response.status_code,
+                'user': user.pk if user is not None and user.is_authenticated else None,
+                'total_ms': metrics['total'],
+                'view_ms': metrics['view'],
+                'render_ms': metrics['render'],
+                'db_ms': metrics['db'],
+                'db_queries': metrics['queries'],
+                'bytes': None if response.streaming else len(response.content),
+            }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.timing.view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Called when the view returned, before the response data (e.g. of an API view) are rendered
+        request.timing.view_end = time.perf_counter()
+        response.add_post_render_callback(request.timing.rendered)
+        return response
+
+class ReplicaRoutingMiddleware:
+    """
+    Serves safe requests from a read replica unless the client wrote recently, and pins a client to the primary
+    after a successful write (see api.routers). Not loaded when no replicas are configured.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'DATABASE_REPLICAS', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        key = client_key(request)
+        if request.method in SAFE_METHODS:
+            if pinned_to_primary(key):
+                return self.get_response(request)
+            with read_from_replicas():
+                response = self.get_response(request)
+                replica = current_replica()
+            if response.streaming:
+                response.streaming_content = stream_from_replicas(response.streaming_content, replica)
+            return response
+
+        response = self.get_response(request)
+        if response.status_code < 400:
+            pin_to_primary(key)
+            # A login starts a new session, which identifies the client from its next request on
+            new_key = session_key(response)
+            if new_key is not None and new_key != key:
+                pin_to_primary(new_key)
+        return response
+
+class AsgiConnectionMiddleware:
+    """
+    Closes the database connections used by an ASGI request on the thread that ran its view, which returns pooled
+    connections to the pool (see api.backends.pool). Django closes them when the response is closed, but the ASGI
+    handler does that on another thread, which holds connections of its own, so the view thread's were never released.
+    Under WSGI the whole request runs on one thread and Django's own handling applies.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not isinstance(request, ASGIRequest):
+            return self.get_response(request)
+        try:
+            return self.get_response(request)
+        finally:
+            connections.close_all()
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.7 on 2026-10-18 06:16
+
+from django.db import migrations, models
+
+
+def populate_trading_days(apps, schema_editor):
+    StockPrice = apps.get_model('api', 'StockPrice')
+    TradingDay = apps.get_model('api', 'TradingDay')
+    dates = StockPrice.objects.values_list('date', flat=True).distinct()
+    TradingDay.objects.bulk_create([TradingDay(date=date) for date in dates])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_auto_20200626_2300'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TradingDay',
+            fields=[
+                ('date', models.DateField(primary_key=True, serialize=False)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.RunPython(populate_trading_days, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.7 on 2026-10-18 06:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_tradingday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Suggestion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('action', models.CharField(max_length=10)),
+                ('percent_change', models.FloatField(blank=True, null=True)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='suggestions', to='api.Stock')),
+            ],
+            options={
+                'ordering': ['date', 'stock'],
+                'unique_together': {('date', 'stock')},
+            },
+        ),
+    ]
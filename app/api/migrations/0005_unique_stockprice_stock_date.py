@@ -0,0 +1,34 @@
+# Generated by Django 3.0.7 on 2026-10-18 06:22
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicate_prices(apps, schema_editor):
+    """
+    Keeps only the most recently created price for each (stock, date) so the unique constraint can be added.
+    Stored suggestions for affected dates may be stale afterwards; run 'manage.py backfill_suggestions'.
+    """
+    StockPrice = apps.get_model('api', 'StockPrice')
+    duplicates = list(StockPrice.objects.values('stock_id', 'date')
+                      .annotate(keep=Max('id'), count=Count('id'))
+                      .filter(count__gt=1)
+                      .values_list('stock_id', 'date', 'keep'))
+
+    for stock_id, date, keep in duplicates:
+        StockPrice.objects.filter(stock_id=stock_id, date=date).exclude(id=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_suggestion'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_prices, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='stockprice',
+            unique_together={('stock', 'date')},
+        ),
+    ]
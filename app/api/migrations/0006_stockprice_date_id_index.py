@@ -0,0 +1,17 @@
+# Generated by Django 3.0.7 on 2026-10-18 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_unique_stockprice_stock_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stockprice',
+            index=models.Index(fields=['date', 'id'], name='stockprice_date_id_idx'),
+        ),
+    ]
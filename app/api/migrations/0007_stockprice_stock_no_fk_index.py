@@ -0,0 +1,19 @@
+# Generated by Django 3.0.7 on 2026-10-18 06:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_stockprice_date_id_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockprice',
+            name='stock',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock_prices', to='api.Stock'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.0.7 on 2026-10-18 09:02
+
+from django.db import migrations
+
+from api.utils import suggestions_from_rows
+
+
+def backfill_suggestions(apps, schema_editor, window=20):
+    """
+    Computes the stored suggestions for every trading date, as the backfill_suggestions command does,
+    for the prices loaded before the Suggestion table existed. Reads the prices for 'window' dates per query.
+    """
+    StockPrice = apps.get_model('api', 'StockPrice')
+    Suggestion = apps.get_model('api', 'Suggestion')
+    TradingDay = apps.get_model('api', 'TradingDay')
+
+    Suggestion.objects.all().delete()
+    calendar = list(TradingDay.objects.order_by('date').values_list('date', flat=True))
+    for i in range(1, len(calendar), window):
+        # The window's dates, preceded by the trading date before the first of them
+        dates = calendar[i - 1:i + window]
+        previous_dates = dict(zip(dates[1:], dates))
+
+        predictions = []
+        closes = {}
+        prices = StockPrice.objects.filter(date__in=dates).order_by('date', 'stock_id')
+        for symbol, date, predicted, actual in prices.values_list('stock_id', 'date', 'predicted_closing_price', 'actual_closing_price'):
+            closes[(symbol, date)] = actual
+            if date in previous_dates:
+                predictions.append((symbol, date, predicted))
+
+        rows = [(symbol, predicted, closes.get((symbol, previous_dates[date]))) for symbol, date, predicted in predictions]
+        Suggestion.objects.bulk_create([Suggestion(stock_id=symbol, date=date, action=suggestion['action'], percent_change=suggestion['percent_change'])
+                                        for (symbol, date, predicted), suggestion in zip(predictions, suggestions_from_rows(rows))])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_dataversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_suggestions, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,12 @@
-from django.db import models
+from asgiref.local import Local
+from django.db import models, transaction
+from django.db.models import Count, F, Max, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
+from .utils import suggestions_from_rows
+
 class Interest(models.Model):
     interest = models.CharField(max_length=100)
 
@@ -10,19 +16,103 @@ class Interest(models.Model):
     class Meta:
         ordering = ['interest']
 
+# Symbols of the stocks being deleted in this thread. Their prices are deleted by the cascade,
+# and the handlers in api.signals sync once for all of them rather than once per price.
+cascade = Local()
+
+def deleting_stock(symbol):
+    return symbol in getattr(cascade, 'symbols', ())
+
+def delete_stocks(delete):
+    """
+    Calls 'delete', then forgets the stocks it marked as being deleted, even if it raised: otherwise the prices of
+    a stock whose delete failed would stay unsynced in this thread.
+    """
+    symbols = getattr(cascade, 'symbols', set())
+    try:
+        return delete()
+    finally:
+        cascade.symbols = symbols
+
+class StockQuerySet(models.QuerySet):
+    def delete(self):
+        return delete_stocks(super().delete)
+
+    def with_price_summary(self):
+        """
+        Annotates each stock with a bounded summary of its prices, computed in the same query:
+        price_count, first_price_date, last_price_date, and the closing prices of the most recent bar.
+        """
+        latest = StockPrice.objects.filter(stock=OuterRef('pk')).order_by('-date')
+        return self.annotate(
+            price_count=Count('stock_prices'),
+            first_price_date=Min('stock_prices__date'),
+            last_price_date=Max('stock_prices__date'),
+            latest_closing_price=Subquery(latest.values('actual_closing_price')[:1]),
+            latest_predicted_closing_price=Subquery(latest.values('predicted_closing_price')[:1]),
+        )
+
 class Stock(models.Model):
     name = models.CharField(max_length=100)
     symbol = models.CharField(max_length=100, primary_key=True)
     category = models.CharField(max_length=100)
 
+    objects = StockQuerySet.as_manager()
+
     def __str__(self):
         return self.symbol
 
+    def delete(self, *args, **kwargs):
+        return delete_stocks(lambda: super(Stock, self).delete(*args, **kwargs))
+
     class Meta:
         ordering = ['name']
 
+class StockPriceQuerySet(models.QuerySet):
+    # Functions giving the first day of the bar that contains a date, by bar interval
+    intervals = {
+        'day': lambda field: F(field),
+        'week': TruncWeek,
+        'month': TruncMonth,
+    }
+
+    def bars(self, interval='day'):
+        """
+        Aggregates the prices into one bar per 'interval' ('day', 'week' or 'month'), oldest first, with two queries.
+        Filter the prices to a single stock first, as the prices of different stocks would be mixed.
+        Returns a list of dicts with:
+        date - The first day of the interval (weeks start on Monday)
+        days - The number of prices in the bar
+        opening_price - The opening price of the first price
+        daily_high, daily_low - The highest high and lowest low
+        actual_closing_price, predicted_closing_price - The closing prices of the last price
+        volume - The total volume
+        """
+        groups = (self.annotate(period=self.intervals[interval]('date'))
+                  .values('period')
+                  .annotate(first_date=Min('date'), last_date=Max('date'), high=Max('daily_high'), low=Min('daily_low'),
+                            total_volume=Sum('volume'), days=Count('id'))
+                  .order_by('period'))
+
+        # Read the first and last price of every bar; the bars are computed again as subqueries
+        edges = {date: (opening, actual, predicted) for date, opening, actual, predicted in
+                 self.filter(Q(date__in=groups.values('first_date')) | Q(date__in=groups.values('last_date')))
+                 .values_list('date', 'opening_price', 'actual_closing_price', 'predicted_closing_price')}
+
+        return [{
+            'date': group['period'],
+            'days': group['days'],
+            'opening_price': edges[group['first_date']][0],
+            'daily_high': group['high'],
+            'daily_low': group['low'],
+            'actual_closing_price': edges[group['last_date']][1],
+            'predicted_closing_price': edges[group['last_date']][2],
+            'volume': group['total_volume'],
+        } for group in groups]
+
 class StockPrice(models.Model):
-    stock = models.ForeignKey(Stock, related_name='stock_prices', on_delete=models.CASCADE)
+    # The unique (stock, date) index leads with stock, so the foreign key needs no index of its own
+    stock = models.ForeignKey(Stock, related_name='stock_prices', on_delete=models.CASCADE, db_index=False)
     date = models.DateField()
     predicted_closing_price = models.DecimalField(max_digits=12, decimal_places=2)
     opening_price = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
@@ -31,6 +121,200 @@ class StockPrice(models.Model):
     daily_low = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
     volume = models.IntegerField(blank=True, null=True)
 
+    objects = StockPriceQuerySet.as_manager()
+
+    class Meta:
+        # One bar per stock per day. Its index also serves a stock's prices newest first (recent=<symbol>),
+        # which databases read by scanning the index backwards
+        unique_together = [['stock', 'date']]
+        indexes = [
+            # Prices on a date or set of dates (recent=all, suggestions), and the keyset pagination order of the price list
+            models.Index(fields=['date', 'id'], name='stockprice_date_id_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+
+        # Remember the stock and date as loaded so that moving a price can be synced to the trading calendar and suggestions
+        instance._loaded_date = instance.__dict__.get('date')
+        instance._loaded_stock_id = instance.__dict__.get('stock_id')
+        return instance
+
+class TradingDayManager(models.Manager):
+    def latest_dates(self, count):
+        """
+        Returns a list of the 'count' most recent trading dates, newest first.
+        """
+        return list(self.order_by('-date').values_list('date', flat=True)[:count])
+
+    def previous_date(self, date):
+        """
+        Returns the trading date immediately before 'date', or None if there is no earlier trading date.
+        """
+        return self.filter(date__lt=date).order_by('-date').values_list('date', flat=True).first()
+
+    def next_date(self, date):
+        """
+        Returns the trading date immediately after 'date', or None if there is no later trading date.
+        """
+        return self.filter(date__gt=date).order_by('date').values_list('date', flat=True).first()
+
+    def sync(self, date):
+        """
+        Adds or removes 'date' from the calendar depending on whether any stock price exists for it.
+        Returns True if the calendar changed.
+        """
+        if StockPrice.objects.filter(date=date).exists():
+            return self.get_or_create(date=date)[1]
+        return self.filter(date=date).delete()[0] > 0
+
+    def rebuild(self):
+        """
+        Rebuilds the whole calendar from the stock price table.
+        Use after bulk loads (bulk_create, QuerySet.update/delete) which do not send model signals.
+        """
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            dates = StockPrice.objects.values_list('date', flat=True).distinct()
+            self.bulk_create([self.model(date=date) for date in dates])
+
+class TradingDay(models.Model):
+    """
+    One row per date that has at least one stock price.
+    Kept in sync with StockPrice by the handlers in api.signals, so date lookups never need to scan StockPrice.
+    """
+    date = models.DateField(primary_key=True)
+
+    objects = TradingDayManager()
+
+    def __str__(self):
+        return str(self.date)
+
+    class Meta:
+        ordering = ['-date']
+
+class SuggestionManager(models.Manager):
+    def refresh(self, date, symbols=None):
+        """
+        Recomputes the stored suggestions for 'date' from the stock prices on that date and the previous trading date.
+        Only the stocks in 'symbols' are recomputed if it is given.
+        """
+        with transaction.atomic(using=self.db):
+            stale = self.filter(date=date)
+            if symbols is not None:
+                stale = stale.filter(stock_id__in=symbols)
+            stale.delete()
+
+            previous_date = TradingDay.objects.previous_date(date)
+            if previous_date is None:
+                return
+
+            # Pair each stock's predicted closing price with its actual closing price from the previous day in one query.
+            # Stocks with no price on the previous day get a null previous close.
+            previous_close = StockPrice.objects.filter(stock=OuterRef('stock'), date=previous_date).values('actual_closing_price')[:1]
+            rows = StockPrice.objects.filter(date=date).annotate(previous_close=Subquery(previous_close))
+            if symbols is not None:
+                rows = rows.filter(stock_id__in=symbols)
+            rows = rows.values_list('stock_id', 'predicted_closing_price', 'previous_close')
+
+            self.bulk_create([self.model(stock_id=suggestion['stock'], date=date, action=suggestion['action'], percent_change=suggestion['percent_change'])
+                              for suggestion in suggestions_from_rows(rows)])
+
+    def refresh_dates(self, dates, window=20, symbols=None):
+        """
+        Recomputes the stored suggestions for many dates, reading the prices for 'window' dates per query.
+        Use for bulk loads and backfills, where calling refresh for each date would be slow.
+        Only the stocks in 'symbols' are recomputed if it is given.
+        """
+        dates = sorted(set(dates))
+        for i in range(0, len(dates), window):
+            self.refresh_window(dates[i:i + window], symbols)
+
+    def refresh_window(self, dates, symbols=None):
+        """
+        Recomputes the stored suggestions for a sorted list of dates with one price query.
+        """
+        with transaction.atomic(using=self.db):
+            stale = self.filter(date__in=dates)
+            if symbols is not None:
+                stale = stale.filter(stock_id__in=symbols)
+            stale.delete()
+
+            # Map each trading date in the window to the trading date before it
+            calendar = [TradingDay.objects.previous_date(dates[0])]
+            calendar += TradingDay.objects.filter(date__range=(dates[0], dates[-1])).order_by('date').values_list('date', flat=True)
+            previous_dates = {date: previous for previous, date in zip(calendar, calendar[1:]) if previous is not None and date in dates}
+            if not previous_dates:
+                return
+
+            predictions = []
+            closes = {}
+            prices = StockPrice.objects.filter(date__in=set(previous_dates) | set(previous_dates.values()))
+            if symbols is not None:
+                prices = prices.filter(stock_id__in=symbols)
+            prices = prices.order_by('date', 'stock_id').values_list('stock_id', 'date', 'predicted_closing_price', 'actual_closing_price')
+            for symbol, date, predicted, actual in prices:
+                closes[(symbol, date)] = actual
+                if date in previous_dates:
+                    predictions.append((symbol, date, predicted))
+
+            rows = [(symbol, predicted, closes.get((symbol, previous_dates[date]))) for symbol, date, predicted in predictions]
+            self.bulk_create([self.model(stock_id=suggestion['stock'], date=date, action=suggestion['action'], percent_change=suggestion['percent_change'])
+                              for (symbol, date, predicted), suggestion in zip(predictions, suggestions_from_rows(rows))])
+
+    def refresh_around(self, date, symbols=None):
+        """
+        Recomputes the suggestions affected by a change to the prices on 'date': those for 'date' itself,
+        and those for the next trading date, which use 'date' as their previous day.
+        """
+        self.refresh(date, symbols)
+        next_date = TradingDay.objects.next_date(date)
+        if next_date is not None:
+            self.refresh(next_date, symbols)
+
+class Suggestion(models.Model):
+    """
+    Precomputed suggestion for a stock on a trading date, so the suggestion view is a single indexed read.
+    Kept up to date by the handlers in api.signals; bulk loads must call Suggestion.objects.refresh themselves
+    (see the backfill_suggestions management command).
+    """
+    stock = models.ForeignKey(Stock, related_name='suggestions', on_delete=models.CASCADE)
+    date = models.DateField()
+    action = models.CharField(max_length=10)
+    percent_change = models.FloatField(blank=True, null=True)
+
+    objects = SuggestionManager()
+
+    class Meta:
+        ordering = ['date', 'stock']
+        unique_together = [['date', 'stock']]
+
+class DataVersionManager(models.Manager):
+    def current(self):
+        """
+        Returns the (version, modified) tuple of the stock data, or (0, None) if it was never changed.
+        """
+        return self.filter(pk=1).values_list('version', 'modified').first() or (0, None)
+
+    def bump(self):
+        """
+        Records a change to the stock data.
+        """
+        if not self.filter(pk=1).update(version=F('version') + 1, modified=timezone.now()):
+            self.get_or_create(pk=1, defaults={'version': 1, 'modified': timezone.now()})
+
+class DataVersion(models.Model):
+    """
+    Change counter for stocks, stock prices and the tables derived from them, used to answer conditional GETs
+    with one primary key lookup. A single row, bumped on every write (see api.cache.stock_data_changed);
+    unlike modification times on the rows themselves, it also changes when rows are deleted.
+    """
+    version = models.BigIntegerField(default=0)
+    modified = models.DateTimeField(default=timezone.now)
+
+    objects = DataVersionManager()
+
 class PCUser(AbstractUser):
     # Get interests from the Interest table
     interests = models.ManyToManyField(Interest)
@@ -0,0 +1,122 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over a unique, indexed ordering such as ('date', 'id').
+    Each page is fetched with 'WHERE key > last key ORDER BY key LIMIT n', so page latency does not grow with depth,
+    and no COUNT query is made. Cursors are opaque and encode the key of the first or last row of the current page.
+    The ordering is read from the view's 'keyset_ordering' attribute; all fields are ascending.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.ordering = view.keyset_ordering
+        self.model = queryset.model
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor[1]
+        if cursor is None:
+            queryset = queryset.order_by(*self.ordering)
+        elif reverse:
+            queryset = queryset.filter(self.keyset_filter(cursor[0], 'lt')).order_by(*['-' + field for field in self.ordering])
+        else:
+            queryset = queryset.filter(self.keyset_filter(cursor[0], 'gt')).order_by(*self.ordering)
+
+        # Fetch one extra row to tell whether there is another page
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.first_key = self.key(results[0]) if results else None
+        self.last_key = self.key(results[-1]) if results else None
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.has_next or self.last_key is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.last_key, False))
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_key is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.first_key, True))
+
+    def keyset_filter(self, values, lookup):
+        """
+        Builds the condition for rows after (lookup 'gt') or before (lookup 'lt') the key 'values' in the ordering,
+        e.g. for ('date', 'id'): date >= d AND (date > d OR (date = d AND id > i)).
+        The leading 'date >= d' lets the database answer it with a range scan of the index.
+        """
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            equal = dict(zip(self.ordering[:i], values[:i]))
+            equal['%s__%s' % (field, lookup)] = values[i]
+            condition |= Q(**equal)
+        return Q(**{'%s__%se' % (self.ordering[0], lookup): values[0]}) & condition
+
+    def key(self, obj):
+        return [getattr(obj, self.model._meta.get_field(field).attname) for field in self.ordering]
+
+    def encode_cursor(self, key, reverse):
+        data = {'k': [value.isoformat() if hasattr(value, 'isoformat') else value for value in key], 'r': int(reverse)}
+        return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+
+    def decode_cursor(self, request):
+        """
+        Returns (key values, reverse) from the request's cursor, or None if there is no cursor.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            values = data['k']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            values = [self.model._meta.get_field(field).to_python(value) for field, value in zip(self.ordering, values)]
+            return values, bool(data.get('r'))
+        except (binascii.Error, ValueError, KeyError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+class KeysetOrPageNumberPagination(BasePagination):
+    """
+    Keyset pagination by default, with the previous page number pagination kept for backwards compatibility.
+    Page numbers are used when the request has '?page=' or '?pagination=page', or when the view's
+    'keyset_ordering' is None (e.g. for a custom ordering).
+    """
+    def paginate_queryset(self, queryset, request, view=None):
+        use_pages = (getattr(view, 'keyset_ordering', None) is None
+                     or 'page' in request.query_params
+                     or request.query_params.get('pagination') == 'page')
+        self.paginator = PageNumberPagination() if use_pages else KeysetPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
@@ -0,0 +1,177 @@
+"""
+Optional date-range partitioning of the stock price table on PostgreSQL, set up by the partition_prices command.
+
+The partitioned table is split into one partition per month or per year of 'date', e.g. api_stockprice_p2020_01 or
+api_stockprice_p2020. It also has a default partition, api_stockprice_default, which holds any dates that no partition
+covers yet. Queries that filter on date, such as recent prices and suggestions, then read only the partitions of those dates.
+
+PostgreSQL requires the primary key and unique constraints of a partitioned table to include the partition key,
+so the primary key becomes (id, date). Ids still come from the same sequence and stay unique. The model and queries
+are unchanged, and other databases such as SQLite keep a plain table.
+
+Partitions for the coming months are created by partition_prices, which should be run regularly (e.g. daily from cron),
+and by the bulk writers in api.ingest for the dates they write. When a partition is created, the rows that landed in
+the default partition for its dates are moved into it.
+"""
+import re
+from datetime import date
+
+from django.db import connection, transaction
+
+from .models import StockPrice
+
+TABLE = StockPrice._meta.db_table
+DEFAULT_PARTITION = TABLE + '_default'
+INTERVALS = ('month', 'year')
+
+# pg_get_expr() of a range partition's bound, e.g. FOR VALUES FROM ('2020-01-01') TO ('2020-02-01')
+BOUND = re.compile(r"FROM \('([0-9-]+)'\) TO \('([0-9-]+)'\)")
+
+def is_partitioned():
+    """
+    Returns whether the stock price table is a partitioned PostgreSQL table.
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+def partition_range(day, interval):
+    """
+    Returns the first day of the month or year containing 'day', and the first day of the next one.
+    """
+    if interval == 'year':
+        return date(day.year, 1, 1), date(day.year + 1, 1, 1)
+    start = date(day.year, day.month, 1)
+    return start, date(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+def partition_name(start, interval):
+    if interval == 'year':
+        return '%s_p%d' % (TABLE, start.year)
+    return '%s_p%d_%02d' % (TABLE, start.year, start.month)
+
+def bound_range(expression):
+    """
+    Returns the (start, end) dates of a partition bound expression, or None for the default partition.
+    """
+    match = BOUND.search(expression)
+    if match is None:
+        return None
+    return date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))
+
+def partitions(cursor):
+    """
+    Returns the sorted (start, end) date ranges of the table's partitions, not counting the default partition.
+    """
+    cursor.execute('SELECT pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                   'WHERE i.inhparent = %s::regclass', [TABLE])
+    return sorted(filter(None, (bound_range(expression) for (expression,) in cursor.fetchall())))
+
+def interval_of(ranges):
+    return 'year' if ranges and (ranges[0][1] - ranges[0][0]).days > 31 else 'month'
+
+def missing_ranges(ranges, dates, interval, ahead):
+    """
+    Returns the sorted ranges needed for 'dates' and for the current and 'ahead' following months or years
+    that none of 'ranges' overlaps.
+    """
+    needed = {partition_range(day, interval) for day in dates}
+    day = date.today()
+    for i in range(ahead + 1):
+        needed.add(partition_range(day, interval))
+        day = partition_range(day, interval)[1]
+    return sorted((start, end) for start, end in needed if not any(s < end and start < e for s, e in ranges))
+
+def create_partition(cursor, start, end, interval):
+    """
+    Creates the partition of [start, end) and moves the rows of those dates from the default partition into it.
+    Attaching a table only blocks concurrent DDL, where CREATE TABLE ... PARTITION OF would block reads and writes too.
+    """
+    quote = connection.ops.quote_name
+    name = quote(partition_name(start, interval))
+    cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)' % (name, quote(TABLE)))
+    cursor.execute('WITH moved AS (DELETE FROM %s WHERE date >= %%s AND date < %%s RETURNING *) INSERT INTO %s SELECT * FROM moved' % (
+        quote(DEFAULT_PARTITION), name), [start, end])
+    cursor.execute("ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM ('%s') TO ('%s')" % (
+        quote(TABLE), name, start.isoformat(), end.isoformat()))
+
+def ensure_partitions(dates=(), ahead=3):
+    """
+    Creates the missing partitions for 'dates' and for the current and 'ahead' following months or years.
+    Returns the names of the partitions created. Does nothing unless the table is partitioned.
+    """
+    if not is_partitioned():
+        return []
+    dates = set(dates)
+    with transaction.atomic(), connection.cursor() as cursor:
+        ranges = partitions(cursor)
+        interval = interval_of(ranges)
+        if not missing_ranges(ranges, dates, interval, ahead):
+            return []
+
+        # Serializes the writers that create partitions, then checks again for partitions created meanwhile
+        cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [TABLE])
+        ranges = partitions(cursor)
+        created = []
+        for start, end in missing_ranges(ranges, dates, interval, ahead):
+            create_partition(cursor, start, end, interval)
+            created.append(partition_name(start, interval))
+        return created
+
+def partition_table(interval='month', ahead=3):
+    """
+    Converts the plain stock price table into a table partitioned by 'interval' of date, with partitions from its
+    first date to 'ahead' months or years from now, and the same columns, constraints and indexes. Returns the names
+    of the partitions created.
+
+    The rows are copied in one transaction that locks the table against reads and writes, which takes a while on a large table.
+    """
+    quote = connection.ops.quote_name
+    table = quote(TABLE)
+    old = quote(TABLE + '_unpartitioned')
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Runs the deferred foreign key checks of earlier writes in the transaction, which would prevent dropping the old table
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' % table)
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        sequence = cursor.fetchone()[0]
+        cursor.execute('ALTER TABLE %s RENAME TO %s' % (table, old))
+
+        # Constraints and indexes, to be created again under the same names once the old table is dropped
+        cursor.execute('SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass',
+                       [TABLE + '_unpartitioned'])
+        constraints = cursor.fetchall()
+        cursor.execute('SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = %s::regclass '
+                       'AND indexrelid NOT IN (SELECT conindid FROM pg_constraint)', [TABLE + '_unpartitioned'])
+        indexes = [re.sub(r' ON (ONLY )?\S+ USING ', ' ON %s USING ' % table, definition, count=1) for (definition,) in cursor.fetchall()]
+
+        cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) PARTITION BY RANGE (date)' % (table, old))
+        cursor.execute('CREATE TABLE %s PARTITION OF %s DEFAULT' % (quote(DEFAULT_PARTITION), table))
+        cursor.execute('SELECT min(date), max(date) FROM %s' % old)
+        first, last = cursor.fetchone()
+        dates = []
+        if first is not None:
+            day = first
+            while day <= last:
+                dates.append(day)
+                day = partition_range(day, interval)[1]
+        created = []
+        for start, end in missing_ranges([], dates, interval, ahead):
+            create_partition(cursor, start, end, interval)
+            created.append(partition_name(start, interval))
+
+        cursor.execute('INSERT INTO %s SELECT * FROM %s' % (table, old))
+        cursor.execute('ALTER SEQUENCE %s OWNED BY %s.id' % (sequence, table))
+        cursor.execute('DROP TABLE %s' % old)
+
+        # Indexes are built after the copy, which is faster than maintaining them row by row
+        for name, kind, definition in constraints:
+            if kind in ('p', 'u') and not re.search(r'\bdate\b', definition):
+                definition = re.sub(r'\)', ', date)', definition, count=1)
+            cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % (table, quote(name), definition))
+        for definition in indexes:
+            cursor.execute(definition)
+        cursor.execute('ANALYZE %s' % table)
+    return created
@@ -0,0 +1,11 @@
+from rest_framework import permissions
+
+class DjangoModelUpsertPermissions(permissions.DjangoModelPermissions):
+    """
+    DjangoModelPermissions for endpoints where a POST may both create and update objects,
+    so it requires the add and change permissions.
+    """
+    perms_map = dict(permissions.DjangoModelPermissions.perms_map, POST=[
+        '%(app_label)s.add_%(model_name)s',
+        '%(app_label)s.change_%(model_name)s',
+    ])
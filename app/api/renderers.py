@@ -0,0 +1,90 @@
+import csv
+import io
+import json
+
+import msgpack
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed, several times faster than the standard library.
+    orjson is an optional dependency, not listed in requirements.txt (see REST_FRAMEWORK in settings).
+    The output is the same as JSONRenderer's: compact, UTF-8, and with Decimal, date, datetime and other types
+    converted by the same encoder, which orjson calls for every type it doesn't handle the same way itself.
+
+    Floats are the exception. orjson writes them in the shortest form that parses back to the same value, e.g.
+    0.00001 where the standard library writes 1e-05, and writes NaN and infinities as null, which JSONRenderer refuses to render.
+
+    Indented output (e.g. for the browsable API), ASCII-only output and data orjson cannot encode, such as integers
+    beyond 64 bits or dicts with keys that are not strings, are rendered by JSONRenderer, as is everything when
+    orjson is not installed.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Escaped like JSONRenderer does, so the output is also valid JavaScript. Both start with the byte 0xE2,
+        # which a single-byte search rules out much faster than searching for either
+        if b'\xe2' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renders a list as newline-delimited JSON (one JSON value per line), and anything else as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(row) + '\n' for row in rows).encode(self.charset)
+
+class CSVRenderer(BaseRenderer):
+    """
+    Renders a list of dicts as CSV, with a header line from the keys of the first dict.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not data:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+        return output.getvalue().encode(self.charset)
+
+class MsgpackRenderer(BaseRenderer):
+    """
+    Renders data as MessagePack. Views that support it send price lists in the columnar layout of api.columnar.
+    """
+    media_type = 'application/x-msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, use_bin_type=True)
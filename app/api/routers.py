@@ -0,0 +1,163 @@
+"""
+Routing of reads to read replicas (settings.DATABASE_REPLICAS, configured from SQL_REPLICAS) and of writes to the primary, 'default'.
+
+Reads go to a replica only while api.middleware.ReplicaRoutingMiddleware serves a safe (GET, HEAD, OPTIONS) request,
+so that writes, the reads of requests that write, management commands such as the nightly import and the shell
+all use the primary. A client that has just written is pinned to the primary for settings.REPLICA_STICKY_SECONDS,
+so it reads its own writes despite replication lag. A login pins the session it starts as well, as the client is
+identified by its new session cookie from its next request on.
+
+Cached API responses (see api.cache) are keyed on the data version, which a request reads from the database it reads
+the data from, before the data. A response filled from a lagging replica is thus stored under the older version it
+belongs to, and clients pinned to the primary, which read the newer version, never get it.
+
+Users and tokens are always read from the primary, so that a client can authenticate with a token it was just issued.
+
+Each request reads from one replica, chosen round robin among those that accept a connection. A replica that does not
+is skipped for settings.REPLICA_RETRY_SECONDS, and reads fall back to the primary when no replica is available.
+"""
+import hashlib
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+
+from asgiref.local import Local
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+state = Local()
+
+# Replica alias -> time.monotonic() until which it is skipped, in this process
+unavailable = {}
+
+turns = itertools.count()
+
+@contextmanager
+def read_from_replicas(replica=''):
+    """
+    Routes the reads made inside the block to a replica, or to 'replica' if one was already chosen.
+    """
+    previous = getattr(state, 'replica', None)
+    # Empty until the first read chooses a replica
+    state.replica = replica
+    try:
+        yield
+    finally:
+        state.replica = previous
+
+def current_replica():
+    """
+    Returns the replica chosen by the reads of the current read_from_replicas() block, '' if none yet.
+    """
+    return getattr(state, 'replica', None) or ''
+
+def stream_from_replicas(content, replica=''):
+    """
+    Iterates the content of a streaming response with its reads routed to 'replica', or to a replica chosen by
+    the first of them. The reads of a streaming response are made after the middleware returned it.
+    """
+    iterator = iter(content)
+    while True:
+        with read_from_replicas(replica):
+            chunk = next(iterator, None)
+            replica = current_replica()
+        if chunk is None:
+            return
+        yield chunk
+
+def available(alias):
+    """
+    Returns whether a replica accepts a connection, connecting to it if needed.
+    """
+    connection = connections[alias]
+    try:
+        # Replaces a persistent connection that the server closed, see api.backends.pool
+        if hasattr(connection, 'close_if_health_check_failed'):
+            connection.close_if_health_check_failed()
+        connection.ensure_connection()
+    except DatabaseError:
+        return False
+    return True
+
+def choose_replica():
+    """
+    Returns the next available replica, or the primary if none is.
+    """
+    replicas = settings.DATABASE_REPLICAS
+    start = next(turns)
+    for i in range(len(replicas)):
+        alias = replicas[(start + i) % len(replicas)]
+        if unavailable.get(alias, 0) > time.monotonic():
+            continue
+        if available(alias):
+            return alias
+        unavailable[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+        logger.warning('Database replica %s is unavailable, skipping it for %d seconds', alias, settings.REPLICA_RETRY_SECONDS)
+    return DEFAULT_DB_ALIAS
+
+class ReplicaRouter:
+    """
+    Database router sending reads to replicas inside read_from_replicas() and everything else to the primary.
+    """
+    def db_for_read(self, model, **hints):
+        if model._meta.label in (settings.AUTH_USER_MODEL, 'authtoken.Token'):
+            return DEFAULT_DB_ALIAS
+        # Related objects are read from the database their instance came from
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return None
+        replica = getattr(state, 'replica', None)
+        if replica is None:
+            return DEFAULT_DB_ALIAS
+        if not replica:
+            replica = state.replica = choose_replica()
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+def client_key(request):
+    """
+    Returns a cache key identifying the client of a request: its token or session, or its address if anonymous.
+    """
+    return pin_key(request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME) or request.META.get('REMOTE_ADDR', ''))
+
+def session_key(response):
+    """
+    Returns the cache key identifying the client by the session cookie a response sets, e.g. on login, or None.
+    """
+    cookie = response.cookies.get(settings.SESSION_COOKIE_NAME)
+    return pin_key(cookie.value) if cookie is not None and cookie.value else None
+
+def pin_key(client):
+    return 'api.replica.pinned.' + hashlib.md5(client.encode()).hexdigest()
+
+def pin_to_primary(key):
+    """
+    Makes the reads of a client use the primary for settings.REPLICA_STICKY_SECONDS.
+    The pins are kept in the 'default' cache, which must be shared by all workers for them to apply across workers.
+    """
+    caches['default'].set(key, True, settings.REPLICA_STICKY_SECONDS)
+
+def pinned_to_primary(key):
+    return caches['default'].get(key, False)
+
+def check_primary_pins(app_configs, **kwargs):
+    """
+    System check warning that the primary pins are not shared between workers when replicas use a local memory cache.
+    """
+    if getattr(settings, 'DATABASE_REPLICAS', None) and isinstance(caches['default'], LocMemCache):
+        return [checks.Warning('Clients are pinned to the primary in a local memory cache, so a client may read from a replica '
+                               'after writing through another worker.', hint='Set CACHE_BACKEND and CACHE_LOCATION to a shared cache.',
+                               id='api.W001')]
+    return []
@@ -1,4 +1,8 @@
-from rest_framework import serializers
+import decimal
+from functools import lru_cache
+
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
 from .models import PCUser, Interest, StockPrice, Stock
 
@@ -14,16 +18,140 @@ class StockPriceSerializer(serializers.ModelSerializer):
         model = StockPrice
         fields = ['id', 'stock', 'date', 'predicted_closing_price', 'opening_price', 'actual_closing_price', 'daily_high', 'daily_low', 'volume']
 
+class StockPriceBulkSerializer(serializers.ModelSerializer):
+    """
+    Validates one row of a bulk price upload. Stocks are checked for the whole upload in one query by the view,
+    and (stock, date) uniqueness is handled by the upsert, so neither needs a query here.
+    """
+    stock = serializers.CharField(max_length=100)
+
+    class Meta:
+        model = StockPrice
+        fields = ['stock', 'date', 'predicted_closing_price', 'opening_price', 'actual_closing_price', 'daily_high', 'daily_low', 'volume']
+        validators = []
+
+class PriceBarSerializer(serializers.Serializer):
+    """
+    A bar of aggregated prices from StockPrice.objects.bars().
+    """
+    date = serializers.DateField()
+    days = serializers.IntegerField()
+    opening_price = serializers.DecimalField(max_digits=12, decimal_places=2, allow_null=True)
+    daily_high = serializers.DecimalField(max_digits=12, decimal_places=2, allow_null=True)
+    daily_low = serializers.DecimalField(max_digits=12, decimal_places=2, allow_null=True)
+    actual_closing_price = serializers.DecimalField(max_digits=12, decimal_places=2, allow_null=True)
+    predicted_closing_price = serializers.DecimalField(max_digits=12, decimal_places=2, allow_null=True)
+    volume = serializers.IntegerField(allow_null=True)
+
+class StockPriceSummarySerializer(serializers.Serializer):
+    """
+    Bounded summary of a stock's prices, read from the annotations added by Stock.objects.with_price_summary().
+    Stocks without the annotations (e.g. one that was just created) are summarized as having no prices.
+    """
+    count = serializers.IntegerField(source='price_count', default=0)
+    first_date = serializers.DateField(source='first_price_date', allow_null=True)
+    last_date = serializers.DateField(source='last_price_date', allow_null=True)
+    latest_closing_price = serializers.DecimalField(max_digits=12, decimal_places=2, allow_null=True)
+    latest_predicted_closing_price = serializers.DecimalField(max_digits=12, decimal_places=2, allow_null=True)
+
 class StockSerializer(serializers.ModelSerializer):
-    stock_prices = serializers.PrimaryKeyRelatedField(many=True, queryset=StockPrice.objects.all())
+    price_summary = StockPriceSummarySerializer(source='*', read_only=True)
 
     class Meta:
         model = Stock
-        fields = ['name', 'symbol', 'category', 'stock_prices']
+        fields = ['name', 'symbol', 'category', 'price_summary']
+
+class StockWithPricesSerializer(StockSerializer):
+    """
+    StockSerializer plus the id of every price of the stock. Use with stock_prices prefetched.
+    """
+    stock_prices = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+
+    class Meta(StockSerializer.Meta):
+        fields = StockSerializer.Meta.fields + ['stock_prices']
 
 class PCUserDetailSerializer(serializers.ModelSerializer):
     interests = serializers.PrimaryKeyRelatedField(many=True, queryset=Interest.objects.all())
 
     class Meta:
         model = PCUser
-        fields = ['id', 'username', 'email', 'interests']
\ No newline at end of file
+        fields = ['id', 'username', 'email', 'interests']
+
+class RowSerializer:
+    """
+    Fast read-only counterpart of a serializer for list endpoints. Turns rows of values_list(*columns) into the same data
+    as the serializer gives for model instances, with one converter per field chosen up front, and no model instances,
+    attribute lookups or per-field to_representation calls.
+
+    Supports fields read from model fields or annotations, related primary keys and nested serializers with source='*'.
+    Raises TypeError for other fields, e.g. many related fields.
+    """
+    def __init__(self, serializer):
+        self.columns = []
+        self.fields = self.compile(serializer)
+
+    def compile(self, serializer):
+        """
+        Returns (name, column index, converter) for each readable field of 'serializer', adding the columns it reads.
+        Nested serializers get a None index and convert the whole row.
+        """
+        fields = []
+        for field in serializer._readable_fields:
+            if isinstance(field, serializers.BaseSerializer):
+                if field.source != '*' or getattr(field, 'many', False):
+                    raise TypeError('%s.%s cannot be read from rows' % (type(serializer).__name__, field.field_name))
+                nested = self.compile(field)
+                fields.append((field.field_name, None, lambda row, nested=nested: self.convert(row, nested)))
+            else:
+                if field.source == '*' or '.' in field.source or isinstance(field, serializers.ManyRelatedField):
+                    raise TypeError('%s.%s cannot be read from rows' % (type(serializer).__name__, field.field_name))
+                fields.append((field.field_name, len(self.columns), converter(field)))
+                self.columns.append(field.source)
+        return fields
+
+    def convert(self, row, fields):
+        data = {}
+        for name, index, convert in fields:
+            value = row if index is None else row[index]
+            data[name] = value if value is None or convert is None else convert(value)
+        return data
+
+    def to_representation(self, rows):
+        fields = self.fields
+        return [self.convert(row, fields) for row in rows]
+
+def converter(field):
+    """
+    Returns a function giving field.to_representation(value) for a non-null value, or None if that is the value itself.
+    """
+    if isinstance(field, serializers.DecimalField):
+        if not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING) or field.localize or field.decimal_places is None:
+            return field.to_representation
+        # DecimalField.quantize builds these for every value
+        quantum = decimal.Decimal('.1') ** field.decimal_places
+        context = decimal.getcontext().copy()
+        if field.max_digits is not None:
+            context.prec = field.max_digits
+        rounding = field.rounding
+
+        def convert_decimal(value):
+            if not isinstance(value, decimal.Decimal):
+                value = decimal.Decimal(str(value).strip())
+            return '{:f}'.format(value.quantize(quantum, rounding=rounding, context=context))
+        return convert_decimal
+    if isinstance(field, serializers.DateField) and (getattr(field, 'format', api_settings.DATE_FORMAT) or '').lower() == ISO_8601:
+        return lambda value: value if isinstance(value, str) else value.isoformat()
+    if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+        return None
+    if type(field) is serializers.IntegerField:
+        return int
+    if type(field) is serializers.CharField:
+        return str
+    return field.to_representation
+
+@lru_cache(maxsize=None)
+def row_serializer(serializer_class):
+    """
+    Returns the RowSerializer of a serializer class, compiled once.
+    """
+    return RowSerializer(serializer_class())
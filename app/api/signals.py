@@ -0,0 +1,113 @@
+from bisect import bisect_right
+
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .cache import interests_changed, stock_data_changed
+from .ingest import batches
+from .models import Interest, PCUser, Stock, StockPrice, Suggestion, TradingDay, cascade, deleting_stock
+
+def sync_price_date(date, symbol):
+    """
+    Syncs the trading calendar for 'date' and recomputes the suggestions affected by a change to 'symbol' on that date.
+    If the calendar changed, every stock's suggestions around 'date' are recomputed, as their previous day changed.
+    """
+    calendar_changed = TradingDay.objects.sync(date)
+    Suggestion.objects.refresh_around(date, None if calendar_changed else [symbol])
+
+@receiver(post_save, sender=StockPrice)
+def stock_price_saved(sender, instance, **kwargs):
+    """
+    Keeps the trading calendar and stored suggestions in sync when a stock price is created or updated.
+    """
+    sync_price_date(instance.date, instance.stock_id)
+
+    # If the price was moved to another date or stock, the old one needs syncing too
+    loaded_date = getattr(instance, '_loaded_date', None)
+    loaded_stock_id = getattr(instance, '_loaded_stock_id', None)
+    if loaded_date is not None and (str(loaded_date) != str(instance.date) or loaded_stock_id != instance.stock_id):
+        sync_price_date(loaded_date, loaded_stock_id)
+    instance._loaded_date = instance.date
+    instance._loaded_stock_id = instance.stock_id
+
+@receiver(post_delete, sender=StockPrice)
+def stock_price_deleted(sender, instance, **kwargs):
+    """
+    Removes the price's date from the trading calendar once its last stock price is deleted, and updates suggestions.
+    """
+    if deleting_stock(instance.stock_id):
+        return
+    sync_price_date(instance.date, instance.stock_id)
+
+@receiver(pre_delete, sender=Stock)
+def stock_deleting(sender, instance, **kwargs):
+    """
+    Remembers the dates of a stock's prices before the cascade deletes them, for stock_deleted.
+    """
+    instance._price_dates = set(StockPrice.objects.filter(stock=instance).values_list('date', flat=True).distinct())
+    cascade.symbols = getattr(cascade, 'symbols', set()) | {instance.pk}
+
+@receiver(post_delete, sender=Stock)
+def stock_deleted(sender, instance, **kwargs):
+    """
+    Syncs the trading calendar and suggestions once after a stock and all its prices were deleted.
+    The stock's own suggestions are deleted by the cascade. Other stocks' suggestions only change if a date left
+    the calendar, for the trading date following it.
+    """
+    cascade.symbols = getattr(cascade, 'symbols', set()) - {instance.pk}
+    dates = getattr(instance, '_price_dates', set())
+    if not dates:
+        return
+
+    # One range read instead of an IN list of every date, which can exceed SQLite's variable limit
+    remaining = set(StockPrice.objects.filter(date__range=(min(dates), max(dates))).values_list('date', flat=True).distinct())
+    removed = sorted(dates - remaining)
+    if not removed:
+        return
+    for batch in batches(removed):
+        TradingDay.objects.filter(date__in=batch).delete()
+
+    calendar = list(TradingDay.objects.filter(date__gt=removed[0]).order_by('date').values_list('date', flat=True))
+    following = {bisect_right(calendar, date) for date in removed}
+    Suggestion.objects.refresh_dates(calendar[i] for i in following if i < len(calendar))
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+@receiver(post_save, sender=StockPrice)
+@receiver(post_delete, sender=StockPrice)
+def stock_or_price_changed(sender, **kwargs):
+    """
+    Bumps the data version, which the cached API responses are keyed on, when a stock or stock price changes.
+    """
+    # Once for a stock, not for each price deleted with it
+    if sender is StockPrice and deleting_stock(kwargs['instance'].stock_id):
+        return
+    stock_data_changed()
+
+@receiver(post_save, sender=Interest)
+@receiver(post_delete, sender=Interest)
+def interest_changed(sender, **kwargs):
+    """
+    Bumps the data version, which the interest -> stock symbols index is keyed on, when an interest changes.
+    Changes to stocks bump it in stock_or_price_changed.
+    """
+    interests_changed()
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed(sender, instance, **kwargs):
+    """
+    Revokes a token in the authentication cache when it is deleted, e.g. on logout.
+    """
+    token_cache.revoke(key=instance.key)
+
+@receiver(post_save, sender=PCUser)
+@receiver(post_delete, sender=PCUser)
+def user_changed(sender, instance, **kwargs):
+    """
+    Revokes a user's tokens in the authentication cache when the user changes, e.g. is deactivated.
+    """
+    token_cache.revoke(user_id=instance.pk)
@@ -1,12 +1,61 @@
-from datetime import date
-
-from django.test import TestCase
+import asyncio
+import gzip
+import importlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta, timezone
+from io import StringIO
+from unittest import mock, skipUnless
+from decimal import Decimal
+from math import isnan
+
+import msgpack
+from prometheus_client import REGISTRY
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.apps import apps
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, router, transaction
+from django.db.models import F
+from django.db.models.signals import pre_delete
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import Permission
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 from rest_framework.authtoken.models import Token
 
-from .models import PCUser, Interest, Stock, StockPrice
-from .utils import stock_suggestions
+from Project_Capitalizer.asgi import application
+
+from .authentication import CachedTokenAuthentication, TokenCache, token_cache
+from .backends.pool import ConnectionPool, PoolTimeout, get_pool, ping, pools
+from .backends.sqlite3.base import DatabaseWrapper
+from .benchmarks import market_data, percentile
+from .cache import response_cache
+from .columnar import price_columns, price_rows
+from . import ingest
+from .ingest import sync_derived_tables, upsert_prices, upsert_prices_portable
+from .metrics import latest
+from .middleware import RequestTimingMiddleware
+from .pagination import KeysetPagination
+from . import renderers
+from .renderers import FastJSONRenderer
+from .partitioning import bound_range, ensure_partitions, is_partitioned, missing_ranges, partition_name, partition_range
+from .routers import check_primary_pins, read_from_replicas, unavailable
+from .models import DataVersion, PCUser, Interest, Stock, StockPrice, Suggestion, TradingDay, deleting_stock
+from .serializers import RowSerializer, StockWithPricesSerializer
+from .utils import batch_suggestions, stock_suggestions
+from .views import RowListMixin, StockList
 
 class UserTestCase(TestCase):
     """
@@ -81,14 +130,14 @@ class StockPriceTestCase(TestCase):
         StockPrice.objects.create(stock=stock1, date='2020-01-02', predicted_closing_price='5.05')
 
     def test_create_stock_price(self):
-        expectedData = {'id': 3, 'stock': 'tst1', 'date': '2020-01-01', 'predicted_closing_price': '5.00', 'opening_price': None, 'actual_closing_price': None, 'daily_high': None, 'daily_low': None, 'volume': None }
+        expectedData = {'id': 3, 'stock': 'tst1', 'date': '2020-01-03', 'predicted_closing_price': '5.00', 'opening_price': None, 'actual_closing_price': None, 'daily_high': None, 'daily_low': None, 'volume': None }
         
         # Arrange (special user)
         client = APIClient()
         client.credentials(HTTP_AUTHORIZATION='Token ' + self.sUserToken)
 
         # Act
-        response = client.post('/api/v1/stock-price/', {'stock': 'tst1', 'date': '2020-01-01', 'predicted_closing_price': '5.00'})
+        response = client.post('/api/v1/stock-price/', {'stock': 'tst1', 'date': '2020-01-03', 'predicted_closing_price': '5.00'})
 
         # Assert
         self.assertEquals(response.status_code, 201)
@@ -286,8 +335,8 @@ class StockTestCase(TestCase):
 
     def test_get_all_stocks(self):
         expectedData = [
-            {'name': 'test1', 'symbol': 'tst1', 'category': 'cat1', 'stock_prices': [1, 2, 3]},
-            {'name': 'test2', 'symbol': 'tst2', 'category': 'cat2', 'stock_prices': [4, 5, 6]},
+            {'name': 'test1', 'symbol': 'tst1', 'category': 'cat1', 'price_summary': {'count': 3, 'first_date': '2020-01-01', 'last_date': '2020-01-03', 'latest_closing_price': None, 'latest_predicted_closing_price': '5.10'}},
+            {'name': 'test2', 'symbol': 'tst2', 'category': 'cat2', 'price_summary': {'count': 3, 'first_date': '2020-01-01', 'last_date': '2020-01-03', 'latest_closing_price': None, 'latest_predicted_closing_price': '6.10'}},
             ]
 
         # Arrange (special user)
@@ -314,7 +363,7 @@ class StockTestCase(TestCase):
         self.assertEquals(response.data, expectedData)
 
     def test_get_a_stock(self):
-        expectedData = {'name': 'test2', 'symbol': 'tst2', 'category': 'cat2', 'stock_prices': [4, 5, 6]}
+        expectedData = {'name': 'test2', 'symbol': 'tst2', 'category': 'cat2', 'price_summary': {'count': 3, 'first_date': '2020-01-01', 'last_date': '2020-01-03', 'latest_closing_price': None, 'latest_predicted_closing_price': '6.10'}}
 
         # Arrange (special user)
         client = APIClient()
@@ -351,7 +400,7 @@ class StockTestCase(TestCase):
         self.assertEquals(response.status_code, 404)
 
     def test_create_stock(self):
-        expectedData = {'name': 'test3', 'symbol': 'tst3', 'category': 'cat3', 'stock_prices': []}
+        expectedData = {'name': 'test3', 'symbol': 'tst3', 'category': 'cat3', 'price_summary': {'count': 0, 'first_date': None, 'last_date': None, 'latest_closing_price': None, 'latest_predicted_closing_price': None}}
 
         # Arrange (special user)
         client = APIClient()
@@ -376,7 +425,7 @@ class StockTestCase(TestCase):
         self.assertEquals(response.status_code, 403)
     
     def test_patch_stock(self):
-        expectedData = {'name': 'test2', 'symbol': 'tst2', 'category': 'cat3', 'stock_prices': [4, 5, 6]}
+        expectedData = {'name': 'test2', 'symbol': 'tst2', 'category': 'cat3', 'price_summary': {'count': 3, 'first_date': '2020-01-01', 'last_date': '2020-01-03', 'latest_closing_price': None, 'latest_predicted_closing_price': '6.10'}}
 
         # Arrange (special user)
         client = APIClient()
@@ -401,7 +450,7 @@ class StockTestCase(TestCase):
         self.assertEquals(response.status_code, 403)
     
     def test_put_stock(self):
-        expectedData = {'name': 'test2', 'symbol': 'tst2', 'category': 'cat3', 'stock_prices': [4, 5, 6]}
+        expectedData = {'name': 'test2', 'symbol': 'tst2', 'category': 'cat3', 'price_summary': {'count': 3, 'first_date': '2020-01-01', 'last_date': '2020-01-03', 'latest_closing_price': None, 'latest_predicted_closing_price': '6.10'}}
 
         # Arrange (special user)
         client = APIClient()
@@ -457,8 +506,11 @@ class SuggestionViewTestCase(TestCase):
         self.userToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
 
         stock1 = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
+        stock2 = Stock.objects.create(name='test2', symbol='tst2', category='testCat')
+        StockPrice.objects.create(stock=stock1, date='2019-12-31', predicted_closing_price="5.00", actual_closing_price='5.00')
+        StockPrice.objects.create(stock=stock2, date='2019-12-31', predicted_closing_price="5.00", actual_closing_price='5.00')
         StockPrice.objects.create(stock=stock1, date='2020-01-01', opening_price='5.00', predicted_closing_price="10.00")
-        StockPrice.objects.create(stock=stock1, date='2020-01-01', opening_price='5.00', predicted_closing_price="0.00")
+        StockPrice.objects.create(stock=stock2, date='2020-01-01', opening_price='5.00', predicted_closing_price="0.00")
 
     def test_must_be_authenticated(self):
         # Arrange
@@ -490,13 +542,14 @@ class SuggestionAlgorithmTestCase(TestCase):
         # Arrange
         stock1 = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
         StockPrice.objects.create(stock=stock1, date=date.today(), opening_price='1.00', predicted_closing_price="2.00")    #  1.0 change
-        StockPrice.objects.create(stock=stock1, date=date.today(), opening_price='1.00', predicted_closing_price="0.00")    # -1.0 change
-        prices = StockPrice.objects.filter(stock=stock1)
+        StockPrice.objects.create(stock=stock1, date=date(2020, 1, 2), opening_price='1.00', predicted_closing_price="0.00")    # -1.0 change
+        prices = StockPrice.objects.filter(stock=stock1).order_by('id')
+        prices_before = [StockPrice(stock=stock1, predicted_closing_price='1.00', actual_closing_price=Decimal('1.00'))] * 2
 
         expected = [{'stock': 'tst1', 'action': 'buy', 'percent_change': 1.0}, {'stock': 'tst1', 'action': 'sell', 'percent_change': -1.0}, ]
 
         # Act
-        result = stock_suggestions(prices, -0.1, 0.1)
+        result = stock_suggestions(prices, prices_before, -0.1, 0.1)
 
         # Assert
         self.assertEqual(result, expected)
@@ -505,15 +558,16 @@ class SuggestionAlgorithmTestCase(TestCase):
         # Arrange
         stock1 = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
         StockPrice.objects.create(stock=stock1, date='2020-01-01', opening_price='1.00', predicted_closing_price="1.10")    #  0.1 change
-        StockPrice.objects.create(stock=stock1, date='2020-01-01', opening_price='1.00', predicted_closing_price="0.90")    # -0.1 change
-        prices = StockPrice.objects.filter(stock=stock1)
+        StockPrice.objects.create(stock=stock1, date='2020-01-02', opening_price='1.00', predicted_closing_price="0.90")    # -0.1 change
+        prices = StockPrice.objects.filter(stock=stock1).order_by('id')
+        prices_before = [StockPrice(stock=stock1, predicted_closing_price='1.00', actual_closing_price=Decimal('1.00'))] * 2
 
         expectedStocks = ['tst1', 'tst1']
         expectedActions = ['hold', 'hold']
         expectedChange = [0.1, -0.1]
 
         # Act
-        result = stock_suggestions(prices, -0.1, 0.1)
+        result = stock_suggestions(prices, prices_before, -0.1, 0.1)
         stocks = [suggest['stock'] for suggest in result]
         actions = [suggest['action'] for suggest in result]
         change = [suggest['percent_change'] for suggest in result]
@@ -528,12 +582,2516 @@ class SuggestionAlgorithmTestCase(TestCase):
         # Arrange
         stock1 = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
         StockPrice.objects.create(stock=stock1, date='2020-01-01', opening_price='1.00', predicted_closing_price="1.00")    #  0.0 change
-        prices = StockPrice.objects.filter(stock=stock1)
+        prices = StockPrice.objects.filter(stock=stock1).order_by('id')
+        prices_before = [StockPrice(stock=stock1, predicted_closing_price='1.00', actual_closing_price=Decimal('1.00'))]
 
         expected = [{'stock': 'tst1', 'action': 'hold', 'percent_change': 0.0},]
 
         # Act
-        result = stock_suggestions(prices, -0.1, 0.1)
+        result = stock_suggestions(prices, prices_before, -0.1, 0.1)
+
+        # Assert
+        self.assertEquals(result, expected)
+
+    def test_mismatched_lengths(self):
+        # Arrange
+        stock1 = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
+        prices = [StockPrice(stock=stock1, predicted_closing_price=Decimal('1.00'))]
+
+        # Act
+        result = stock_suggestions(prices, [], -0.1, 0.1)
+
+        # Assert
+        self.assertIsNone(result)
+
+    def test_batch_matches_decimal_arithmetic(self):
+        # Arrange (predicted prices on and one cent either side of both thresholds)
+        previous = []
+        predicted = []
+        for cents in range(20, 2000, 7):
+            for target in (cents * 105 // 100, cents * 95 // 100):
+                for offset in (-1, 0, 1):
+                    previous.append(Decimal(cents) / 100)
+                    predicted.append(Decimal(target + offset) / 100)
+        predicted[3] = None
+        previous[5] = None
+
+        expected = []
+        for before, today in zip(previous, predicted):
+            if before is None or today is None:
+                expected.append('unknown')
+                continue
+            change = (today - before) / before
+            expected.append('buy' if change > 0.05 else 'sell' if change < -0.05 else 'hold')
+
+        # Act
+        actions, changes = batch_suggestions(previous, predicted)
+
+        # Assert
+        self.assertEquals(list(actions), expected)
+        self.assertTrue(isnan(changes[3]) and isnan(changes[5]))
+
+    def test_zero_previous_close_is_unknown(self):
+        # Act
+        actions, changes = batch_suggestions([Decimal('0.00')], [Decimal('1.00')])
+
+        # Assert
+        self.assertEquals(list(actions), ['unknown'])
+
+class TradingDayTestCase(TestCase):
+    """
+    Tests that the trading calendar stays in sync with stock prices
+    """
+    def setUp(self):
+        self.stock1 = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
+        self.stock2 = Stock.objects.create(name='test2', symbol='tst2', category='testCat')
+        StockPrice.objects.create(stock=self.stock1, date='2020-01-01', predicted_closing_price='5.00')
+        StockPrice.objects.create(stock=self.stock2, date='2020-01-01', predicted_closing_price='6.00')
+        StockPrice.objects.create(stock=self.stock1, date='2020-01-02', predicted_closing_price='5.05')
+        StockPrice.objects.create(stock=self.stock1, date='2020-01-06', predicted_closing_price='5.10')
+
+    def test_created_prices_add_dates(self):
+        # Act
+        dates = TradingDay.objects.latest_dates(5)
+
+        # Assert
+        self.assertEquals(dates, [date(2020, 1, 6), date(2020, 1, 2), date(2020, 1, 1)])
+
+    def test_latest_dates_is_limited(self):
+        # Act
+        dates = TradingDay.objects.latest_dates(2)
+
+        # Assert
+        self.assertEquals(dates, [date(2020, 1, 6), date(2020, 1, 2)])
+
+    def test_previous_date(self):
+        # Act / Assert
+        self.assertEquals(TradingDay.objects.previous_date(date(2020, 1, 6)), date(2020, 1, 2))
+        self.assertEquals(TradingDay.objects.previous_date(date(2020, 1, 5)), date(2020, 1, 2))
+        self.assertIsNone(TradingDay.objects.previous_date(date(2020, 1, 1)))
+
+    def test_deleting_last_price_removes_date(self):
+        # Act
+        StockPrice.objects.get(stock=self.stock1, date='2020-01-01').delete()
+        datesAfterFirstDelete = TradingDay.objects.latest_dates(5)
+        StockPrice.objects.get(stock=self.stock2, date='2020-01-01').delete()
+        datesAfterSecondDelete = TradingDay.objects.latest_dates(5)
+
+        # Assert
+        self.assertIn(date(2020, 1, 1), datesAfterFirstDelete)
+        self.assertNotIn(date(2020, 1, 1), datesAfterSecondDelete)
+
+    def test_moving_price_moves_date(self):
+        # Arrange
+        price = StockPrice.objects.get(date='2020-01-06')
+
+        # Act
+        price.date = date(2020, 1, 7)
+        price.save()
+
+        # Assert
+        self.assertEquals(TradingDay.objects.latest_dates(5), [date(2020, 1, 7), date(2020, 1, 2), date(2020, 1, 1)])
+
+    def test_deleting_stock_removes_its_dates(self):
+        # Act
+        self.stock1.delete()
+
+        # Assert
+        self.assertEquals(TradingDay.objects.latest_dates(5), [date(2020, 1, 1)])
+
+    def test_rebuild_after_bulk_load(self):
+        # Arrange
+        StockPrice.objects.bulk_create([StockPrice(stock=self.stock2, date=date(2020, 1, 8), predicted_closing_price='6.10')])
+        StockPrice.objects.filter(date='2020-01-01').delete()
+
+        # Act
+        TradingDay.objects.rebuild()
+
+        # Assert
+        self.assertEquals(TradingDay.objects.latest_dates(5), [date(2020, 1, 8), date(2020, 1, 6), date(2020, 1, 2)])
+
+    def test_recent_prices_use_calendar(self):
+        # Arrange
+        PCUser.objects.create_user('regular', password='1234')
+        token = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        for day in range(7, 12):
+            StockPrice.objects.create(stock=self.stock1, date=date(2020, 1, day), predicted_closing_price='5.00')
+
+        # Act
+        response = client.get('/api/v1/stock-price/?recent=all')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([price['date'] for price in response.data['results']], ['2020-01-11', '2020-01-10', '2020-01-09', '2020-01-08', '2020-01-07'])
+
+class SuggestionQueryTestCase(TestCase):
+    """
+    Tests that the suggestion view pairs prices by symbol with a constant number of queries
+    """
+    def setUp(self):
+        PCUser.objects.create_user('regular', password='1234')
+        self.userToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+
+        stock1 = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
+        stock2 = Stock.objects.create(name='test2', symbol='tst2', category='testCat')
+        stock3 = Stock.objects.create(name='test3', symbol='tst3', category='testCat')
+        stock4 = Stock.objects.create(name='test4', symbol='tst4', category='testCat')
+
+        StockPrice.objects.create(stock=stock1, date='2020-01-01', predicted_closing_price='1.00', actual_closing_price='1.00')
+        StockPrice.objects.create(stock=stock2, date='2020-01-01', predicted_closing_price='1.00', actual_closing_price='1.00')
+        StockPrice.objects.create(stock=stock4, date='2020-01-01', predicted_closing_price='1.00', actual_closing_price='1.00')
+        StockPrice.objects.create(stock=stock1, date='2020-01-02', predicted_closing_price='2.00')
+        StockPrice.objects.create(stock=stock2, date='2020-01-02', predicted_closing_price='0.50')
+        StockPrice.objects.create(stock=stock3, date='2020-01-02', predicted_closing_price='1.00')
+
+    def get_suggestions(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.userToken)
+        token_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/v1/suggestion/?date=2020-01-02')
+        return response, len(queries)
+
+    def test_pairs_by_symbol(self):
+        expected = [
+            {'stock': 'tst1', 'action': 'buy', 'percent_change': 1},
+            {'stock': 'tst2', 'action': 'sell', 'percent_change': -0.5},
+            {'stock': 'tst3', 'action': 'unknown', 'percent_change': None},   # No price on the previous day
+            ]
+
+        # Act
+        response, queryCount = self.get_suggestions()
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['suggestions'], expected)
+
+    def test_query_count_is_constant(self):
+        # Arrange
+        response, queryCountBefore = self.get_suggestions()
+        for i in range(10):
+            stock = Stock.objects.create(name='extra%d' % i, symbol='ext%d' % i, category='testCat')
+            StockPrice.objects.create(stock=stock, date='2020-01-01', predicted_closing_price='1.00', actual_closing_price='1.00')
+            StockPrice.objects.create(stock=stock, date='2020-01-02', predicted_closing_price='1.01')
+
+        # Act
+        response, queryCountAfter = self.get_suggestions()
+
+        # Assert
+        self.assertEquals(len(response.data['suggestions']), 13)
+        self.assertEquals(queryCountAfter, queryCountBefore)
+
+    def test_no_previous_date(self):
+        # Arrange
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.userToken)
+
+        # Act
+        response = client.get('/api/v1/suggestion/?date=2020-01-01')
+
+        # Assert
+        self.assertEquals(response.status_code, 400)
+
+class SuggestionStoreTestCase(TestCase):
+    """
+    Tests that stored suggestions are kept up to date as prices change
+    """
+    def setUp(self):
+        self.stock1 = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
+        self.stock2 = Stock.objects.create(name='test2', symbol='tst2', category='testCat')
+        StockPrice.objects.create(stock=self.stock1, date='2020-01-01', predicted_closing_price='1.00', actual_closing_price='1.00')
+        StockPrice.objects.create(stock=self.stock2, date='2020-01-01', predicted_closing_price='1.00', actual_closing_price='1.00')
+        StockPrice.objects.create(stock=self.stock1, date='2020-01-03', predicted_closing_price='2.00')
+        StockPrice.objects.create(stock=self.stock2, date='2020-01-03', predicted_closing_price='1.00')
+
+    def stored(self, day):
+        return list(Suggestion.objects.filter(date=day).order_by('stock_id').values_list('stock_id', 'action', 'percent_change'))
+
+    def test_created_prices_are_suggested(self):
+        # Assert
+        self.assertEquals(self.stored('2020-01-01'), [])
+        self.assertEquals(self.stored('2020-01-03'), [('tst1', 'buy', 1.0), ('tst2', 'hold', 0.0)])
+
+    def test_updating_prediction_updates_suggestion(self):
+        # Arrange
+        price = StockPrice.objects.get(stock=self.stock2, date='2020-01-03')
+
+        # Act
+        price.predicted_closing_price = Decimal('0.50')
+        price.save()
+
+        # Assert
+        self.assertEquals(self.stored('2020-01-03'), [('tst1', 'buy', 1.0), ('tst2', 'sell', -0.5)])
+
+    def test_updating_previous_close_updates_next_day(self):
+        # Arrange
+        price = StockPrice.objects.get(stock=self.stock1, date='2020-01-01')
+
+        # Act
+        price.actual_closing_price = Decimal('2.00')
+        price.save()
+
+        # Assert
+        self.assertEquals(self.stored('2020-01-03'), [('tst1', 'hold', 0.0), ('tst2', 'hold', 0.0)])
+
+    def test_new_trading_date_recomputes_following_date(self):
+        # Act
+        StockPrice.objects.create(stock=self.stock1, date='2020-01-02', predicted_closing_price='1.00', actual_closing_price='4.00')
+
+        # Assert
+        self.assertEquals(self.stored('2020-01-02'), [('tst1', 'hold', 0.0)])
+        self.assertEquals(self.stored('2020-01-03'), [('tst1', 'sell', -0.5), ('tst2', 'unknown', None)])
+
+    def test_deleting_prices_removes_suggestions(self):
+        # Act
+        StockPrice.objects.filter(date='2020-01-01').delete()
+
+        # Assert
+        self.assertEquals(self.stored('2020-01-03'), [])
+
+    def test_deleting_stock_refreshes_following_date(self):
+        # Arrange (a stock whose only price adds 2020-01-02 to the calendar)
+        stock3 = Stock.objects.create(name='test3', symbol='tst3', category='testCat')
+        StockPrice.objects.create(stock=stock3, date='2020-01-02', predicted_closing_price='1.00', actual_closing_price='4.00')
+
+        # Act
+        stock3.delete()
+
+        # Assert
+        self.assertEquals(TradingDay.objects.latest_dates(5), [date(2020, 1, 3), date(2020, 1, 1)])
+        self.assertEquals(self.stored('2020-01-03'), [('tst1', 'buy', 1.0), ('tst2', 'hold', 0.0)])
+
+    def test_failed_stock_delete_is_forgotten(self):
+        # Arrange
+        def fail(sender, **kwargs):
+            raise IntegrityError('test')
+        pre_delete.connect(fail, sender=Stock)
+        try:
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                self.stock1.delete()
+        finally:
+            pre_delete.disconnect(fail, sender=Stock)
+
+        # Act
+        StockPrice.objects.get(stock=self.stock1, date='2020-01-03').delete()
+
+        # Assert
+        self.assertFalse(deleting_stock('tst1'))
+        self.assertEquals(self.stored('2020-01-03'), [('tst2', 'hold', 0.0)])
+
+    def test_deleting_stock_query_count_is_constant(self):
+        # Arrange (stocks with 2 and 30 prices, on dates another stock keeps in the calendar)
+        counts = []
+        for count in (2, 30):
+            stock = Stock.objects.create(name='test%d' % count, symbol='ext%d' % count, category='testCat')
+            for i in range(count):
+                day = date(2019, 1, 1) + timedelta(days=i)
+                StockPrice.objects.get_or_create(stock=self.stock1, date=day, defaults={'predicted_closing_price': '1.00'})
+                StockPrice.objects.create(stock=stock, date=day, predicted_closing_price='1.00')
+
+            # Act
+            with CaptureQueriesContext(connection) as queries:
+                stock.delete()
+            counts.append(len(queries))
+
+        # Assert
+        self.assertEquals(counts[0], counts[1])
+        self.assertEquals(StockPrice.objects.filter(stock__in=['ext2', 'ext30']).count(), 0)
+
+    def test_backfill_after_bulk_load(self):
+        # Arrange
+        StockPrice.objects.bulk_create([
+            StockPrice(stock=self.stock1, date=date(2020, 1, 6), predicted_closing_price='3.00'),
+            StockPrice(stock=self.stock2, date=date(2020, 1, 6), predicted_closing_price='1.00'),
+            ])
+        StockPrice.objects.filter(date='2020-01-03').update(actual_closing_price='2.00')
+
+        # Act
+        call_command('backfill_suggestions', '--rebuild-calendar', stdout=StringIO())
+
+        # Assert
+        self.assertEquals(self.stored('2020-01-06'), [('tst1', 'buy', 0.5), ('tst2', 'sell', -0.5)])
+
+    def test_migration_backfills_existing_prices(self):
+        # Arrange
+        backfill_suggestions = importlib.import_module('api.migrations.0009_backfill_suggestions').backfill_suggestions
+        StockPrice.objects.create(stock=self.stock1, date='2020-01-06', predicted_closing_price='3.00')
+        StockPrice.objects.filter(date='2020-01-03').update(actual_closing_price='2.00')
+        Suggestion.objects.all().delete()
+
+        # Act
+        backfill_suggestions(apps, None, window=1)
+
+        # Assert
+        self.assertEquals(self.stored('2020-01-01'), [])
+        self.assertEquals(self.stored('2020-01-03'), [('tst1', 'buy', 1.0), ('tst2', 'hold', 0.0)])
+        self.assertEquals(self.stored('2020-01-06'), [('tst1', 'buy', 0.5)])
+
+    def test_view_reads_stored_suggestions(self):
+        # Arrange
+        PCUser.objects.create_user('regular', password='1234')
+        token = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+        # Act
+        response = client.get('/api/v1/suggestion/?date=2020-01-03')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['suggestions'], [{'stock': 'tst1', 'action': 'buy', 'percent_change': 1.0}, {'stock': 'tst2', 'action': 'hold', 'percent_change': 0.0}])
+
+class StockPriceBulkTestCase(TestCase):
+    """
+    Tests the bulk stock price upload
+    """
+    def setUp(self):
+        PCUser.objects.create_user('regular', password='1234')
+        addUser = PCUser.objects.create_user('adder', password='1234')
+        addUser.user_permissions.add(Permission.objects.get(codename='add_stockprice'))
+        specialUser = PCUser.objects.create_user('special', password='1234')
+        specialUser.user_permissions.add(Permission.objects.get(codename='add_stockprice'))
+        specialUser.user_permissions.add(Permission.objects.get(codename='change_stockprice'))
+
+        self.rUserToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+        self.aUserToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'adder', 'password': '1234'}).data['key']
+        self.sUserToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'special', 'password': '1234'}).data['key']
+
+        stock1 = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
+        Stock.objects.create(name='test2', symbol='tst2', category='testCat')
+        StockPrice.objects.create(stock=stock1, date='2020-01-01', predicted_closing_price='1.00', actual_closing_price='1.00')
+
+    def client_for(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        return client
+
+    def test_upsert_json_array(self):
+        # Arrange
+        client = self.client_for(self.sUserToken)
+        body = [
+            {'stock': 'tst1', 'date': '2020-01-01', 'predicted_closing_price': '1.00', 'actual_closing_price': '2.00'},
+            {'stock': 'tst1', 'date': '2020-01-02', 'predicted_closing_price': '3.00'},
+            {'stock': 'tst2', 'date': '2020-01-02', 'predicted_closing_price': '4.00', 'volume': 100},
+            ]
+
+        # Act
+        response = client.post('/api/v1/stock-price/bulk/', body, format='json')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data, {'created': 2, 'updated': 1, 'errors': []})
+        self.assertEquals(StockPrice.objects.count(), 3)
+        self.assertEquals(StockPrice.objects.get(stock='tst1', date='2020-01-01').actual_closing_price, Decimal('2.00'))
+        self.assertEquals(StockPrice.objects.get(stock='tst2', date='2020-01-02').volume, 100)
+
+    def test_upsert_ndjson(self):
+        # Arrange
+        client = self.client_for(self.sUserToken)
+        body = '{"stock": "tst1", "date": "2020-01-02", "predicted_closing_price": "3.00"}\n\n{"stock": "tst2", "date": "2020-01-02", "predicted_closing_price": "4.00"}\n'
+
+        # Act
+        response = client.post('/api/v1/stock-price/bulk/', body, content_type='application/x-ndjson')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data, {'created': 2, 'updated': 0, 'errors': []})
+
+    def test_invalid_ndjson(self):
+        # Arrange
+        client = self.client_for(self.sUserToken)
+
+        # Act
+        response = client.post('/api/v1/stock-price/bulk/', '{"stock": "tst1"}\n{oops\n', content_type='application/x-ndjson')
+
+        # Assert
+        self.assertEquals(response.status_code, 400)
+        self.assertIn('line 2', response.data['detail'])
+
+    def test_reports_row_errors(self):
+        # Arrange
+        client = self.client_for(self.sUserToken)
+        body = [
+            {'stock': 'nope', 'date': '2020-01-02', 'predicted_closing_price': '3.00'},
+            {'stock': 'tst1', 'date': 'not a date', 'predicted_closing_price': '3.00'},
+            {'stock': 'tst2', 'date': '2020-01-02', 'predicted_closing_price': '4.00'},
+            ]
+
+        # Act
+        response = client.post('/api/v1/stock-price/bulk/', body, format='json')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['created'], 1)
+        self.assertEquals([error['index'] for error in response.data['errors']], [0, 1])
+        self.assertIn('stock', response.data['errors'][0]['errors'])
+        self.assertIn('date', response.data['errors'][1]['errors'])
+
+    def test_all_rows_invalid(self):
+        # Arrange
+        client = self.client_for(self.sUserToken)
+
+        # Act
+        response = client.post('/api/v1/stock-price/bulk/', [{'stock': 'nope', 'date': '2020-01-02', 'predicted_closing_price': '3.00'}], format='json')
+
+        # Assert
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(StockPrice.objects.count(), 1)
+
+    def test_stocks_checked_in_one_query(self):
+        # Arrange
+        client = self.client_for(self.sUserToken)
+        body = [{'stock': symbol, 'date': '2020-01-0%d' % day, 'predicted_closing_price': '1.00'} for symbol in ['tst1', 'tst2'] for day in range(2, 10)]
+
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post('/api/v1/stock-price/bulk/', body, format='json')
+
+        # Assert
+        self.assertEquals(response.data['created'], 16)
+        self.assertEquals(len([query for query in queries if 'FROM "api_stock" WHERE' in query['sql']]), 1)
+
+    def test_updates_calendar_and_suggestions(self):
+        # Arrange
+        client = self.client_for(self.sUserToken)
+
+        # Act
+        client.post('/api/v1/stock-price/bulk/', [{'stock': 'tst1', 'date': '2020-01-02', 'predicted_closing_price': '1.50'}], format='json')
+
+        # Assert
+        self.assertEquals(TradingDay.objects.latest_dates(5), [date(2020, 1, 2), date(2020, 1, 1)])
+        self.assertEquals(list(Suggestion.objects.values_list('stock_id', 'date', 'action')), [('tst1', date(2020, 1, 2), 'buy')])
+
+    def test_portable_upsert(self):
+        # Arrange
+        rows = [
+            {'stock': 'tst1', 'date': date(2020, 1, 1), 'predicted_closing_price': Decimal('1.00'), 'actual_closing_price': Decimal('3.00')},
+            {'stock': 'tst2', 'date': date(2020, 1, 1), 'predicted_closing_price': Decimal('2.00')},
+            ]
+
+        # Act
+        result = upsert_prices_portable(rows)
+
+        # Assert
+        self.assertEquals(result, (1, 1))
+        self.assertEquals(StockPrice.objects.get(stock='tst1', date='2020-01-01').actual_closing_price, Decimal('3.00'))
+        self.assertEquals(StockPrice.objects.get(stock='tst2', date='2020-01-01').predicted_closing_price, Decimal('2.00'))
+
+    def test_portable_upsert_retries_concurrent_insert(self):
+        # Arrange (the price is inserted by another writer after the existing rows were read)
+        rows = [
+            {'stock': 'tst1', 'date': date(2020, 1, 1), 'predicted_closing_price': Decimal('1.00'), 'actual_closing_price': Decimal('3.00')},
+            {'stock': 'tst2', 'date': date(2020, 1, 2), 'predicted_closing_price': Decimal('2.00')},
+            ]
+        real_find = ingest.find_existing_prices
+
+        # Act
+        with mock.patch('api.ingest.find_existing_prices', side_effect=[{}, real_find(rows)]):
+            result = upsert_prices_portable(rows)
+
+        # Assert
+        self.assertEquals(result, (1, 1))
+        self.assertEquals(StockPrice.objects.get(stock='tst1', date='2020-01-01').actual_closing_price, Decimal('3.00'))
+        self.assertEquals(StockPrice.objects.filter(stock='tst2', date='2020-01-02').count(), 1)
+
+    def test_requires_add_and_change_permissions(self):
+        # Arrange
+        body = [{'stock': 'tst1', 'date': '2020-01-02', 'predicted_closing_price': '1.50'}]
+
+        # Act
+        regularResponse = self.client_for(self.rUserToken).post('/api/v1/stock-price/bulk/', body, format='json')
+        addOnlyResponse = self.client_for(self.aUserToken).post('/api/v1/stock-price/bulk/', body, format='json')
+
+        # Assert
+        self.assertEquals(regularResponse.status_code, 403)
+        self.assertEquals(addOnlyResponse.status_code, 403)
+
+class ImportPricesTestCase(TestCase):
+    """
+    Tests the import_prices management command
+    """
+    csvData = (
+        'symbol,date,predicted_closing_price,actual_closing_price,volume,name,category\n'
+        'tst1,2020-01-01,1.00,1.00,100,Test One,cat1\n'
+        'tst2,2020-01-01,1.00,2.00,,,\n'
+        'tst1,2020-01-02,1.50,,,Test One,cat1\n'
+        'tst2,2020-01-02,1.00,,,,\n'
+        )
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_file(self, name, data):
+        path = os.path.join(self.directory.name, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt') as file:
+            file.write(data)
+        return path
+
+    def import_prices(self, *args):
+        stdout = StringIO()
+        stderr = StringIO()
+        call_command('import_prices', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_csv(self):
+        # Arrange
+        path = self.write_file('prices.csv', self.csvData)
+
+        # Act
+        stdout, stderr = self.import_prices(path, '--batch-size', '3')
 
         # Assert
-        self.assertEquals(result, expected)
\ No newline at end of file
+        self.assertIn('4 rows (4 created, 0 updated), 2 new stocks, 0 errors', stdout)
+        self.assertIn('rows/sec', stdout)
+        self.assertEquals(Stock.objects.get(symbol='tst1').name, 'Test One')
+        self.assertEquals(Stock.objects.get(symbol='tst2').name, 'tst2')
+        self.assertEquals(StockPrice.objects.get(stock='tst1', date='2020-01-01').volume, 100)
+        self.assertEquals(TradingDay.objects.latest_dates(5), [date(2020, 1, 2), date(2020, 1, 1)])
+        self.assertEquals(list(Suggestion.objects.order_by('stock_id').values_list('stock_id', 'action')), [('tst1', 'buy'), ('tst2', 'sell')])
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_import_gzipped_ndjson_upserts(self):
+        # Arrange
+        self.import_prices(self.write_file('prices.csv', self.csvData))
+        path = self.write_file('prices.ndjson.gz', json.dumps({'stock': 'tst1', 'date': '2020-01-02', 'predicted_closing_price': '1.00'}) + '\n')
+
+        # Act
+        stdout, stderr = self.import_prices(path)
+
+        # Assert
+        self.assertIn('1 rows (0 created, 1 updated)', stdout)
+        self.assertEquals(StockPrice.objects.get(stock='tst1', date='2020-01-02').predicted_closing_price, Decimal('1.00'))
+        self.assertEquals(Suggestion.objects.get(stock='tst1', date='2020-01-02').action, 'hold')
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        # Arrange
+        path = self.write_file('prices.csv', self.csvData + 'tst3,2020-01-03,1.001,,,,\ntst3,not a date,1.00,,,,\n')
+
+        # Act
+        stdout, stderr = self.import_prices(path)
+
+        # Assert
+        self.assertIn('4 rows (4 created, 0 updated), 2 new stocks, 2 errors', stdout)
+        self.assertIn('line 6: predicted_closing_price', stderr)
+        self.assertIn('line 7: date', stderr)
+
+    def test_non_integral_volume_is_rejected(self):
+        # Arrange
+        rows = [{'stock': 'tst1', 'date': '2020-01-01', 'predicted_closing_price': '1.00', 'volume': volume} for volume in (1.5, '2.0', 3.0)]
+        path = self.write_file('prices.ndjson', ''.join(json.dumps(row) + '\n' for row in rows))
+
+        # Act
+        stdout, stderr = self.import_prices(path)
+
+        # Assert
+        self.assertIn('1 rows (1 created, 0 updated), 1 new stocks, 1 errors', stdout)
+        self.assertIn('line 1: volume', stderr)
+        self.assertEquals(StockPrice.objects.get(stock='tst1', date='2020-01-01').volume, 3)
+
+    def test_committed_batches_are_synced_if_import_fails(self):
+        # Arrange
+        path = self.write_file('prices.csv', self.csvData)
+        version = DataVersion.objects.current()[0]
+        real_copy = ingest.copy_prices
+        calls = []
+
+        def copy_then_fail(rows):
+            calls.append(rows)
+            if len(calls) > 1:
+                raise RuntimeError('Connection lost')
+            return real_copy(rows)
+
+        # Act
+        with mock.patch('api.management.commands.import_prices.copy_prices', side_effect=copy_then_fail), self.assertRaises(RuntimeError):
+            self.import_prices(path, '--batch-size', '2')
+
+        # Assert
+        self.assertEquals(StockPrice.objects.count(), 2)
+        self.assertEquals(TradingDay.objects.latest_dates(5), [date(2020, 1, 1)])
+        self.assertGreater(DataVersion.objects.current()[0], version)
+        self.assertTrue(os.path.exists(path + '.checkpoint'))
+
+    def test_sync_recomputes_only_imported_stocks(self):
+        # Arrange
+        for symbol in ['tst1', 'tst2']:
+            stock = Stock.objects.create(name=symbol, symbol=symbol, category='cat1')
+            StockPrice.objects.create(stock=stock, date='2020-01-01', predicted_closing_price='1.00', actual_closing_price='1.00')
+            StockPrice.objects.create(stock=stock, date='2020-01-02', predicted_closing_price='1.00')
+        untouched = Suggestion.objects.get(stock='tst2', date='2020-01-02').pk
+        path = self.write_file('prices.csv', 'symbol,date,predicted_closing_price\ntst1,2020-01-02,2.00\n')
+
+        # Act
+        self.import_prices(path)
+
+        # Assert
+        self.assertEquals(Suggestion.objects.get(stock='tst1', date='2020-01-02').action, 'buy')
+        self.assertEquals(Suggestion.objects.get(stock='tst2', date='2020-01-02').pk, untouched)
+
+    def test_new_trading_day_recomputes_following_date(self):
+        # Arrange
+        for symbol in ['tst1', 'tst2']:
+            stock = Stock.objects.create(name=symbol, symbol=symbol, category='cat1')
+            StockPrice.objects.create(stock=stock, date='2020-01-01', predicted_closing_price='1.00', actual_closing_price='1.00')
+            StockPrice.objects.create(stock=stock, date='2020-01-03', predicted_closing_price='2.00')
+        path = self.write_file('prices.csv', 'symbol,date,predicted_closing_price,actual_closing_price\ntst1,2020-01-02,1.00,4.00\n')
+
+        # Act
+        self.import_prices(path)
+
+        # Assert
+        self.assertEquals(list(Suggestion.objects.filter(date='2020-01-03').values_list('stock', 'action')), [('tst1', 'sell'), ('tst2', 'unknown')])
+
+    def test_resume_skips_committed_records(self):
+        # Arrange
+        path = self.write_file('prices.csv', self.csvData)
+        with open(path + '.checkpoint', 'w') as checkpoint:
+            json.dump({'size': os.path.getsize(path), 'records': 2}, checkpoint)
+
+        # Act
+        stdout, stderr = self.import_prices(path, '--resume')
+
+        # Assert
+        self.assertIn('Resuming', stdout)
+        self.assertEquals(StockPrice.objects.filter(date='2020-01-01').count(), 0)
+        self.assertEquals(StockPrice.objects.filter(date='2020-01-02').count(), 2)
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_resume_refuses_changed_file(self):
+        # Arrange
+        path = self.write_file('prices.csv', self.csvData)
+        with open(path + '.checkpoint', 'w') as checkpoint:
+            json.dump({'size': 1, 'records': 2}, checkpoint)
+
+        # Act / Assert
+        with self.assertRaises(CommandError):
+            self.import_prices(path, '--resume')
+
+class StockQueryTestCase(TestCase):
+    """
+    Tests that reading stocks takes a constant number of queries
+    """
+    def setUp(self):
+        PCUser.objects.create_user('regular', password='1234')
+        self.userToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+        self.add_stocks(0, 2)
+
+    def add_stocks(self, first, last):
+        for i in range(first, last):
+            stock = Stock.objects.create(name='test%d' % i, symbol='tst%d' % i, category='testCat')
+            StockPrice.objects.create(stock=stock, date='2020-01-01', predicted_closing_price='1.00', actual_closing_price='1.10')
+            StockPrice.objects.create(stock=stock, date='2020-01-02', predicted_closing_price='1.20')
+
+    def get(self, url):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.userToken)
+        token_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        return response, len(queries)
+
+    def test_summary(self):
+        # Act
+        response, queryCount = self.get('/api/v1/stock/tst1')
+
+        # Assert
+        self.assertEquals(response.data['price_summary'], {'count': 2, 'first_date': '2020-01-01', 'last_date': '2020-01-02', 'latest_closing_price': None, 'latest_predicted_closing_price': '1.20'})
+        self.assertNotIn('stock_prices', response.data)
+
+    def test_list_query_count_is_constant(self):
+        # Arrange
+        response, queryCountBefore = self.get('/api/v1/stock/')
+        self.add_stocks(2, 12)
+
+        # Act
+        response, queryCountAfter = self.get('/api/v1/stock/')
+
+        # Assert
+        self.assertEquals(len(response.data['results']), 12)
+        self.assertEquals(queryCountAfter, queryCountBefore)
+        self.assertLessEqual(queryCountAfter, 3)   # Token, data version, stocks with summaries
+
+    def test_opt_in_price_ids(self):
+        # Arrange
+        response, queryCountBefore = self.get('/api/v1/stock/?include=stock_prices')
+        self.add_stocks(2, 12)
+
+        # Act
+        response, queryCountAfter = self.get('/api/v1/stock/?include=stock_prices')
+        detailResponse, detailQueryCount = self.get('/api/v1/stock/tst0?include=stock_prices')
+
+        # Assert
+        priceIds = list(StockPrice.objects.filter(stock='tst0').order_by('id').values_list('id', flat=True))
+        self.assertEquals(response.data['results'][0]['stock_prices'], priceIds)
+        self.assertEquals(detailResponse.data['stock_prices'], priceIds)
+        self.assertEquals(queryCountAfter, queryCountBefore)
+        self.assertLessEqual(queryCountAfter, 4)   # Token, data version, stocks with summaries, prefetched price ids
+        self.assertLessEqual(detailQueryCount, 4)
+
+class ResponseCacheTestCase(TestCase):
+    """
+    Tests the cached recent price and suggestion responses
+    """
+    def setUp(self):
+        caches['default'].clear()
+        response_cache.reset_stats()
+
+        PCUser.objects.create_user('regular', password='1234')
+        specialUser = PCUser.objects.create_user('special', password='1234')
+        specialUser.user_permissions.add(Permission.objects.get(codename='add_stockprice'))
+        specialUser.user_permissions.add(Permission.objects.get(codename='change_stockprice'))
+        self.userToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+        self.sUserToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'special', 'password': '1234'}).data['key']
+
+        stock = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
+        StockPrice.objects.create(stock=stock, date='2019-12-31', predicted_closing_price='5.00', actual_closing_price='5.00')
+        StockPrice.objects.create(stock=stock, date='2020-01-01', predicted_closing_price='10.00')
+
+    def get(self, url, token=None):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + (token or self.userToken))
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        return response, len(queries)
+
+    def test_recent_prices_are_cached(self):
+        # Arrange
+        missResponse, missQueryCount = self.get('/api/v1/stock-price/?recent=all')
+
+        # Act
+        hitResponse, hitQueryCount = self.get('/api/v1/stock-price/?recent=all')
+
+        # Assert
+        self.assertEquals(missResponse['X-Cache'], 'MISS')
+        self.assertEquals(hitResponse['X-Cache'], 'HIT')
+        self.assertEquals(hitResponse.data, missResponse.data)
+        self.assertEquals(hitQueryCount, 1)   # Data version; the token was cached by the first request
+        self.assertEquals(response_cache.stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_suggestions_are_cached(self):
+        # Arrange
+        missResponse, missQueryCount = self.get('/api/v1/suggestion/?date=2020-01-01')
+
+        # Act
+        hitResponse, hitQueryCount = self.get('/api/v1/suggestion/?date=2020-01-01')
+
+        # Assert
+        self.assertEquals(missResponse['X-Cache'], 'MISS')
+        self.assertEquals(hitResponse['X-Cache'], 'HIT')
+        self.assertEquals(hitResponse.data, missResponse.data)
+        self.assertEquals(hitQueryCount, 1)
+
+    def test_key_includes_query_params(self):
+        # Arrange
+        self.get('/api/v1/stock-price/?recent=all')
+        self.get('/api/v1/suggestion/?date=2020-01-01')
+
+        # Act
+        responses = [self.get(url)[0] for url in ['/api/v1/stock-price/?recent=tst1', '/api/v1/stock-price/?recent=all&page=1', '/api/v1/suggestion/?date=2019-12-31']]
+
+        # Assert
+        self.assertEquals([response['X-Cache'] for response in responses], ['MISS', 'MISS', 'MISS'])
+
+    def test_errors_are_not_cached(self):
+        # Arrange
+        self.get('/api/v1/suggestion/?date=2019-12-31')
+
+        # Act
+        response, queryCount = self.get('/api/v1/suggestion/?date=2019-12-31')
+
+        # Assert
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(response['X-Cache'], 'MISS')
+
+    def test_must_be_authenticated(self):
+        # Arrange
+        self.get('/api/v1/stock-price/?recent=all')
+
+        # Act
+        response = APIClient().get('/api/v1/stock-price/?recent=all')
+
+        # Assert
+        self.assertEquals(response.status_code, 401)
+
+    def test_price_changes_invalidate(self):
+        # Arrange
+        self.get('/api/v1/stock-price/?recent=tst1')
+        StockPrice.objects.create(stock_id='tst1', date='2020-01-02', predicted_closing_price='11.00')
+
+        # Act
+        response, queryCount = self.get('/api/v1/stock-price/?recent=tst1')
+
+        # Assert
+        self.assertEquals(response['X-Cache'], 'MISS')
+        self.assertEquals(len(response.data['results']), 3)
+
+    def test_writes_of_other_processes_invalidate(self):
+        # Arrange
+        etag = self.get('/api/v1/stock-price/?recent=tst1')[0]['ETag']
+        # As another process, e.g. import_prices, would write: this process's cache is not told
+        StockPrice.objects.filter(date='2020-01-01').update(predicted_closing_price='12.00')
+        DataVersion.objects.filter(pk=1).update(version=F('version') + 1)
+
+        # Act
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.userToken)
+        response = client.get('/api/v1/stock-price/?recent=tst1', HTTP_IF_NONE_MATCH=etag)
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['X-Cache'], 'MISS')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEquals([price['predicted_closing_price'] for price in response.data['results'] if price['date'] == '2020-01-01'], ['12.00'])
+
+    def test_price_deletes_invalidate(self):
+        # Arrange
+        self.get('/api/v1/stock-price/?recent=tst1')
+        StockPrice.objects.get(date='2020-01-01').delete()
+
+        # Act
+        response, queryCount = self.get('/api/v1/stock-price/?recent=tst1')
+
+        # Assert
+        self.assertEquals(response['X-Cache'], 'MISS')
+        self.assertEquals(len(response.data['results']), 1)
+
+    def test_stock_changes_invalidate(self):
+        # Arrange
+        self.get('/api/v1/suggestion/?date=2020-01-01')
+        Stock.objects.create(name='test2', symbol='tst2', category='testCat')
+
+        # Act
+        response, queryCount = self.get('/api/v1/suggestion/?date=2020-01-01')
+
+        # Assert
+        self.assertEquals(response['X-Cache'], 'MISS')
+
+    def test_bulk_upload_invalidates(self):
+        # Arrange
+        self.get('/api/v1/suggestion/?date=2020-01-01')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.sUserToken)
+        client.post('/api/v1/stock-price/bulk/', [{'stock': 'tst1', 'date': '2019-12-31', 'predicted_closing_price': '5.00', 'actual_closing_price': '20.00'}], format='json')
+
+        # Act
+        response, queryCount = self.get('/api/v1/suggestion/?date=2020-01-01')
+
+        # Assert
+        self.assertEquals(response['X-Cache'], 'MISS')
+        self.assertEquals(response.data['suggestions'][0]['action'], 'sell')
+
+class ConditionalGetTestCase(TestCase):
+    """
+    Tests ETag and Last-Modified on the stock, price and suggestion views
+    """
+    urls = ['/api/v1/stock-price/', '/api/v1/stock-price/?recent=all', '/api/v1/stock/', '/api/v1/stock/tst1', '/api/v1/suggestion/?date=2020-01-01']
+
+    def setUp(self):
+        caches['default'].clear()
+        PCUser.objects.create_user('regular', password='1234')
+        self.userToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+
+        stock = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
+        StockPrice.objects.create(stock=stock, date='2019-12-31', predicted_closing_price='5.00', actual_closing_price='5.00')
+        StockPrice.objects.create(stock=stock, date='2020-01-01', predicted_closing_price='10.00')
+
+    def get(self, url, **headers):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.userToken)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, **headers)
+        return response, len(queries)
+
+    def test_validators_are_sent(self):
+        for url in self.urls:
+            # Act
+            response, queryCount = self.get(url)
+
+            # Assert
+            self.assertEquals(response.status_code, 200, url)
+            self.assertTrue(response['ETag'].startswith('"'), url)
+            self.assertIn('Last-Modified', response, url)
+
+    def test_matching_etag_is_not_modified(self):
+        for url in self.urls:
+            # Arrange
+            etag = self.get(url)[0]['ETag']
+
+            # Act
+            response, queryCount = self.get(url, HTTP_IF_NONE_MATCH=etag)
+
+            # Assert
+            self.assertEquals(response.status_code, 304, url)
+            self.assertEquals(response.content, b'', url)
+            self.assertEquals(queryCount, 1, url)   # Data version; the token was cached by the first request
+
+    def test_unchanged_since_is_not_modified(self):
+        # Arrange
+        lastModified = self.get('/api/v1/stock/')[0]['Last-Modified']
+
+        # Act
+        response, queryCount = self.get('/api/v1/stock/', HTTP_IF_MODIFIED_SINCE=lastModified)
+
+        # Assert
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(queryCount, 1)
+
+    def test_etag_depends_on_uri_and_format(self):
+        # Act
+        etags = {self.get(url)[0]['ETag'] for url in ['/api/v1/stock/', '/api/v1/stock/?include=stock_prices', '/api/v1/stock/?format=api']}
+
+        # Assert
+        self.assertEquals(len(etags), 3)
+
+    def test_writes_change_etag(self):
+        # Arrange
+        etag = self.get('/api/v1/stock/tst1')[0]['ETag']
+
+        for write in [lambda: StockPrice.objects.create(stock_id='tst1', date='2020-01-02', predicted_closing_price='11.00'),
+                      lambda: StockPrice.objects.get(date='2020-01-02').delete(),
+                      lambda: Stock.objects.get(symbol='tst1').save()]:
+            # Act
+            write()
+            response, queryCount = self.get('/api/v1/stock/tst1', HTTP_IF_NONE_MATCH=etag)
+
+            # Assert
+            self.assertEquals(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+
+    def test_bulk_writes_change_etag(self):
+        # Arrange
+        etag = self.get('/api/v1/suggestion/?date=2020-01-01')[0]['ETag']
+        upsert_prices([{'stock': 'tst1', 'date': date(2019, 12, 31), 'predicted_closing_price': Decimal('5.00'), 'actual_closing_price': Decimal('20.00')}])
+        sync_derived_tables([date(2019, 12, 31)])
+
+        # Act
+        response, queryCount = self.get('/api/v1/suggestion/?date=2020-01-01', HTTP_IF_NONE_MATCH=etag)
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['suggestions'][0]['action'], 'sell')
+
+    def test_must_be_authenticated(self):
+        # Arrange
+        etag = self.get('/api/v1/stock/')[0]['ETag']
+
+        # Act
+        response = APIClient().get('/api/v1/stock/', HTTP_IF_NONE_MATCH=etag)
+
+        # Assert
+        self.assertEquals(response.status_code, 401)
+
+class StockPriceExportTestCase(TestCase):
+    """
+    Tests the streaming price export
+    """
+    def setUp(self):
+        PCUser.objects.create_user('regular', password='1234')
+        self.userToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+
+        stock1 = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
+        stock2 = Stock.objects.create(name='test2', symbol='tst2', category='testCat')
+        StockPrice.objects.create(stock=stock2, date='2020-01-01', predicted_closing_price='2.00', actual_closing_price='2.10', volume=100)
+        StockPrice.objects.create(stock=stock1, date='2020-01-02', predicted_closing_price='1.20')
+        StockPrice.objects.create(stock=stock1, date='2020-01-01', predicted_closing_price='1.00', actual_closing_price='1.10', volume=10)
+
+    def get(self, url, **headers):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.userToken)
+        return client.get(url, **headers)
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_is_default(self):
+        # Act
+        response = self.get('/api/v1/stock-price/export/')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEquals([(row['stock'], row['date']) for row in rows], [('tst1', '2020-01-01'), ('tst1', '2020-01-02'), ('tst2', '2020-01-01')])
+        self.assertEquals(rows[0], {'stock': 'tst1', 'date': '2020-01-01', 'predicted_closing_price': '1.00', 'opening_price': None,
+                                    'actual_closing_price': '1.10', 'daily_high': None, 'daily_low': None, 'volume': 10})
+
+    def test_csv(self):
+        # Act
+        response = self.get('/api/v1/stock-price/export/?format=csv')
+        acceptResponse = self.get('/api/v1/stock-price/export/', HTTP_ACCEPT='text/csv')
+
+        # Assert
+        self.assertEquals(response['Content-Type'], 'text/csv; charset=utf-8')
+        content = self.content(response)
+        self.assertEquals(content.splitlines()[:2], ['stock,date,predicted_closing_price,opening_price,actual_closing_price,daily_high,daily_low,volume',
+                                                     'tst1,2020-01-01,1.00,,1.10,,,10'])
+        self.assertEquals(self.content(acceptResponse), content)
+
+    def test_csv_can_be_imported(self):
+        # Arrange
+        content = self.content(self.get('/api/v1/stock-price/export/?format=csv'))
+        StockPrice.objects.all().delete()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'prices.csv')
+            with open(path, 'w') as f:
+                f.write(content)
+
+            # Act
+            call_command('import_prices', path, stdout=StringIO())
+
+        # Assert
+        self.assertEquals(self.content(self.get('/api/v1/stock-price/export/?format=csv')), content)
+
+    def test_filters(self):
+        # Act
+        response = self.get('/api/v1/stock-price/export/?symbols=tst1,tst3&start=2020-01-02&end=2020-01-31')
+
+        # Assert
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEquals([(row['stock'], row['date']) for row in rows], [('tst1', '2020-01-02')])
+
+    def test_invalid_filter(self):
+        # Act
+        response = self.get('/api/v1/stock-price/export/?format=csv&start=yesterday')
+
+        # Assert
+        self.assertEquals(response.status_code, 400)
+        self.assertIn('start', response.json())
+
+    def test_must_be_authenticated(self):
+        # Act
+        response = APIClient().get('/api/v1/stock-price/export/')
+
+        # Assert
+        self.assertEquals(response.status_code, 401)
+
+    def test_csv_starts_before_query(self):
+        # Arrange
+        response = self.get('/api/v1/stock-price/export/?format=csv')
+
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            header = next(iter(response.streaming_content))
+
+        # Assert
+        self.assertTrue(header.startswith(b'stock,date,'))
+        self.assertEquals(len(queries), 0)
+
+    def test_memory_does_not_grow_with_rows(self):
+        # Arrange
+        def peak_memory(url):
+            response = self.get(url)
+            tracemalloc.start()
+            size = sum(len(chunk) for chunk in response.streaming_content)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return size, peak
+
+        stocks = [Stock(name='bulk%d' % i, symbol='blk%d' % i, category='testCat') for i in range(20)]
+        Stock.objects.bulk_create(stocks)
+        StockPrice.objects.bulk_create([StockPrice(stock=stock, date=date(2000, 1, 1) + timedelta(days=day), predicted_closing_price='1.00')
+                                        for day in range(1000) for stock in stocks])
+
+        # Act
+        smallSize, smallPeak = peak_memory('/api/v1/stock-price/export/?symbols=blk0,blk1,blk2,blk3')
+        largeSize, largePeak = peak_memory('/api/v1/stock-price/export/')
+
+        # Assert
+        self.assertGreater(largeSize, smallSize * 4)
+        self.assertLess(largePeak, smallPeak * 1.5)
+
+class ColumnarPriceTestCase(TestCase):
+    """
+    Tests the MessagePack columnar price lists
+    """
+    def setUp(self):
+        caches['default'].clear()
+        PCUser.objects.create_user('regular', password='1234')
+        self.userToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+
+        stock1 = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
+        stock2 = Stock.objects.create(name='test2', symbol='tst2', category='testCat')
+        for day in range(1, 4):
+            StockPrice.objects.create(stock=stock1, date=date(2020, 1, day), predicted_closing_price='10.05', opening_price='9.99',
+                                      actual_closing_price='-0.50', daily_high='123456789.01', daily_low='0.00', volume=1000 * day)
+            StockPrice.objects.create(stock=stock2, date=date(2020, 1, day), predicted_closing_price='1.00')
+
+    def get(self, url, **headers):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.userToken)
+        return client.get(url, **headers)
+
+    def test_round_trip(self):
+        for url in ['/api/v1/stock-price/', '/api/v1/stock-price/?page=1', '/api/v1/stock-price/?recent=all', '/api/v1/stock-price/?recent=tst1']:
+            # Act
+            jsonResponse = self.get(url)
+            binaryResponse = self.get(url, HTTP_ACCEPT='application/x-msgpack')
+
+            # Assert
+            self.assertEquals(binaryResponse['Content-Type'], 'application/x-msgpack', url)
+            data = msgpack.unpackb(binaryResponse.content, raw=False)
+            self.assertEquals(price_rows(data['results']), json.loads(jsonResponse.content)['results'], url)
+            self.assertLess(len(binaryResponse.content), len(jsonResponse.content) / 2, url)
+
+    def test_format_param(self):
+        # Act
+        response = self.get('/api/v1/stock-price/?format=msgpack')
+
+        # Assert
+        self.assertEquals(response['Content-Type'], 'application/x-msgpack')
+        self.assertEquals(len(msgpack.unpackb(response.content, raw=False)['results']['id']), 6)
+
+    @mock.patch.object(KeysetPagination, 'page_size', 4)
+    def test_pages(self):
+        # Arrange
+        first = msgpack.unpackb(self.get('/api/v1/stock-price/?format=msgpack').content, raw=False)
+
+        # Act
+        second = msgpack.unpackb(self.get(first['next']).content, raw=False)
+
+        # Assert
+        self.assertEquals(first['results']['id'] + second['results']['id'], list(StockPrice.objects.order_by('date', 'id').values_list('id', flat=True)))
+        self.assertIsNone(second['next'])
+
+    def test_no_model_instances(self):
+        # Act
+        with mock.patch.object(StockPrice, 'from_db') as fromDb:
+            response = self.get('/api/v1/stock-price/?recent=all&format=msgpack')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        fromDb.assert_not_called()
+
+    def test_cache_is_per_format(self):
+        # Arrange
+        jsonData = self.get('/api/v1/stock-price/?recent=all').data
+
+        # Act
+        response = self.get('/api/v1/stock-price/?recent=all', HTTP_ACCEPT='application/x-msgpack')
+
+        # Assert
+        self.assertEquals(response['X-Cache'], 'MISS')
+        self.assertEquals(price_rows(msgpack.unpackb(response.content, raw=False)['results']), json.loads(json.dumps(jsonData['results'])))
+
+    def test_columns(self):
+        # Act
+        columns = price_columns([(7, 'tst2', date(1970, 1, 2), Decimal('1.25'), None, Decimal('-3.00'), None, None, None),
+                                 (8, 'tst1', date(1969, 12, 31), Decimal('0.01'), None, None, None, None, 5),
+                                 (9, 'tst2', date(2020, 1, 1), Decimal('2.00'), None, None, None, None, 6)])
+
+        # Assert
+        self.assertEquals(columns['symbols'], ['tst2', 'tst1'])
+        self.assertEquals(columns['stock'], [0, 1, 0])
+        self.assertEquals(columns['date'], [1, -1, 18262])
+        self.assertEquals(columns['predicted_closing_price'], [125, 1, 200])
+        self.assertEquals(columns['actual_closing_price'], [-300, None, None])
+        self.assertEquals(columns['volume'], [None, 5, 6])
+        self.assertEquals(columns['price_scale'], 100)
+
+class StockPriceHistoryTestCase(TestCase):
+    """
+    Tests the per-stock price history with database-side downsampling
+    """
+    def setUp(self):
+        PCUser.objects.create_user('regular', password='1234')
+        self.userToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+
+        stock = Stock.objects.create(name='test1', symbol='tst1', category='testCat')
+        other = Stock.objects.create(name='test2', symbol='tst2', category='testCat')
+        # Thursday 2020-01-30 to Wednesday 2020-02-05, one price a day
+        for day in range(7):
+            price = Decimal(10 + day)
+            StockPrice.objects.create(stock=stock, date=date(2020, 1, 30) + timedelta(days=day), opening_price=price - 1, daily_high=price + day % 3,
+                                      daily_low=price - 2 - day % 2, actual_closing_price=price, predicted_closing_price=price + Decimal('0.50'), volume=100 + day)
+            StockPrice.objects.create(stock=other, date=date(2020, 1, 30) + timedelta(days=day), opening_price=1, daily_high=1000, daily_low=0,
+                                      actual_closing_price=1, predicted_closing_price=1, volume=1)
+
+    def get(self, url):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.userToken)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        return response, len(queries)
+
+    def test_months(self):
+        # Act
+        response, queryCount = self.get('/api/v1/stock/tst1/prices?interval=month')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['stock'], 'tst1')
+        self.assertEquals(response.data['interval'], 'month')
+        self.assertEquals([dict(bar) for bar in response.data['bars']], [
+            {'date': '2020-01-01', 'days': 2, 'opening_price': '9.00', 'daily_high': '12.00', 'daily_low': '8.00',
+             'actual_closing_price': '11.00', 'predicted_closing_price': '11.50', 'volume': 201},
+            {'date': '2020-02-01', 'days': 5, 'opening_price': '11.00', 'daily_high': '17.00', 'daily_low': '10.00',
+             'actual_closing_price': '16.00', 'predicted_closing_price': '16.50', 'volume': 520},
+        ])
+        self.assertLessEqual(queryCount, 5)   # Token, data version, stock, bars, first and last prices
+
+    def test_weeks(self):
+        # Act
+        response, queryCount = self.get('/api/v1/stock/tst1/prices?interval=week')
+
+        # Assert
+        bars = response.data['bars']
+        self.assertEquals([(bar['date'], bar['days'], bar['opening_price'], bar['actual_closing_price']) for bar in bars],
+                          [('2020-01-27', 4, '9.00', '13.00'), ('2020-02-03', 3, '13.00', '16.00')])
+
+    def test_days_in_range(self):
+        # Act
+        response, queryCount = self.get('/api/v1/stock/tst1/prices?start=2020-02-01&end=2020-02-02')
+
+        # Assert
+        self.assertEquals(response.data['interval'], 'day')
+        self.assertEquals([dict(bar) for bar in response.data['bars']], [
+            {'date': '2020-02-01', 'days': 1, 'opening_price': '11.00', 'daily_high': '14.00', 'daily_low': '10.00',
+             'actual_closing_price': '12.00', 'predicted_closing_price': '12.50', 'volume': 102},
+            {'date': '2020-02-02', 'days': 1, 'opening_price': '12.00', 'daily_high': '13.00', 'daily_low': '10.00',
+             'actual_closing_price': '13.00', 'predicted_closing_price': '13.50', 'volume': 103},
+        ])
+
+    def test_missing_values(self):
+        # Arrange
+        StockPrice.objects.filter(stock='tst1', date='2020-01-30').update(opening_price=None, daily_high=None, volume=None)
+        StockPrice.objects.filter(stock='tst1', date='2020-01-31').update(volume=None)
+
+        # Act
+        response, queryCount = self.get('/api/v1/stock/tst1/prices?interval=month&end=2020-01-31')
+
+        # Assert
+        bar = response.data['bars'][0]
+        self.assertEquals((bar['opening_price'], bar['daily_high'], bar['volume']), (None, '12.00', None))
+
+    def test_empty_range(self):
+        # Act
+        response, queryCount = self.get('/api/v1/stock/tst1/prices?start=2021-01-01')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['bars'], [])
+
+    def test_unknown_stock(self):
+        # Act
+        response, queryCount = self.get('/api/v1/stock/none/prices')
+
+        # Assert
+        self.assertEquals(response.status_code, 404)
+
+    def test_invalid_interval(self):
+        # Act
+        response, queryCount = self.get('/api/v1/stock/tst1/prices?interval=year')
+
+        # Assert
+        self.assertEquals(response.status_code, 400)
+        self.assertIn('interval', response.data)
+
+class TokenCacheTestCase(TestCase):
+    """
+    Tests the cached token authentication
+    """
+    def setUp(self):
+        token_cache.clear()
+        token_cache.reset_stats()
+        PCUser.objects.create_user('regular', password='1234')
+        self.userToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+
+    def client_for(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        return client
+
+    def get(self, token):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_for(token).get('/api/v1/interest/')
+        return response, len(queries)
+
+    def test_lookup_is_cached(self):
+        # Arrange
+        response, missQueryCount = self.get(self.userToken)
+
+        # Act
+        response, hitQueryCount = self.get(self.userToken)
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(hitQueryCount, missQueryCount - 1)
+        self.assertEquals(token_cache.stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5, 'size': 1})
+
+    def test_invalid_token_is_not_cached(self):
+        for i in range(2):
+            # Act
+            response, queryCount = self.get('0' * 40)
+
+            # Assert
+            self.assertEquals(response.status_code, 401)
+            self.assertEquals(str(response.data['detail']), 'Invalid token.')
+        self.assertEquals(token_cache.stats()['hits'], 0)
+
+    def test_logout_evicts(self):
+        # Arrange
+        self.get(self.userToken)
+
+        # Act
+        logoutResponse = self.client_for(self.userToken).post('/api/v1/rest-auth/logout/')
+        response, queryCount = self.get(self.userToken)
+
+        # Assert
+        self.assertEquals(logoutResponse.status_code, 200)
+        self.assertEquals(response.status_code, 401)
+
+    def test_token_deletion_evicts(self):
+        # Arrange
+        self.get(self.userToken)
+
+        # Act
+        Token.objects.filter(key=self.userToken).get().delete()
+        response, queryCount = self.get(self.userToken)
+
+        # Assert
+        self.assertEquals(response.status_code, 401)
+
+    def test_revocations_of_other_processes_apply(self):
+        # Arrange
+        self.get(self.userToken)
+        entries = OrderedDict(token_cache.entries)
+
+        # Act
+        Token.objects.filter(key=self.userToken).get().delete()
+        # Another process's cache, which the delete signal does not reach
+        token_cache.entries = entries
+        response, queryCount = self.get(self.userToken)
+
+        # Assert
+        self.assertEquals(response.status_code, 401)
+
+    def test_deactivation_evicts(self):
+        # Arrange
+        self.get(self.userToken)
+        user = PCUser.objects.get(username='regular')
+
+        # Act
+        user.is_active = False
+        user.save()
+        response, queryCount = self.get(self.userToken)
+
+        # Assert
+        self.assertEquals(response.status_code, 401)
+        self.assertEquals(str(response.data['detail']), 'User inactive or deleted.')
+
+    def test_login_again_keeps_token(self):
+        # Arrange
+        self.get(self.userToken)
+
+        # Act
+        key = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+        response, queryCount = self.get(key)
+
+        # Assert
+        self.assertEquals(key, self.userToken)
+        self.assertEquals(response.status_code, 200)
+
+    def test_permission_changes_apply(self):
+        # Arrange
+        Stock.objects.create(name='test1', symbol='tst1', category='testCat')
+        data = {'stock': 'tst1', 'date': '2020-01-01', 'predicted_closing_price': '1.00'}
+        forbiddenResponse = self.client_for(self.userToken).post('/api/v1/stock-price/', data, format='json')
+
+        # Act
+        PCUser.objects.get(username='regular').user_permissions.add(Permission.objects.get(codename='add_stockprice'))
+        response = self.client_for(self.userToken).post('/api/v1/stock-price/', data, format='json')
+
+        # Assert
+        self.assertEquals(forbiddenResponse.status_code, 403)
+        self.assertEquals(response.status_code, 201)
+
+    def test_user_is_a_fresh_instance(self):
+        # Arrange
+        authentication = CachedTokenAuthentication()
+        firstUser, firstToken = authentication.authenticate_credentials(self.userToken)
+
+        # Act
+        user, token = authentication.authenticate_credentials(self.userToken)
+
+        # Assert
+        self.assertIsNot(user, firstUser)
+        self.assertEquals(user, firstUser)
+        self.assertIs(token.user, user)
+        self.assertFalse(user._state.adding)
+
+    def test_expiry_and_size(self):
+        # Arrange
+        cache = TokenCache(size=2, timeout=10)
+        with mock.patch('time.monotonic', return_value=100):
+            cache.set('a', (1,))
+            cache.set('b', (2,))
+            cache.get('a')
+            cache.set('c', (3,))
+
+        # Act
+        with mock.patch('time.monotonic', return_value=105):
+            beforeExpiry = [cache.get(key) for key in ['a', 'b', 'c']]
+        with mock.patch('time.monotonic', return_value=111):
+            afterExpiry = cache.get('a')
+
+        # Assert
+        self.assertEquals(beforeExpiry, [(1,), None, (3,)])   # 'b' was the least recently used
+        self.assertIsNone(afterExpiry)
+
+class PersonalSuggestionTestCase(TestCase):
+    """
+    Tests the suggestions filtered by the user's interests
+    """
+    def setUp(self):
+        caches['default'].clear()
+        tech = Interest.objects.create(interest='Tech')
+        Interest.objects.create(interest='Energy')
+        user = PCUser.objects.create_user('regular', password='1234')
+        user.interests.add(tech)
+        self.userToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+
+        # Predicted changes from the previous day's close of 10.00: tch1 +20%, tch2 -10%, tch3 +10%, tch4 -30%, tch5 +1%, tch6 unknown
+        for symbol, category, predicted in [('tch1', 'Tech', '12.00'), ('tch2', 'Tech', '9.00'), ('tch3', 'Tech', '11.00'), ('tch4', 'Tech', '7.00'),
+                                            ('tch5', 'Tech', '10.10'), ('tch6', 'Tech', '10.00'), ('nrg1', 'Energy', '20.00')]:
+            stock = Stock.objects.create(name=symbol, symbol=symbol, category=category)
+            if symbol != 'tch6':
+                StockPrice.objects.create(stock=stock, date='2020-01-01', predicted_closing_price='10.00', actual_closing_price='10.00')
+            StockPrice.objects.create(stock=stock, date='2020-01-02', predicted_closing_price=predicted)
+
+    def get(self, url):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.userToken)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        return response, len(queries)
+
+    def test_ranked_by_interest(self):
+        # Act
+        response, queryCount = self.get('/api/v1/suggestion/personal/?date=2020-01-02')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([(row['stock'], row['action']) for row in response.data['suggestions']],
+                          [('tch1', 'buy'), ('tch3', 'buy'), ('tch5', 'hold'), ('tch2', 'sell'), ('tch4', 'sell'), ('tch6', 'unknown')])
+
+    def test_limit(self):
+        # Act
+        response, queryCount = self.get('/api/v1/suggestion/personal/?date=2020-01-02&limit=1')
+
+        # Assert
+        self.assertEquals([(row['stock'], row['action']) for row in response.data['suggestions']], [('tch1', 'buy'), ('tch4', 'sell')])
+
+    def test_index_is_reused(self):
+        # Arrange
+        self.get('/api/v1/suggestion/personal/?date=2020-01-02')
+
+        # Act
+        response, queryCount = self.get('/api/v1/suggestion/personal/?date=2020-01-02')
+
+        # Assert
+        self.assertEquals(queryCount, 3)   # The data version, the user's interests and the suggestions; the token is cached
+
+    def test_stock_changes_update_index(self):
+        # Arrange
+        self.get('/api/v1/suggestion/personal/?date=2020-01-02')
+
+        # Act
+        stock = Stock.objects.get(symbol='nrg1')
+        stock.category = 'Tech'
+        stock.save()
+        response, queryCount = self.get('/api/v1/suggestion/personal/?date=2020-01-02&limit=1')
+
+        # Assert
+        self.assertEquals(response.data['suggestions'][0]['stock'], 'nrg1')
+
+    def test_changes_of_other_processes_update_index(self):
+        # Arrange
+        self.get('/api/v1/suggestion/personal/?date=2020-01-02')
+
+        # Act
+        # Another process's write, whose signals and cache deletes do not reach this one
+        Stock.objects.filter(symbol='nrg1').update(category='Tech')
+        DataVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        response, queryCount = self.get('/api/v1/suggestion/personal/?date=2020-01-02&limit=1')
+
+        # Assert
+        self.assertEquals(response.data['suggestions'][0]['stock'], 'nrg1')
+
+    def test_imported_stocks_update_index(self):
+        # Arrange
+        self.get('/api/v1/suggestion/personal/?date=2020-01-02')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'prices.csv')
+            with open(path, 'w') as file:
+                file.write('symbol,date,predicted_closing_price,actual_closing_price,name,category\n'
+                           'tch7,2020-01-01,10.00,10.00,tch7,Tech\n'
+                           'tch7,2020-01-02,20.00,,tch7,Tech\n')
+
+            # Act
+            call_command('import_prices', path, stdout=StringIO(), stderr=StringIO())
+        response, queryCount = self.get('/api/v1/suggestion/personal/?date=2020-01-02&limit=1')
+
+        # Assert
+        self.assertEquals(response.data['suggestions'][0]['stock'], 'tch7')
+
+    def test_interest_changes_apply(self):
+        # Arrange
+        self.get('/api/v1/suggestion/personal/?date=2020-01-02')
+        Interest.objects.get(interest='Energy').delete()
+        energy = Interest.objects.create(interest='Energy')
+
+        # Act
+        PCUser.objects.get(username='regular').interests.set([energy])
+        response, queryCount = self.get('/api/v1/suggestion/personal/?date=2020-01-02')
+
+        # Assert
+        self.assertEquals([row['stock'] for row in response.data['suggestions']], ['nrg1'])
+
+    def test_no_interests(self):
+        # Arrange
+        PCUser.objects.get(username='regular').interests.clear()
+
+        # Act
+        response, queryCount = self.get('/api/v1/suggestion/personal/?date=2020-01-02')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['suggestions'], [])
+
+    def test_invalid_limit(self):
+        # Act
+        response, queryCount = self.get('/api/v1/suggestion/personal/?date=2020-01-02&limit=0')
+
+        # Assert
+        self.assertEquals(response.status_code, 400)
+
+@skipUnless(connection.vendor == 'sqlite', 'Checks SQLite query plans')
+class StockPriceIndexTestCase(TestCase):
+    """
+    Tests that the hot stock price queries are answered from an index rather than a table scan
+    """
+    def setUp(self):
+        stock = Stock.objects.create(name='test', symbol='tst', category='testCat')
+        StockPrice.objects.create(stock=stock, date='2020-01-01', predicted_closing_price='1.00')
+        StockPrice.objects.create(stock=stock, date='2020-01-02', predicted_closing_price='1.10')
+
+    def plan(self, queryset):
+        # Keep only the plan lines for the stock price table
+        return [line for line in queryset.explain().splitlines() if 'api_stockprice' in line]
+
+    def unique_index(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, StockPrice._meta.db_table)
+        return next(name for name, info in constraints.items() if info['unique'] and info['columns'] == ['stock_id', 'date'])
+
+    def test_prices_on_date(self):
+        # Act
+        plan = self.plan(StockPrice.objects.filter(date='2020-01-02'))
+
+        # Assert
+        self.assertEquals(len(plan), 1)
+        self.assertIn('USING INDEX stockprice_date_id_idx', plan[0])
+
+    def test_prices_on_recent_dates(self):
+        # Act
+        plan = self.plan(StockPrice.objects.filter(date__in=['2020-01-01', '2020-01-02']).order_by('stock__category', 'stock__symbol', '-date'))
+
+        # Assert
+        self.assertEquals(len(plan), 1)
+        self.assertIn('USING INDEX stockprice_date_id_idx', plan[0])
+
+    def test_recent_prices_of_stock(self):
+        # Act
+        plan = self.plan(StockPrice.objects.filter(stock='tst').order_by('-date')[:5])
+
+        # Assert
+        self.assertEquals(len(plan), 1)
+        self.assertIn('USING INDEX %s' % self.unique_index(), plan[0])
+        self.assertNotIn('TEMP B-TREE', ' '.join(plan))
+
+    def test_duplicate_bar_is_rejected(self):
+        # Act / Assert
+        with self.assertRaises(IntegrityError):
+            StockPrice.objects.create(stock_id='tst', date='2020-01-02', predicted_closing_price='1.20')
+
+@mock.patch.object(KeysetPagination, 'page_size', 2)
+class KeysetPaginationTestCase(TestCase):
+    """
+    Tests keyset pagination of the stock price and stock lists
+    """
+    def setUp(self):
+        PCUser.objects.create_user('regular', password='1234')
+        self.userToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+
+        stock1 = Stock.objects.create(name='b', symbol='tst1', category='testCat')
+        stock2 = Stock.objects.create(name='a', symbol='tst2', category='testCat')
+        Stock.objects.create(name='c', symbol='tst3', category='testCat')
+
+        # Inserted out of date order, so (date, id) order differs from id order
+        self.priceIds = [StockPrice.objects.create(stock=stock, date=day, predicted_closing_price='1.00').id for stock, day in [
+            (stock1, '2020-01-03'), (stock2, '2020-01-01'), (stock1, '2020-01-01'), (stock2, '2020-01-02'), (stock1, '2020-01-02')]]
+
+    def get(self, url):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.userToken)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        return response, queries
+
+    def test_walk_forward_and_back(self):
+        # Act
+        pages = []
+        url = '/api/v1/stock-price/'
+        while url:
+            response, queries = self.get(url)
+            pages.append([price['id'] for price in response.data['results']])
+            url = response.data['next']
+        previousResponse, queries = self.get(response.data['previous'])
+
+        # Assert
+        ids = self.priceIds
+        self.assertEquals(pages, [[ids[1], ids[2]], [ids[3], ids[4]], [ids[0]]])
+        self.assertEquals([price['id'] for price in previousResponse.data['results']], [ids[3], ids[4]])
+        self.assertIsNotNone(previousResponse.data['previous'])
+        self.assertIsNotNone(previousResponse.data['next'])
+
+    def test_no_count_query(self):
+        # Act
+        response, queries = self.get('/api/v1/stock-price/')
+
+        # Assert
+        self.assertNotIn('count', response.data)
+        self.assertFalse(any('COUNT(' in query['sql'].upper() for query in queries))
+
+    def test_stocks_ordered_by_symbol(self):
+        # Act
+        firstResponse, queries = self.get('/api/v1/stock/')
+        secondResponse, queries = self.get(firstResponse.data['next'])
+
+        # Assert
+        self.assertEquals([stock['symbol'] for stock in firstResponse.data['results']], ['tst1', 'tst2'])
+        self.assertEquals([stock['symbol'] for stock in secondResponse.data['results']], ['tst3'])
+        self.assertIsNone(secondResponse.data['next'])
+
+    def test_page_number_mode(self):
+        # Act
+        response, queries = self.get('/api/v1/stock-price/?pagination=page')
+        pageResponse, queries = self.get('/api/v1/stock-price/?page=1')
+
+        # Assert
+        self.assertEquals(response.data['count'], 5)
+        self.assertEquals(pageResponse.data['count'], 5)
+
+    def test_invalid_cursor(self):
+        # Act
+        response, queries = self.get('/api/v1/stock-price/?cursor=garbage')
+
+        # Assert
+        self.assertEquals(response.status_code, 404)
+
+@override_settings(API_RESPONSE_CACHE_TIMEOUT=0)
+class RowListTestCase(TestCase):
+    """
+    Tests that the lists built from database rows are the same as those built with the model serializers
+    """
+    def setUp(self):
+        PCUser.objects.create_user('regular', password='1234', is_staff=True)
+        self.userToken = APIClient().post('/api/v1/rest-auth/login/', {'username': 'regular', 'password': '1234'}).data['key']
+
+        Interest.objects.create(interest='int1')
+        Interest.objects.create(interest='int2')
+        stock1 = Stock.objects.create(name='b', symbol='tst1', category='cat2')
+        stock2 = Stock.objects.create(name='a', symbol='tst2', category='cat1')
+        Stock.objects.create(name='c', symbol='tst3', category='cat1')
+        StockPrice.objects.create(stock=stock1, date='2020-01-03', predicted_closing_price='1.5', opening_price='-0.25',
+                                  actual_closing_price='12345678.90', daily_high='2', daily_low='0.01', volume=100)
+        StockPrice.objects.create(stock=stock2, date='2020-01-01', predicted_closing_price='1.00')
+        StockPrice.objects.create(stock=stock1, date='2020-01-01', predicted_closing_price='0', volume=0)
+        StockPrice.objects.create(stock=stock2, date='2020-01-02', predicted_closing_price='99.99', actual_closing_price='100')
+        TradingDay.objects.rebuild()
+
+    def get(self, url):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.userToken)
+        response = client.get(url)
+        self.assertEquals(response.status_code, 200)
+        return response.content
+
+    def test_same_json_as_serializers(self):
+        urls = ['/api/v1/interest/', '/api/v1/stock-price/', '/api/v1/stock-price/?page=1', '/api/v1/stock-price/?recent=all',
+                '/api/v1/stock-price/?recent=tst1', '/api/v1/stock/', '/api/v1/stock/?page=1', '/api/v1/stock/?include=stock_prices']
+        for url in urls:
+            # Act
+            from_rows = self.get(url)
+            with mock.patch.object(RowListMixin, 'list_from_rows', return_value=False), \
+                 mock.patch.object(StockList, 'list_from_rows', return_value=False):
+                from_instances = self.get(url)
+
+            # Assert
+            self.assertEquals(from_rows, from_instances, url)
+
+    def test_same_json_without_orjson(self):
+        for url in ['/api/v1/stock-price/', '/api/v1/stock-price/?recent=all', '/api/v1/stock/', '/api/v1/suggestion/?date=2020-01-02']:
+            # Act
+            fast = self.get(url)
+            with mock.patch('api.renderers.orjson', None):
+                standard = self.get(url)
+
+            # Assert
+            self.assertEquals(fast, standard, url)
+
+    def test_rows_without_instances(self):
+        # Arrange
+        with mock.patch.object(StockPrice, 'from_db') as from_db:
+            # Act
+            self.get('/api/v1/stock-price/')
+
+        # Assert
+        from_db.assert_not_called()
+
+    def test_unsupported_fields(self):
+        # Act / Assert
+        with self.assertRaises(TypeError):
+            RowSerializer(StockWithPricesSerializer())
+
+class FastJSONRendererTestCase(SimpleTestCase):
+    """
+    Tests that FastJSONRenderer renders the same bytes as DRF's JSONRenderer
+    """
+    def assertSameJSON(self, data, accepted_media_type=None):
+        self.assertEquals(FastJSONRenderer().render(data, accepted_media_type), JSONRenderer().render(data, accepted_media_type), data)
+
+    def test_same_output(self):
+        # Arrange
+        values = [
+            None, True, 0, -1, 2 ** 63 - 1, 2 ** 64, 0.05, -1.25, 1234.5, '', 'plain', 'quote " backslash \\ slash / </script>',
+            'caf\u00e9 \u20ac \U0001f4c8', 'line\nseparator\u2028paragraph\u2029control\x01\x1f\x7f',
+            Decimal('1.50'), Decimal('-0.10'), Decimal('12345678.90'),
+            date(2020, 1, 6), datetime(2020, 1, 6, 9, 30), datetime(2020, 1, 6, 9, 30, 15, 123456),
+            datetime(2020, 1, 6, 9, 30, tzinfo=timezone.utc), datetime(2020, 1, 6, 9, 30, tzinfo=timezone(timedelta(hours=-5))),
+            time(9, 30, 15, 500), timedelta(days=1, seconds=30), uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            [], {}, (1, 'a'), {1: 'int key'}, OrderedDict([('b', 1), ('a', [OrderedDict([('c', Decimal('0.01'))])])]),
+        ]
+
+        # Act / Assert
+        for value in values:
+            self.assertSameJSON(value)
+        self.assertSameJSON({'results': values})
+        self.assertEquals(FastJSONRenderer().render(None), b'')
+
+    def test_indented_output(self):
+        # Act / Assert
+        self.assertSameJSON({'a': [1, 2]}, 'application/json; indent=4')
+
+    def test_without_orjson(self):
+        # Arrange
+        data = {'price': Decimal('1.50'), 'date': date(2020, 1, 6), 'text': 'caf\u00e9'}
+
+        # Act
+        with mock.patch('api.renderers.orjson', None):
+            rendered = FastJSONRenderer().render(data)
+
+        # Assert
+        self.assertEquals(rendered, JSONRenderer().render(data))
+
+    def test_floats_parse_to_same_values(self):
+        # Arrange
+        values = [1e-05, 2.5e-07, 1e16, -1.2345678901234568e+17, 0.30000000000000004]
+
+        # Act
+        rendered = FastJSONRenderer().render(values)
+
+        # Assert
+        self.assertEquals(json.loads(rendered), values)
+
+    @skipUnless(renderers.orjson, 'Requires orjson')
+    def test_non_finite_floats_are_null(self):
+        # Act
+        rendered = FastJSONRenderer().render({'values': [float('nan'), float('inf'), float('-inf'), 1.5]})
+
+        # Assert
+        self.assertEquals(rendered, b'{"values":[null,null,null,1.5]}')
+
+class AsgiTestCase(SimpleTestCase):
+    """
+    Tests serving the API through the ASGI application
+    """
+    @async_to_sync
+    async def request(self, path):
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'format=json',
+            'headers': [(b'host', b'localhost')],
+        })
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(5)
+        body = await communicator.receive_output(5)
+        return start, body
+
+    def test_get_api_root(self):
+        # Act
+        start, body = self.request('/api/v1/')
+
+        # Assert
+        self.assertEquals(start['status'], 200)
+        self.assertIn('stock-prices', json.loads(body['body']))
+
+class AsgiDatabaseTestCase(SimpleTestCase):
+    """
+    Tests concurrent requests that query the database through the ASGI application, on a pooled database file
+    """
+    databases = {'default'}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, 'asgi.sqlite3')
+        connections.databases['asgi'] = dict(connections.databases['default'], NAME=cls.path)
+        call_command('migrate', database='asgi', verbosity=0)
+        user = PCUser.objects.db_manager('asgi').create_user('asgi', password='1234')
+        cls.token = Token.objects.using('asgi').create(user=user).key
+        stock = Stock.objects.using('asgi').create(name='test', symbol='tst', category='testCat')
+        for day in range(1, 6):
+            StockPrice.objects.using('asgi').create(stock=stock, date=date(2020, 1, day), predicted_closing_price='1.00')
+        Interest.objects.using('asgi').create(interest='Tech')
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['asgi'].close()
+        del connections['asgi']
+        del connections.databases['asgi']
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    async def get(self, path, query_string=b''):
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string,
+            'headers': [(b'host', b'localhost'), (b'authorization', ('Token ' + self.token).encode())],
+        })
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(5)
+        body = b''
+        while True:
+            message = await communicator.receive_output(5)
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                return start['status'], body
+
+    def serve(self, *requests):
+        """
+        Sends the requests concurrently from a thread of their own, as a server would, on a pool of 3 connections.
+        Returns the (status, body) of each request and the stats of the pool.
+        """
+        results = []
+
+        @async_to_sync
+        async def send():
+            results.extend(await asyncio.gather(*(self.get(*request) for request in requests)))
+
+        settings = dict(NAME=self.path, CONN_MAX_AGE=0, POOL_SIZE=3, POOL_TIMEOUT=2)
+        with mock.patch.dict(connections.databases['default'], settings), mock.patch.dict(pools, clear=True):
+            token_cache.clear()
+            thread = threading.Thread(target=send)
+            thread.start()
+            thread.join()
+            stats = get_pool('default', connections.databases['default']).stats()
+        return results, stats
+
+    def test_connections_return_to_pool(self):
+        for round in range(3):
+            # Act
+            results, stats = self.serve(*[('/api/v1/interest/',)] * 8)
+
+            # Assert
+            self.assertEquals([status for status, body in results], [200] * 8)
+            self.assertEquals(stats['in_use'], 0)
+
+    def test_export(self):
+        # Act
+        results, stats = self.serve(('/api/v1/stock-price/export/', b'format=ndjson'), ('/api/v1/stock-price/export/', b'format=csv'))
+
+        # Assert
+        (ndjsonStatus, ndjson), (csvStatus, csvBody) = results
+        self.assertEquals(ndjsonStatus, 200)
+        self.assertEquals([json.loads(line)['date'] for line in ndjson.decode().splitlines()], ['2020-01-0%d' % day for day in range(1, 6)])
+        self.assertEquals(csvStatus, 200)
+        self.assertEquals(len(csvBody.decode().splitlines()), 6)
+        self.assertEquals(stats['in_use'], 0)
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    """
+    Tests the database connection pool and health checks
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'pool.sqlite3')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def connect(self):
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def wrapper(self, **settings):
+        return DatabaseWrapper(dict(connection.settings_dict, NAME=self.path, **settings), alias='pooltest')
+
+    def test_reuses_released_connection(self):
+        # Arrange
+        pool = ConnectionPool(size=2)
+        first = pool.acquire(self.connect)
+        pool.release(first)
+
+        # Act
+        second = pool.acquire(self.connect)
+
+        # Assert
+        self.assertIs(second, first)
+        self.assertEquals(pool.stats(), {'size': 2, 'open': 1, 'in_use': 1, 'idle': 0, 'created': 1, 'waits': 0, 'timeouts': 0, 'reconnects': 0})
+
+    def test_times_out_when_all_in_use(self):
+        # Arrange
+        pool = ConnectionPool(size=1, timeout=0.01)
+        pool.acquire(self.connect)
+
+        # Act / Assert
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(self.connect)
+        self.assertEquals(pool.stats()['waits'], 1)
+        self.assertEquals(pool.stats()['timeouts'], 1)
+
+    def test_waiting_thread_gets_released_connection(self):
+        # Arrange
+        pool = ConnectionPool(size=1, timeout=5)
+        first = pool.acquire(self.connect)
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(pool.acquire(self.connect)))
+        thread.start()
+
+        # Act
+        while not pool.stats()['waits']:
+            thread.join(0.001)
+        pool.release(first)
+        thread.join()
+
+        # Assert
+        self.assertEquals(acquired, [first])
+        self.assertEquals(pool.stats()['created'], 1)
+
+    def test_replaces_idle_connection_failing_health_check(self):
+        # Arrange
+        pool = ConnectionPool(size=1, health_checks=True)
+        first = pool.acquire(self.connect)
+        pool.release(first)
+        first.close()
+
+        # Act
+        second = pool.acquire(self.connect)
+
+        # Assert
+        self.assertIsNot(second, first)
+        self.assertTrue(ping(second))
+        self.assertEquals(pool.stats()['reconnects'], 1)
+        self.assertEquals(pool.stats()['open'], 1)
+
+    def test_disabled_pool_closes_released_connections(self):
+        # Arrange
+        pool = ConnectionPool(size=0)
+        first = pool.acquire(self.connect)
+        second = pool.acquire(self.connect)
+
+        # Act
+        pool.release(first)
+
+        # Assert
+        self.assertFalse(ping(first))
+        self.assertEquals(pool.stats()['open'], 1)
+        self.assertEquals(pool.stats()['in_use'], 1)
+
+    def test_request_gets_pooled_connection(self):
+        # Arrange
+        wrapper = self.wrapper(CONN_MAX_AGE=0, POOL_SIZE=1)
+        wrapper.ensure_connection()
+        first = wrapper.connection
+
+        # Act: the end of a request returns the connection, the next request takes it again
+        wrapper.close_if_unusable_or_obsolete()
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+        # Assert
+        self.assertIs(wrapper.connection, first)
+        self.assertEquals(wrapper.pool.stats()['created'], 1)
+        wrapper.close()
+
+    def test_persistent_connection_health_check(self):
+        # Arrange
+        wrapper = self.wrapper(CONN_MAX_AGE=None, CONN_HEALTH_CHECKS=True)
+        wrapper.ensure_connection()
+        first = wrapper.connection
+        first.close()
+
+        # Act
+        wrapper.close_if_unusable_or_obsolete()
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+        # Assert
+        self.assertIsNot(wrapper.connection, first)
+        self.assertEquals(wrapper.pool.stats()['reconnects'], 1)
+        wrapper.close()
+
+class MarketDataTestCase(SimpleTestCase):
+    """
+    Tests the synthetic market data and latency percentiles of the benchmarks
+    """
+    def test_same_seed_same_data(self):
+        # Act
+        first = list(market_data(3, 5, seed=1))
+        second = list(market_data(3, 5, seed=1))
+        other = list(market_data(3, 5, seed=2))
+
+        # Assert
+        self.assertEquals(first, second)
+        self.assertNotEqual(first, other)
+
+    def test_bars_are_consistent(self):
+        # Act
+        days = list(market_data(5, 10))
+
+        # Assert
+        dates = [prices[0]['date'] for prices in days]
+        self.assertEquals(len(set(dates)), 10)
+        self.assertTrue(all(day.weekday() < 5 for day in dates))
+        for prices in days:
+            self.assertEquals([price['stock'] for price in prices], ['S00000', 'S00001', 'S00002', 'S00003', 'S00004'])
+            for price in prices:
+                self.assertTrue(price['daily_low'] <= min(price['opening_price'], price['actual_closing_price']))
+                self.assertTrue(price['daily_high'] >= max(price['opening_price'], price['actual_closing_price']))
+                self.assertEquals(price['actual_closing_price'].as_tuple().exponent, -2)
+
+    def test_percentile(self):
+        # Arrange
+        values = list(range(100, 0, -1))
+
+        # Act / Assert
+        self.assertEquals(percentile(values, 0.5), 50)
+        self.assertEquals(percentile(values, 0.95), 95)
+        self.assertEquals(percentile(values, 0.99), 99)
+        self.assertEquals(percentile([7], 0.99), 7)
+
+class PartitionRangeTestCase(SimpleTestCase):
+    """
+    Tests the date ranges and names of stock price partitions
+    """
+    def test_month_and_year_ranges(self):
+        # Act / Assert
+        self.assertEquals(partition_range(date(2020, 2, 29), 'month'), (date(2020, 2, 1), date(2020, 3, 1)))
+        self.assertEquals(partition_range(date(2020, 12, 31), 'month'), (date(2020, 12, 1), date(2021, 1, 1)))
+        self.assertEquals(partition_range(date(2020, 6, 15), 'year'), (date(2020, 1, 1), date(2021, 1, 1)))
+        self.assertEquals(partition_name(date(2020, 1, 1), 'month'), 'api_stockprice_p2020_01')
+        self.assertEquals(partition_name(date(2020, 1, 1), 'year'), 'api_stockprice_p2020')
+
+    def test_bound_range(self):
+        # Act / Assert
+        self.assertEquals(bound_range("FOR VALUES FROM ('2020-01-01') TO ('2020-02-01')"), (date(2020, 1, 1), date(2020, 2, 1)))
+        self.assertIsNone(bound_range('DEFAULT'))
+
+    def test_missing_ranges(self):
+        # Arrange
+        current = partition_range(date.today(), 'month')
+        following = partition_range(current[1], 'month')
+        existing = [current, (date(2019, 1, 1), date(2019, 2, 1))]
+
+        # Act
+        missing = missing_ranges(existing, [date(2019, 1, 31), date(2019, 3, 4)], 'month', 1)
+
+        # Assert
+        self.assertEquals(missing, [(date(2019, 3, 1), date(2019, 4, 1)), following])
+
+class PartitionPricesTestCase(TestCase):
+    """
+    Tests the partition_prices command
+    """
+    def setUp(self):
+        self.stock = Stock.objects.create(name='test', symbol='tst', category='testCat')
+        StockPrice.objects.create(stock=self.stock, date='2020-01-02', predicted_closing_price='1.00')
+        StockPrice.objects.create(stock=self.stock, date='2020-02-03', predicted_closing_price='1.10')
+
+    @skipUnless(connection.vendor != 'postgresql', 'Checks the fallback of other databases')
+    def test_plain_table_on_other_databases(self):
+        # Arrange
+        stdout = StringIO()
+
+        # Act
+        call_command('partition_prices', stdout=stdout)
+
+        # Assert
+        self.assertIn('stays a plain table', stdout.getvalue())
+        self.assertFalse(is_partitioned())
+        self.assertEquals(ensure_partitions([date(2030, 1, 1)]), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Partitioning requires PostgreSQL')
+    def test_partitioned_table_keeps_working(self):
+        # Act
+        call_command('partition_prices', stdout=StringIO())
+
+        # Assert
+        self.assertTrue(is_partitioned())
+        self.assertEquals(list(StockPrice.objects.order_by('date').values_list('predicted_closing_price', flat=True)), [Decimal('1.00'), Decimal('1.10')])
+        price = StockPrice.objects.create(stock=self.stock, date='2020-02-04', predicted_closing_price='1.20')
+        self.assertEquals(StockPrice.objects.get(pk=price.pk).date, date(2020, 2, 4))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            StockPrice.objects.create(stock=self.stock, date='2020-02-04', predicted_closing_price='1.30')
+
+        # Only the partition of the date is read
+        plan = StockPrice.objects.filter(date='2020-02-03').explain()
+        self.assertIn('api_stockprice_p2020_02', plan)
+        self.assertNotIn('api_stockprice_p2020_01', plan)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Partitioning requires PostgreSQL')
+    def test_partitions_created_for_new_dates(self):
+        # Arrange
+        call_command('partition_prices', stdout=StringIO())
+        # A row written without a partition lands in the default partition
+        StockPrice.objects.create(stock=self.stock, date='2040-01-02', predicted_closing_price='1.00')
+
+        # Act
+        upsert_prices([{'stock': 'tst', 'date': date(2040, 1, 3), 'predicted_closing_price': Decimal('2.00')}])
+
+        # Assert
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM api_stockprice_p2040_01')
+            self.assertEquals(cursor.fetchone()[0], 2)
+            cursor.execute('SELECT count(*) FROM api_stockprice_default')
+            self.assertEquals(cursor.fetchone()[0], 0)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Partitioning requires PostgreSQL')
+    def test_upserts_on_partitioned_table(self):
+        # Arrange
+        call_command('partition_prices', '--interval', 'year', stdout=StringIO())
+        rows = [{'stock': 'tst', 'date': date(2020, 1, 2), 'predicted_closing_price': Decimal('2.00'), 'volume': 10},
+                {'stock': 'tst', 'date': date(2021, 6, 1), 'predicted_closing_price': Decimal('3.00')}]
+
+        # Act
+        copied = ingest.copy_prices(rows)
+        upserted = upsert_prices([dict(rows[0], predicted_closing_price=Decimal('2.50'))])
+
+        # Assert
+        self.assertEquals(copied, (1, 1))
+        self.assertEquals(upserted, (0, 1))
+        self.assertEquals(list(StockPrice.objects.order_by('date').values_list('date', 'predicted_closing_price', 'volume')), [
+            (date(2020, 1, 2), Decimal('2.50'), 10), (date(2020, 2, 3), Decimal('1.10'), None), (date(2021, 6, 1), Decimal('3.00'), None)])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM api_stockprice_p2021')
+            self.assertEquals(cursor.fetchone()[0], 1)
+
+class RequestTimingTestCase(TestCase):
+    """
+    Tests the Server-Timing header and JSON log line of the request timing middleware
+    """
+    def setUp(self):
+        stock = Stock.objects.create(name='a', symbol='tst1', category='testCat')
+        StockPrice.objects.create(stock=stock, date='2020-01-01', predicted_closing_price='1.00')
+        self.staff = PCUser.objects.create_user('staff', password='1234', is_staff=True)
+        self.regular = PCUser.objects.create_user('regular', password='1234')
+
+    def get(self, user, url='/api/v1/stock/'):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        token_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        return response, queries
+
+    @override_settings(REQUEST_TIMING_HEADER='staff')
+    def test_header_for_staff(self):
+        # Act
+        staffResponse, queries = self.get(self.staff)
+        regularResponse, regularQueries = self.get(self.regular)
+
+        # Assert
+        entries = [entry.split(';')[0] for entry in staffResponse['Server-Timing'].split(', ')]
+        self.assertEquals(entries, ['db', 'view', 'render', 'total'])
+        self.assertIn('db;desc="%d queries"' % len(queries), staffResponse['Server-Timing'])
+        self.assertFalse(regularResponse.has_header('Server-Timing'))
+
+    @override_settings(REQUEST_TIMING_HEADER='all')
+    def test_header_for_all(self):
+        # Act
+        response, queries = self.get(self.regular)
+
+        # Assert
+        self.assertTrue(response.has_header('Server-Timing'))
+
+    @override_settings(REQUEST_TIMING_HEADER='off', REQUEST_TIMING_LOG=True)
+    def test_json_log_line(self):
+        # Act
+        with self.assertLogs('api.timing', 'INFO') as logs:
+            response, queries = self.get(self.regular)
+
+        # Assert
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEquals(len(logs.records), 1)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEquals(line['method'], 'GET')
+        self.assertEquals(line['path'], '/api/v1/stock/')
+        self.assertEquals(line['view'], 'stock-list')
+        self.assertEquals(line['status'], 200)
+        self.assertEquals(line['user'], self.regular.pk)
+        self.assertEquals(line['db_queries'], len(queries))
+        self.assertEquals(line['bytes'], len(response.content))
+        self.assertTrue(line['total_ms'] >= line['view_ms'] + line['render_ms'])
+
+    @override_settings(REQUEST_TIMING_HEADER='off', REQUEST_TIMING_LOG=False, REQUEST_METRICS=False)
+    def test_not_used_when_disabled(self):
+        # Act / Assert
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestTimingMiddleware(lambda request: None)
+
+class MetricsTestCase(TestCase):
+    """
+    Tests the Prometheus metrics endpoint and what is recorded in it
+    """
+    def setUp(self):
+        Stock.objects.create(name='a', symbol='tst1', category='testCat')
+        self.user = PCUser.objects.create_user('regular', password='1234')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        token_cache.clear()
+
+    def value(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_records_requests_by_url_name(self):
+        # Arrange
+        requests = self.value('api_requests_total', view='stock-list', method='GET', status='200')
+        observed = self.value('api_request_duration_seconds_count', view='stock-list')
+        queries = self.value('api_db_queries_total', view='stock-list')
+
+        # Act
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get('/api/v1/stock/')
+        # Read the count before the next request resets the connection's query log
+        count = len(captured)
+        self.client.get('/no-such-page/')
+
+        # Assert
+        self.assertEquals(self.value('api_requests_total', view='stock-list', method='GET', status='200'), requests + 1)
+        self.assertEquals(self.value('api_request_duration_seconds_count', view='stock-list'), observed + 1)
+        self.assertEquals(self.value('api_db_queries_total', view='stock-list'), queries + count)
+        self.assertTrue(self.value('api_requests_total', view='<unmatched>', method='GET', status='404') >= 1)
+
+    def test_counts_cache_lookups(self):
+        # Arrange
+        hits = self.value('api_cache_lookups_total', cache='token', result='hit')
+        misses = self.value('api_cache_lookups_total', cache='token', result='miss')
+
+        # Act
+        self.client.get('/api/v1/stock/')
+        self.client.get('/api/v1/stock/')
+
+        # Assert
+        self.assertEquals(self.value('api_cache_lookups_total', cache='token', result='miss'), misses + 1)
+        self.assertEquals(self.value('api_cache_lookups_total', cache='token', result='hit'), hits + 1)
+
+    def test_metrics_endpoint(self):
+        # Act
+        self.client.get('/api/v1/stock/')
+        response = APIClient().get('/metrics')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'api_requests_total{method="GET",status="200",view="stock-list"}', response.content)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        # Act
+        missing = APIClient().get('/metrics')
+        wrong = APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer wrong')
+        right = APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+
+        # Assert
+        self.assertEquals(missing.status_code, 403)
+        self.assertEquals(wrong.status_code, 403)
+        self.assertEquals(right.status_code, 200)
+
+    def test_metrics_are_internal_without_token(self):
+        # Act
+        internalResponse = APIClient().get('/metrics', REMOTE_ADDR='172.18.0.5')
+        proxied = APIClient().get('/metrics', REMOTE_ADDR='172.18.0.3', HTTP_X_FORWARDED_FOR='8.8.8.8')
+        public = APIClient().get('/metrics', REMOTE_ADDR='8.8.8.8')
+
+        # Assert
+        self.assertEquals(internalResponse.status_code, 200)
+        self.assertEquals(proxied.status_code, 403)
+        self.assertEquals(public.status_code, 403)
+
+    def test_adds_up_worker_processes(self):
+        # Arrange: two processes record through a shared directory, as gunicorn workers do
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(2):
+                subprocess.run([sys.executable, '-c', 'from api import metrics; metrics.TOKEN_CACHE_HITS.inc(3)'],
+                               cwd=os.path.dirname(os.path.dirname(__file__)), env=dict(os.environ, prometheus_multiproc_dir=directory), check=True)
+
+            # Act
+            with mock.patch.dict(os.environ, {'prometheus_multiproc_dir': directory}):
+                body, content_type = latest()
+
+        # Assert
+        self.assertIn(b'api_cache_lookups_total{cache="token",result="hit"} 6.0', body)
+
+@skipUnless(connection.vendor == 'sqlite', 'Uses an SQLite database file as the replica')
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_ROUTERS=['api.routers.ReplicaRouter'], REPLICA_STICKY_SECONDS=60)
+class ReplicaRouterTestCase(TestCase):
+    """
+    Tests routing reads to a read replica, with a second SQLite database standing in for the replica
+    """
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.databases['replica'] = dict(connections.databases['default'], NAME=os.path.join(cls.directory.name, 'replica.sqlite3'))
+        call_command('migrate', database='replica', verbosity=0)
+        super().setUpClass()
+        # Added after the test case checked the databases it may use, as queries to it must fail like to a server that is down
+        connections.databases['replica_down'] = dict(connections.databases['default'], NAME=os.path.join(cls.directory.name, 'missing', 'replica.sqlite3'))
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in ['replica_down', 'replica']:
+            if alias == 'replica':
+                super().tearDownClass()
+            connections[alias].close()
+            del connections[alias]
+            del connections.databases[alias]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        unavailable.clear()
+        caches['default'].clear()
+        # The same users and tokens on both databases, as replication would have them
+        for alias in ['default', 'replica']:
+            for name in ['first', 'second']:
+                user = PCUser.objects.db_manager(alias).create_superuser(name, name + '@example.com', '1234')
+                Token.objects.using(alias).create(user=user, key=(name * 10)[:40])
+        self.tokens = [('first' * 10)[:40], ('second' * 10)[:40]]
+        token_cache.clear()
+
+        Stock.objects.create(name='primary', symbol='prim', category='testCat')
+        Stock.objects.using('replica').create(name='replica', symbol='repl', category='testCat')
+
+    def client_for(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        return client
+
+    def symbols(self, client):
+        response = client.get('/api/v1/stock/')
+        self.assertEquals(response.status_code, 200)
+        return [stock['symbol'] for stock in response.data['results']]
+
+    def test_reads_outside_requests_use_primary(self):
+        # Act / Assert
+        self.assertEquals(Stock.objects.all().db, 'default')
+        with read_from_replicas():
+            self.assertEquals(Stock.objects.all().db, 'replica')
+            self.assertEquals(router.db_for_write(Stock), 'default')
+
+    def test_safe_request_reads_replica(self):
+        # Act / Assert
+        self.assertEquals(self.symbols(self.client_for(self.tokens[0])), ['repl'])
+
+    def test_read_your_writes(self):
+        # Arrange
+        writer = self.client_for(self.tokens[0])
+        other = self.client_for(self.tokens[1])
+
+        # Act
+        response = writer.post('/api/v1/stock-price/bulk/', [{'stock': 'prim', 'date': '2020-01-01', 'predicted_closing_price': '1.00'}], format='json')
+
+        # Assert
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['created'], 1)
+        self.assertEquals(StockPrice.objects.using('replica').count(), 0)
+        self.assertEquals(self.symbols(writer), ['prim'])
+        self.assertEquals(self.symbols(other), ['repl'])
+
+    def test_login_then_read(self):
+        # Arrange
+        for alias in ['default', 'replica']:
+            PCUser.objects.db_manager(alias).create_user('third', password='1234')
+
+        # Act
+        token = APIClient().post('/api/v1/rest-auth/login/', {'username': 'third', 'password': '1234'}).data['key']
+        response = self.client_for(token).get('/api/v1/stock/')
+
+        # Assert
+        self.assertFalse(Token.objects.using('replica').filter(key=token).exists())
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([stock['symbol'] for stock in response.data['results']], ['repl'])
+
+    def test_cache_fills_from_replica_keep_their_version(self):
+        # Arrange
+        writer = self.client_for(self.tokens[0])
+        other = self.client_for(self.tokens[1])
+        writer.post('/api/v1/stock-price/bulk/', [{'stock': 'prim', 'date': '2020-01-01', 'predicted_closing_price': '1.00'}], format='json')
+
+        # Act
+        # The replica has not replicated the write yet
+        otherResponse = other.get('/api/v1/stock-price/?recent=prim')
+        writerResponse = writer.get('/api/v1/stock-price/?recent=prim')
+
+        # Assert
+        self.assertEquals(otherResponse.data['results'], [])
+        self.assertEquals(writerResponse['X-Cache'], 'MISS')
+        self.assertEquals([price['date'] for price in writerResponse.data['results']], ['2020-01-01'])
+
+    def test_session_login_pins_new_session(self):
+        # Arrange
+        # Sessions are not replicated in this test, like a session the replica has not received yet
+        loginResponse = self.client.post('/admin/login/', {'username': 'first', 'password': '1234', 'next': '/admin/'})
+
+        # Act
+        response = self.client.get('/admin/')
+
+        # Assert
+        self.assertEquals(loginResponse.status_code, 302)
+        self.assertEquals(response.status_code, 200)
+
+    def test_export_streams_from_replica(self):
+        # Arrange
+        StockPrice.objects.using('replica').create(stock_id='repl', date='2020-01-01', predicted_closing_price='1.00')
+
+        # Act
+        response = self.client_for(self.tokens[0]).get('/api/v1/stock-price/export/?format=ndjson')
+
+        # Assert
+        self.assertEquals([json.loads(line)['stock'] for line in b''.join(response.streaming_content).decode().splitlines()], ['repl'])
+
+    def test_local_pins_are_reported(self):
+        # Act / Assert
+        self.assertEquals([warning.id for warning in check_primary_pins(None)], ['api.W001'])
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEquals(check_primary_pins(None), [])
+
+    @override_settings(DATABASE_REPLICAS=['replica_down', 'replica'])
+    def test_skips_replica_that_is_down(self):
+        # Act
+        symbols = [self.symbols(self.client_for(self.tokens[0])) for i in range(3)]
+
+        # Assert
+        self.assertEquals(symbols, [['repl'], ['repl'], ['repl']])
+        self.assertIn('replica_down', unavailable)
+
+    @override_settings(DATABASE_REPLICAS=['replica_down'])
+    def test_falls_back_to_primary(self):
+        # Act / Assert
+        self.assertEquals(self.symbols(self.client_for(self.tokens[0])), ['prim'])
@@ -12,6 +12,12 @@ urlpatterns = [
     path('stock-price/', 
          views.StockPriceList.as_view(), 
          name='stock-price-list'), 
+    path('stock-price/bulk/', 
+         views.StockPriceBulk.as_view(), 
+         name='stock-price-bulk'), 
+    path('stock-price/export/', 
+         views.StockPriceExport.as_view(), 
+         name='stock-price-export'), 
     path('stock-price/<int:pk>', 
          views.StockPriceDetail.as_view(), 
          name='stock-price-detail'), 
@@ -21,9 +27,15 @@ urlpatterns = [
     path('stock/<str:pk>', 
          views.StockDetail.as_view(), 
          name='stock-detail'),
+    path('stock/<str:symbol>/prices', 
+         views.stock_price_history, 
+         name='stock-price-history'),
     path('suggestion/', 
          views.suggestion_list, 
          name='suggestion-list'),
+    path('suggestion/personal/', 
+         views.personal_suggestion_list, 
+         name='suggestion-personal'),
     
     url(r'^rest-auth/', include('rest_auth.urls')),
     url(r'^rest-auth/registration/', include('rest_auth.registration.urls')),
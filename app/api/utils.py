@@ -1,3 +1,6 @@
+from decimal import Decimal
+
+import numpy as np
 
 def stock_suggestions(prices, prices_before, sellThreshold = -0.05, buyThreshold = 0.05):
     """
@@ -14,29 +17,81 @@ def stock_suggestions(prices, prices_before, sellThreshold = -0.05, buyThreshold
     sellThreshold - A percent value as a decimal.
     buyThreshold - A percent value as a decimal.
     """
-    suggestions = []
+    prices = list(prices)
+    prices_before = list(prices_before)
     if (len(prices) != len(prices_before)):
         return None
 
-    for i in range(len(prices)):
-        stockSymbol = prices[i].stock.symbol
+    # stock_id is the stock's symbol, so reading it does not load the related Stock
+    rows = [(price.stock_id, price.predicted_closing_price, before.actual_closing_price) for price, before in zip(prices, prices_before)]
+    return suggestions_from_rows(rows, sellThreshold, buyThreshold)
+
+def suggestions_from_rows(rows, sellThreshold = -0.05, buyThreshold = 0.05):
+    """
+    Same algorithm as stock_suggestions, for rows that are already paired by stock.
+    Either price may be None (e.g. the stock has no price on the previous day), in which case the suggestion is 'unknown'.
+    Returns a list of {'stock', 'action', 'percent_change'} dicts; percent_change is a float, or None when unknown.
+
+    rows - An iterable of (symbol, predicted_closing_price, previous actual_closing_price) tuples
+    sellThreshold - A percent value as a decimal.
+    buyThreshold - A percent value as a decimal.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+
+    symbols, predicted_closes, previous_closes = zip(*rows)
+    actions, changes = batch_suggestions(previous_closes, predicted_closes, sellThreshold, buyThreshold)
 
-        # Make sure there is data in both fields
-        if prices[i].predicted_closing_price == None or prices_before[i].actual_closing_price == None:
-            suggestions.append({'stock': stockSymbol, 'action': 'unknown', 'percent_change': None})
-            continue
+    return [{'stock': symbol, 'action': action, 'percent_change': None if action == 'unknown' else change}
+            for symbol, action, change in zip(symbols, actions.tolist(), changes.tolist())]
 
-        # Calculate percent change between previous day's actual closing and today's predicted
-        before_closing = prices_before[i].actual_closing_price
-        predicted_closing = prices[i].predicted_closing_price
-        percentchange = (predicted_closing - before_closing) / before_closing
+def batch_suggestions(previous_closes, predicted_closes, sellThreshold = -0.05, buyThreshold = 0.05):
+    """
+    Vectorized suggestion engine. Computes the percent change and the suggested action for every stock in one pass.
+    Returns an array of actions ('buy', 'sell', 'hold' or 'unknown') and a float array of percent changes (NaN when unknown).
+    Null prices, and a previous close of zero, are masked out and suggested as 'unknown'.
 
-        if percentchange > buyThreshold:
-            action = 'buy'
-        elif percentchange < sellThreshold:
-            action = 'sell'
-        else:
-            action = 'hold'
+    Actions match exact decimal arithmetic: prices are compared as integer cents, and the few changes that land
+    within float rounding of a threshold are settled with Decimal.
 
-        suggestions.append({'stock': stockSymbol, 'action': action, 'percent_change': percentchange})
-    return suggestions
+    previous_closes - A sequence of previous actual closing prices (Decimal, float, str or None)
+    predicted_closes - A sequence of predicted closing prices, related to previous_closes by index
+    sellThreshold - A percent value as a decimal.
+    buyThreshold - A percent value as a decimal.
+    """
+    before, before_missing = to_cents(previous_closes)
+    predicted, predicted_missing = to_cents(predicted_closes)
+    unknown = before_missing | predicted_missing | (before == 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        changes = (predicted - before) / before
+    changes[unknown] = np.nan
+
+    actions = np.full(len(changes), 'hold', dtype=object)
+    actions[changes > buyThreshold] = 'buy'
+    actions[changes < sellThreshold] = 'sell'
+    actions[unknown] = 'unknown'
+
+    # Settle changes within float rounding of a threshold exactly, the same way Decimal arithmetic would
+    for threshold in (sellThreshold, buyThreshold):
+        for i in np.flatnonzero(np.abs(changes - threshold) <= 1e-9):
+            change = Decimal(int(predicted[i] - before[i])) / Decimal(int(before[i]))
+            if change > buyThreshold:
+                actions[i] = 'buy'
+            elif change < sellThreshold:
+                actions[i] = 'sell'
+            else:
+                actions[i] = 'hold'
+
+    return actions, changes
+
+def to_cents(prices):
+    """
+    Converts a sequence of prices with two decimal places to an int64 array of cents and a boolean mask of the nulls.
+    Nulls may be None or NaN; masked entries are 0 in the returned array.
+    """
+    values = np.fromiter([np.nan if price is None else price for price in prices], dtype=float, count=len(prices))
+    missing = np.isnan(values)
+    values[missing] = 0
+    return np.rint(values * 100).astype(np.int64), missing
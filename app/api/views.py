@@ -1,23 +1,93 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
 from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.settings import api_settings
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 
-from .forms import SuggestionDateForm
-from .models import Interest, StockPrice, Stock, PCUser
-from .serializers import InterestSerializer, StockPriceSerializer, StockSerializer
-from .utils import stock_suggestions
+from .columnar import PRICE_COLUMNS, price_columns
+from .cache import ConditionalGetMixin, cache_response, conditional_response, data_version, interest_symbols, response_cache
+from .export import csv_stream, export_rows, ndjson_stream, spool
+from .forms import PersonalSuggestionForm, PriceExportForm, PriceHistoryForm, SuggestionDateForm
+from .ingest import sync_derived_tables, upsert_prices
+from .metrics import internal, latest
+from .models import Interest, StockPrice, Stock, PCUser, Suggestion, TradingDay
+from .pagination import KeysetOrPageNumberPagination
+from .parsers import NDJSONParser
+from .permissions import DjangoModelUpsertPermissions
+from .renderers import CSVRenderer, FastJSONRenderer, MsgpackRenderer, NDJSONRenderer
+from .serializers import (InterestSerializer, PriceBarSerializer, StockPriceBulkSerializer, StockPriceSerializer, StockSerializer,
+                          StockWithPricesSerializer, row_serializer)
 
-class InterestList(generics.ListAPIView):
+class RowListMixin:
+    """
+    Lists a generic API view from database rows with the RowSerializer of its serializer class (see api.serializers),
+    which gives the same data without building model instances. Named rows have the attributes the paginators read.
+    """
+    def list_from_rows(self):
+        return True
+
+    def list(self, request, *args, **kwargs):
+        if not self.list_from_rows():
+            return super().list(request, *args, **kwargs)
+
+        serializer = row_serializer(self.get_serializer_class())
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*serializer.columns, named=True)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(queryset))
+
+class InterestList(RowListMixin, generics.ListAPIView):
     queryset = Interest.objects.all()
     serializer_class = InterestSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 # List all stock prices; Create reserved for users with special permissions set
-class StockPriceList(generics.ListCreateAPIView):
+class StockPriceList(ConditionalGetMixin, RowListMixin, generics.ListCreateAPIView):
     queryset = StockPrice.objects.all()
     serializer_class = StockPriceSerializer
     permission_classes = [permissions.IsAuthenticated, permissions.DjangoModelPermissions]
+    pagination_class = KeysetOrPageNumberPagination
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [MsgpackRenderer]
+
+    @property
+    def keyset_ordering(self):
+        # The recent views have their own ordering and are small, so they keep page numbers
+        if 'recent' in self.request.query_params:
+            return None
+        return ('date', 'id')
+
+    def list(self, request, *args, **kwargs):
+        if isinstance(request.accepted_renderer, MsgpackRenderer):
+            build = lambda: self.list_columns(request)
+        else:
+            build = lambda: super(StockPriceList, self).list(request, *args, **kwargs)
+
+        # The recent views return the same data to every user between data loads, so their responses are cached
+        if 'recent' in request.query_params:
+            return response_cache.fetch(request, build)
+        return build()
+
+    def list_columns(self, request):
+        """
+        Lists prices in the columnar layout of api.columnar, built straight from database rows without model instances
+        or the serializer. Named rows have the attributes the paginators read.
+        """
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*PRICE_COLUMNS, named=True)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(price_columns(page))
+        return Response(price_columns(queryset))
 
     def get_queryset(self):
         queryset = StockPrice.objects.all()
@@ -25,13 +95,8 @@ class StockPriceList(generics.ListCreateAPIView):
 
         if stock is not None:
             if stock == 'all':
-                # Gets a list of dates for all stock prices
-                all_dates = list(StockPrice.objects.values('date').distinct().order_by('-date'))
-
-                # Get a list of the five most recent dates for stock prices
-                recent_dates = []
-                for i in range(min(len(all_dates), 5)):
-                    recent_dates.append(all_dates[i]['date'])
+                # The five most recent dates for stock prices, as a subquery so the queryset stays lazy
+                recent_dates = TradingDay.objects.order_by('-date').values('date')[:5]
 
                 # Gets the stock prices for all stocks on the five most recent price dates.
                 # Orders them by stock, ascending, and then date, descending. Prices from the same stock are "grouped" together.
@@ -44,50 +109,198 @@ class StockPriceList(generics.ListCreateAPIView):
 
         return queryset
 
+# Create or update many stock prices at once, keyed on (stock, date); reserved for users with add and change permissions
+class StockPriceBulk(generics.GenericAPIView):
+    queryset = StockPrice.objects.all()
+    serializer_class = StockPriceBulkSerializer
+    permission_classes = [permissions.IsAuthenticated, DjangoModelUpsertPermissions]
+    parser_classes = [JSONParser, NDJSONParser]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Accepts a JSON array or NDJSON body of stock prices.
+        Valid rows are written and invalid rows are reported by their index in the body.
+        """
+        if not isinstance(request.data, list):
+            return Response({'detail': 'Expected a list of stock prices.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate the fields of every row, reusing a single serializer
+        serializer = self.get_serializer()
+        rows = []
+        errors = []
+        for index, data in enumerate(request.data):
+            try:
+                rows.append((index, serializer.run_validation(data)))
+            except ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+
+        # Check that all stocks exist with one query
+        symbols = {row['stock'] for index, row in rows}
+        known = set(Stock.objects.filter(symbol__in=symbols).values_list('symbol', flat=True))
+        for index, row in rows:
+            if row['stock'] not in known:
+                errors.append({'index': index, 'errors': {'stock': ['Invalid pk "%s" - object does not exist.' % row['stock']]}})
+        rows = [row for index, row in rows if row['stock'] in known]
+
+        if not rows:
+            return Response({'created': 0, 'updated': 0, 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            created, updated = upsert_prices(rows)
+            sync_derived_tables({row['date'] for row in rows})
+
+        errors.sort(key=lambda error: error['index'])
+        return Response({'created': created, 'updated': updated, 'errors': errors})
+
+# Stream the price history, optionally filtered by symbols and a date range, as NDJSON (default) or CSV
+class StockPriceExport(generics.GenericAPIView):
+    queryset = StockPrice.objects.all()
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+
+    streams = {'ndjson': ndjson_stream, 'csv': csv_stream}
+
+    def get(self, request, *args, **kwargs):
+        """
+        Streams the prices ordered by stock and date. Choose the format with the Accept header or '?format=ndjson|csv',
+        and filter with '?symbols=A,B&start=YYYY-MM-DD&end=YYYY-MM-DD'.
+        """
+        form = PriceExportForm(request.query_params)
+        if not form.is_valid():
+            return Response(form.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = StockPrice.objects.order_by('stock', 'date')
+        if form.cleaned_data['symbols']:
+            queryset = queryset.filter(stock__in=form.cleaned_data['symbols'])
+        if form.cleaned_data['start']:
+            queryset = queryset.filter(date__gte=form.cleaned_data['start'])
+        if form.cleaned_data['end']:
+            queryset = queryset.filter(date__lte=form.cleaned_data['end'])
+
+        renderer = request.accepted_renderer
+        stream = self.streams[renderer.format](export_rows(queryset))
+        content_type = '%s; charset=%s' % (renderer.media_type, renderer.charset)
+        # The ASGI handler streams the response in the event loop, where the rows could not be queried
+        if isinstance(request._request, ASGIRequest):
+            response = FileResponse(spool(stream, renderer.charset), content_type=content_type)
+        else:
+            response = StreamingHttpResponse(stream, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="stock-prices.%s"' % renderer.format
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Errors are not price rows, so they are rendered as JSON whatever format was requested
+        if isinstance(response, Response) and response.status_code >= 400:
+            request.accepted_renderer = FastJSONRenderer()
+            request.accepted_media_type = FastJSONRenderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
+
 # View individual stock prices; Update reserved for users with special permissions set
 class StockPriceDetail(generics.RetrieveUpdateAPIView):
     queryset = StockPrice.objects.all()
     serializer_class = StockPriceSerializer
     permission_classes = [permissions.IsAuthenticated, permissions.DjangoModelPermissions]
 
+# Stocks are read with a summary of their prices; the full list of price ids is included only with '?include=stock_prices'
+class StockViewMixin:
+    def include_stock_prices(self):
+        return 'stock_prices' in self.request.query_params.get('include', '').split(',')
+
+    def get_queryset(self):
+        queryset = Stock.objects.with_price_summary()
+        if self.include_stock_prices():
+            queryset = queryset.prefetch_related(Prefetch('stock_prices', queryset=StockPrice.objects.only('id', 'stock_id')))
+        return queryset
+
+    def get_serializer_class(self):
+        if self.include_stock_prices():
+            return StockWithPricesSerializer
+        return StockSerializer
+
 # List all stocks; Create reserved for users with special permissions set
-class StockList(generics.ListCreateAPIView):
+class StockList(ConditionalGetMixin, StockViewMixin, RowListMixin, generics.ListCreateAPIView):
     queryset = Stock.objects.all()
     serializer_class = StockSerializer
     permission_classes = [permissions.IsAuthenticated, permissions.DjangoModelPermissions]
+    pagination_class = KeysetOrPageNumberPagination
+    keyset_ordering = ('symbol',)
+
+    def list_from_rows(self):
+        # The price ids are prefetched per stock, which rows can't hold
+        return not self.include_stock_prices()
 
 # View individual stocks; Update and destroy reserved for users with special permissions set
-class StockDetail(generics.RetrieveUpdateDestroyAPIView):
+class StockDetail(ConditionalGetMixin, StockViewMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Stock.objects.all()
     serializer_class = StockSerializer
     permission_classes = [permissions.IsAuthenticated, permissions.DjangoModelPermissions]
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@conditional_response
+@cache_response
 def suggestion_list(request):
     """
     List all suggestions for the authenticated user.
     """
     form = SuggestionDateForm(request.GET)
     if form.is_valid():
-        stock_prices_today = StockPrice.objects.filter(date=form.cleaned_data['date']).order_by('stock__symbol')
-        stock_prices_before = []
+        # Suggestions are precomputed when prices change, see api.models.Suggestion
+        suggestions = [{'stock': stock, 'action': action, 'percent_change': percent_change}
+                       for stock, action, percent_change in Suggestion.objects.filter(date=form.cleaned_data['date'])
+                       .order_by('stock_id').values_list('stock_id', 'action', 'percent_change')]
 
-        # Iterate over all dates with price data (sorted in descending order)
-        all_dates = list(StockPrice.objects.values('date').distinct().order_by('-date'))
-        for i in range(len(all_dates)):
+        # There are no suggestions for dates without price data, or without price data on a previous day
+        if suggestions:
+            return Response({'suggestions': suggestions})
+        
+    return Response(status=status.HTTP_400_BAD_REQUEST)
 
-            # Make sure that there is another date in the list, then check if the current date in all_dates matches the form data
-            if i < len(all_dates) - 1 and (all_dates[i]['date'] == form.cleaned_data['date']):
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def personal_suggestion_list(request):
+    """
+    List the suggestions for the stocks in the authenticated user's interests, ranked by percent change, highest first.
+    With '?limit=N', only the N strongest buys and the N strongest sells.
+    """
+    form = PersonalSuggestionForm(request.GET)
+    if not form.is_valid():
+        return Response(form.errors, status=status.HTTP_400_BAD_REQUEST)
 
-                # Get the stock prices from the previous day
-                stock_prices_before = StockPrice.objects.filter(date=all_dates[i+1]['date']).order_by('stock__symbol')
+    symbols = interest_symbols(request.user.interests.values_list('id', flat=True), data_version(request))
+    suggestions = Suggestion.objects.filter(date=form.cleaned_data['date'], stock_id__in=symbols).values_list('stock_id', 'action', 'percent_change')
 
-        # If there were prices found for a previous day, calculate and return the suggestions
-        if stock_prices_before != []:
-            return Response({'suggestions': stock_suggestions(stock_prices_today, stock_prices_before)})
-        
-    return Response(status=status.HTTP_400_BAD_REQUEST)
+    limit = form.cleaned_data['limit']
+    if limit is None:
+        rows = suggestions.order_by(F('percent_change').desc(nulls_last=True), 'stock_id')
+    else:
+        # Buys and sells always have a percent change
+        rows = (list(suggestions.filter(action='buy').order_by('-percent_change', 'stock_id')[:limit])
+                + list(suggestions.filter(action='sell').order_by('percent_change', 'stock_id')[:limit]))
+        rows.sort(key=lambda row: (-row[2], row[0]))
+
+    return Response({'suggestions': [{'stock': stock, 'action': action, 'percent_change': percent_change} for stock, action, percent_change in rows]})
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@conditional_response
+def stock_price_history(request, symbol, format=None):
+    """
+    List a stock's prices in [start, end] as bars of one day, week or month, aggregated by the database.
+    """
+    stock = get_object_or_404(Stock.objects.only('symbol'), symbol=symbol)
+    form = PriceHistoryForm(request.GET)
+    if not form.is_valid():
+        return Response(form.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    prices = StockPrice.objects.filter(stock=stock)
+    if form.cleaned_data['start']:
+        prices = prices.filter(date__gte=form.cleaned_data['start'])
+    if form.cleaned_data['end']:
+        prices = prices.filter(date__lte=form.cleaned_data['end'])
+
+    bars = prices.bars(form.cleaned_data['interval'])
+    return Response({'stock': stock.symbol, 'interval': form.cleaned_data['interval'], 'bars': PriceBarSerializer(bars, many=True).data})
 
 @api_view(['GET'])
 def api_root(request, format=None):
@@ -99,6 +312,25 @@ def api_root(request, format=None):
         'registration': request.build_absolute_uri(request.get_full_path() + 'rest-auth/registration/'),
         'interests': reverse('interest-list', request=request, format=format),
         'stock-prices': reverse('stock-price-list', request=request, format=format),
+        'stock-prices-bulk': reverse('stock-price-bulk', request=request, format=format),
+        'stock-prices-export': reverse('stock-price-export', request=request, format=format),
         'stocks': reverse('stock-list', request=request, format=format),
         'suggestions': reverse('suggestion-list', request=request, format=format),
-        })
\ No newline at end of file
+        'personal-suggestions': reverse('suggestion-personal', request=request, format=format),
+        })
+
+@require_GET
+def metrics(request):
+    """
+    Prometheus metrics of all workers (see api.metrics).
+    If settings.METRICS_TOKEN is set, scrapers must send it as 'Authorization: Bearer <token>'; otherwise only
+    internal scrapers are served.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        if not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token):
+            return HttpResponseForbidden()
+    elif not internal(request):
+        return HttpResponseForbidden()
+    body, content_type = latest()
+    return HttpResponse(body, content_type=content_type)
@@ -0,0 +1,21 @@
+"""
+gunicorn settings, read from the working directory by both the WSGI and the ASGI (uvicorn worker) deployments.
+"""
+import os
+import shutil
+import tempfile
+
+# Workers write their Prometheus metrics to files in this directory, which /metrics adds up (see api.metrics).
+# It must be set before prometheus_client is first imported, which happens in the workers.
+os.environ.setdefault('prometheus_multiproc_dir', os.path.join(tempfile.gettempdir(), 'api-metrics'))
+
+def on_starting(server):
+    # Start from empty metrics, not those of a previous run
+    path = os.environ['prometheus_multiproc_dir']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+def child_exit(server, worker):
+    # Drop the gauges of the worker, e.g. after it was restarted
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)